@@ -0,0 +1,156 @@
+from collections import OrderedDict
+from disk_simulator import DEFAULT_GROUP
+from paths import PathError, ResolvedPath
+
+# Permission checks for the shell.
+# Every inode has an owner (uid), a group (gid) and rwx permissions for the
+# owner, the group and everyone else, like [7, 5, 5]. A session acts as one user
+# with a list of groups; the superuser passes every check. Reaching a path needs
+# execute permission on every directory above it, which would cost an inode
+# lookup per component on every command. Decisions are cached per session
+# instead and re-checked against the drive's access generation, which the drive
+# bumps whenever an owner, group or permission may have changed (chmod, chown,
+# rewrites, deletes, renames, rollbacks).
+
+READ, WRITE, EXECUTE = 4, 2, 1
+SUPERUSER = "root"
+DEFAULT_USER = "user"       # Session user at startup, and owner of files created before users existed
+ACCESS_CACHE_SIZE = 4096    # Cached decisions kept before the least recently used are dropped
+
+
+class AccessDenied(PathError):
+    """A path the session's user isn't allowed to use; the message is shown to the user as is."""
+
+
+def permission_string(permissions: list[int]) -> str:
+    """Format rwx triplets like [7, 5, 0] as "rwxr-x---"."""
+    return "".join(("r" if bits & READ else "-") + ("w" if bits & WRITE else "-") + ("x" if bits & EXECUTE else "-") for bits in permissions)
+
+
+def parse_mode(mode: str) -> list[int] | None:
+    """Parse an octal mode like "755" into rwx triplets, or None if it isn't one."""
+    if len(mode) != 3 or any(c not in "01234567" for c in mode):
+        return None
+    return [int(c) for c in mode]
+
+
+class AccessChecker:
+    """
+    The session's user and groups, and a bounded LRU cache of the decisions made
+    for them: the rwx bits they have on an inode, and whether they can reach
+    everything inside a directory. Switching user clears the cache.
+    """
+    def __init__(self, user: str = DEFAULT_USER, groups: list[str] | None = None, size: int = ACCESS_CACHE_SIZE) -> None:
+        self.size = size
+        self.cache: OrderedDict[tuple, tuple] = OrderedDict()  # Key -> (drive access generation, decision)
+        self.hits = 0
+        self.misses = 0
+        self.switch(user, groups)
+
+    def switch(self, user: str, groups: list[str] | None = None) -> None:
+        """Act as another user. Their first group is the one given to files they create."""
+        self.user = user
+        self.groups = list(dict.fromkeys(groups or [DEFAULT_GROUP]))
+        self.cache.clear()
+
+    @property
+    def group(self) -> str:
+        return self.groups[0]
+
+    def is_superuser(self) -> bool:
+        return self.user == SUPERUSER
+
+    def _cached(self, key: tuple, drive, compute):
+        """Return the cached decision for key if the drive's access generation still matches, else compute and cache it."""
+        entry = self.cache.get(key)
+        if entry is not None and entry[0] == drive.access_generation:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return entry[1]
+        self.misses += 1
+        decision = compute()
+        self.cache[key] = (drive.access_generation, decision)
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+        return decision
+
+    def bits(self, drive, inode_index: int) -> int:
+        """The rwx bits the session has on an inode."""
+        if self.is_superuser():
+            return READ | WRITE | EXECUTE
+        def compute() -> int:
+            inode = drive.get_inode(inode_index)
+            owner, group, other = inode["permissions"]
+            if inode["uid"] == self.user:
+                return owner
+            if inode.get("gid") in self.groups:
+                return group
+            return other
+        return self._cached((drive, inode_index), drive, compute)
+
+    def allowed(self, drive, inode_index: int, want: int) -> bool:
+        return self.bits(drive, inode_index) & want == want
+
+    def require(self, drive, inode_index: int, want: int, display: str) -> None:
+        """Raise AccessDenied unless the session has the wanted bits on an inode."""
+        if not self.allowed(drive, inode_index, want):
+            raise AccessDenied(f"Error: Permission denied: '{display}'.")
+
+    def _search(self, resolved: ResolvedPath) -> tuple[str | None, int | None]:
+        """
+        Walk the directories above resolved: (the first one the session can't
+        search or None, the inode of the directory holding resolved or None if
+        a directory on the way doesn't exist).
+        """
+        drive, directories = resolved.drive, resolved.components[:-1]
+        key = (drive, directories)
+        entry = self.cache.get(key)
+        if entry is not None and entry[0] == drive.access_generation:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return entry[1]
+        directory = 0
+        for depth in range(len(directories) + 1):
+            if not self.allowed(drive, directory, EXECUTE):
+                decision = (f"{resolved.letter}:/" + "/".join(directories[:depth]), None)
+                break
+            if depth == len(directories):
+                decision = (None, directory)
+                break
+            directory = drive.list_directory(directory).get(directories[depth])
+            if directory is None or drive.get_inode(directory)["file_type"].lower() != "directory":
+                return None, None  # Left for the command to report; not cached, the directory may be created
+        # Renames and deletes bump the access generation, so the parent's inode is cached along with the decision
+        return self._cached(key, drive, lambda: decision)
+
+    def check(self, resolved: ResolvedPath, target: int = 0, parent: int = 0) -> None:
+        """
+        Raise AccessDenied unless the session can search every directory above
+        resolved, has the target bits on resolved itself (if it exists) and the
+        parent bits on the directory holding it.
+        """
+        if self.is_superuser():
+            return
+        denied, parent_index = self._search(resolved)
+        if denied is not None:
+            raise AccessDenied(f"Error: Permission denied: '{denied}'.")
+        if target and resolved.inode is not None:
+            self.require(resolved.drive, resolved.inode, target, resolved.display)
+        if parent and not resolved.is_root() and parent_index is not None:
+            self.require(resolved.drive, parent_index, parent, f"{resolved.letter}:{resolved.parent_path}")
+
+    def check_tree(self, drive, inode_index: int, directories: int, files: int, letter: str) -> None:
+        """Raise AccessDenied unless the session has the given bits on every directory and file in a subtree (for rm -r, cp -r)."""
+        if self.is_superuser():
+            return
+        is_directory = drive.get_inode(inode_index)["file_type"].lower() == "directory"
+        want = directories if is_directory else files
+        if want:
+            self.require(drive, inode_index, want, f"{letter}:{drive.path_of(inode_index)}")
+        if is_directory:
+            for child in drive.list_directory(inode_index).values():
+                self.check_tree(drive, child, directories, files, letter)
+
+    def stats(self) -> dict:
+        return {"entries": len(self.cache), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,758 @@
+import argparse
+import random
+import shutil
+import string
+import time
+from disk_simulator import *
+from paths import *
+from access import *
+
+# Benchmarks for the disk simulator.
+# Run with: python benchmark.py <benchmark> [options]   (python benchmark.py -h for the list)
+
+WORDS = ["block", "inode", "bitmap", "extent", "drive", "mount", "sector", "cache", "journal", "superblock", "directory", "file"]
+
+def make_payload(workload: str, size: int, rng: random.Random) -> str:
+    """Generate file content for a benchmark workload."""
+    if workload == "text":
+        # Natural-language-like text from a small vocabulary (compresses well)
+        words = []
+        while sum(len(w) + 1 for w in words) < size:
+            words.append(rng.choice(WORDS))
+        return " ".join(words)[:size]
+    if workload == "json":
+        # Repetitive structured records
+        records = []
+        while sum(len(r) for r in records) < size:
+            records.append('{"id": %d, "name": "%s", "size": %d},' % (rng.randint(0, 9999), rng.choice(WORDS), rng.randint(0, 4096)))
+        return "".join(records)[:size]
+    # Random printable characters (effectively incompressible)
+    return "".join(rng.choice(string.ascii_letters + string.digits) for _ in range(size))
+
+def make_drive(data_blocks: int, inode_count: int, groups: int = 1, **options) -> Drive:
+    """Create an in-memory drive with room for the given number of data blocks and inodes."""
+    inode_blocks = math.ceil(inode_count / groups / (4096 // INODE_SIZE)) * groups
+    return Drive("BENCH", data_blocks + inode_blocks + 3, inode_count=inode_count, groups=groups, **options)
+
+def simulated_ms(drive: Drive) -> float:
+    """Simulated I/O time charged to a drive's timing model so far, in milliseconds."""
+    return drive.device.elapsed * 1000 if drive.device is not None else 0.0
+
+def bench_compression(args) -> None:
+    """Compare CPU cost against blocks and image bytes saved for each compression algorithm."""
+    data_blocks = args.files * math.ceil(args.file_size / CHAR_BLOCK_SIZE)
+    print(f"Compression benchmark: {args.files} files x {args.file_size} chars per workload")
+    print(f"{'Workload':<10} {'Algorithm':<10} {'Write CPU ms':>12} {'Read CPU ms':>12} {'Sim I/O ms':>11} {'Blocks':>8} {'Saved':>7} {'Image bytes':>12}")
+    print("-" * 89)
+    for workload in ["text", "json", "random"]:
+        rng = random.Random(args.seed)
+        payloads = [make_payload(workload, args.file_size, rng) for _ in range(args.files)]
+        baseline_blocks = None
+        for algorithm in COMPRESSION_ALGORITHMS:
+            drive = make_drive(data_blocks, args.files + 1, compression=algorithm, device=args.device)
+            start = time.process_time()
+            for i, payload in enumerate(payloads):
+                inode = Inode(f"/file{i}", "File", 0, [], "bench", 0, [7,7,7], [])
+                drive.write_inode(payload, inode, drive.find_free_inode())
+            write_cpu = time.process_time() - start
+
+            start = time.process_time()
+            for i in range(1, args.files + 1):
+                assert drive.load_inode(i) == payloads[i - 1]
+            read_cpu = time.process_time() - start
+
+            blocks = drive.usage()["blocks_used"]
+            if baseline_blocks is None:
+                baseline_blocks = blocks
+            saved = 1 - blocks / baseline_blocks if baseline_blocks else 0
+            image_bytes = len(encode_drive(drive))
+            print(f"{workload:<10} {algorithm:<10} {write_cpu * 1000:>12.1f} {read_cpu * 1000:>12.1f} {simulated_ms(drive):>11.1f} {blocks:>8} {saved:>6.0%} {image_bytes:>12}")
+
+def bench_inline(args) -> None:
+    """Compare block usage and write time for a small-file workload with and without inline data."""
+    rng = random.Random(args.seed)
+    sizes = [rng.randint(1, 2 * INLINE_DATA_MAX) for _ in range(args.files)]
+    payloads = [make_payload("text", size, rng) for size in sizes]
+    data_blocks = sum(math.ceil(size / CHAR_BLOCK_SIZE) for size in sizes)
+    inline_files = sum(1 for size in sizes if size <= INLINE_DATA_MAX)
+    print(f"Inline data benchmark: {args.files} files of 1-{2 * INLINE_DATA_MAX} chars ({inline_files} fit in the inode)")
+    print(f"{'Mode':<10} {'Write ms':>10} {'Sim I/O ms':>11} {'Blocks':>8} {'Extents':>8}")
+    print("-" * 51)
+    for inline in [False, True]:
+        drive = make_drive(data_blocks, args.files + 1, inline_data=inline, device=args.device)
+        start = time.perf_counter()
+        for i, payload in enumerate(payloads):
+            inode = Inode(f"/file{i}", "File", 0, [], "bench", 0, [7,7,7], [])
+            drive.write_inode(payload, inode, drive.find_free_inode())
+        elapsed = time.perf_counter() - start
+        blocks = drive.usage()["blocks_used"]
+        extents = sum(len(inode["pointers"]) for i, inode in drive.used_inodes())
+        print(f"{'inline' if inline else 'blocks':<10} {elapsed * 1000:>10.1f} {simulated_ms(drive):>11.1f} {blocks:>8} {extents:>8}")
+
+def bench_groups(args) -> None:
+    """Compare read locality of a flat layout against block groups when directories are filled concurrently."""
+    rng = random.Random(args.seed)
+    directories = args.groups
+    payloads = [make_payload("text", args.file_size, rng) for _ in range(args.files)]
+    data_blocks = args.files * math.ceil(args.file_size / CHAR_BLOCK_SIZE)
+    data_blocks += -data_blocks % directories  # Whole groups
+    print(f"Block group benchmark: {args.files} files x {args.file_size} chars written round-robin into {directories} directories")
+    print(f"{'Layout':<12} {'Write ms':>10} {'Sim read ms':>12} {'Seeks':>8} {'Distance':>10} {'Per file':>10}")
+    print("-" * 67)
+    for groups in [1, directories]:
+        drive = make_drive(data_blocks, args.files + directories + 1, groups=groups, device=args.device)
+        dirs = []
+        for d in range(directories):
+            index = drive.find_free_inode(0, directory=True)
+            drive.write_inode("", Inode(f"dir{d}", "Directory", 0, [], "bench", 0, [7,7,7], [], None, 0), index)
+            dirs.append(index)
+        start = time.perf_counter()
+        for i, payload in enumerate(payloads):
+            parent = dirs[i % directories]  # Interleave writes like several programs saving at once
+            inode = Inode(f"file{i}", "File", 0, [], "bench", 0, [7,7,7], [], None, parent)
+            drive.write_inode(payload, inode, drive.find_free_inode(parent))
+        elapsed = time.perf_counter() - start
+
+        # Read every file back directory by directory, as seek_distance models it
+        if drive.device is not None:
+            drive.device.reset()
+        stack = [0]
+        while stack:
+            for name, child in sorted(drive.list_directory(stack.pop()).items(), reverse=True):
+                if drive.get_inode(child)["file_type"].lower() == "directory":
+                    stack.append(child)
+                else:
+                    drive.load_inode(child)
+        stats = drive.seek_distance()
+        layout = "flat" if groups == 1 else f"{groups} groups"
+        print(f"{layout:<12} {elapsed * 1000:>10.1f} {simulated_ms(drive):>12.1f} {stats['seeks']:>8} {stats['distance']:>10} {stats['distance'] / stats['files']:>10.1f}")
+
+def bench_schedulers(args) -> None:
+    """Compare I/O schedulers on several readers working through files scattered across a drive at once."""
+    rng = random.Random(args.seed)
+    payloads = [make_payload("text", args.file_size, rng) for _ in range(args.files)]
+    data_blocks = args.files * math.ceil(args.file_size / CHAR_BLOCK_SIZE)
+    drive = make_drive(2 * data_blocks, args.files + 1, device=args.device if args.device != "none" else "hdd")
+    for i, payload in enumerate(payloads):
+        inode = Inode(f"file{i}", "File", 0, [], "bench", 0, [7,7,7], [], None, 0)
+        drive.write_inode(payload, inode, drive.find_free_inode())
+    # Delete every other file and rewrite it larger so files end up in fragmented extents
+    for i in range(1, args.files + 1, 2):
+        drive.delete_inode(i)
+    for i in range(1, args.files + 1, 2):
+        inode = Inode(f"file{i - 1}", "File", 0, [], "bench", 0, [7,7,7], [], None, 0)
+        drive.write_inode(payloads[i - 1] * 2, inode, i)
+
+    # Several readers at once, each working through its own share of the files in random order
+    readers = []
+    for r in range(args.groups):
+        share = list(range(1 + r, args.files + 1, args.groups))
+        rng.shuffle(share)
+        readers.append(share)
+    streams = drive.trace_io([lambda share=share: [drive.load_inode(i) for i in share] for share in readers])
+    superblock = drive.block_list[0]
+    print(f"Scheduler benchmark: {args.groups} concurrent readers over {args.files} files, {sum(len(stream) for stream in streams)} block requests on {drive.device.name}")
+    print(f"{'Scheduler':<10} {'Head movement':>14} {'Sim ms':>10} {'MB/s':>8} {'Mean wait ms':>13} {'Max wait ms':>12}")
+    print("-" * 72)
+    for scheduler in SCHEDULERS:
+        device = make_device(drive.device.name, superblock["block_size"], superblock["total_blocks"])
+        stats = run_queue(device, streams, scheduler, superblock["total_blocks"] - 1)
+        throughput = stats["requests"] * superblock["block_size"] / stats["elapsed"] / (1024 * 1024)
+        print(f"{scheduler:<10} {stats['head_movement']:>14} {stats['elapsed'] * 1000:>10.1f} {throughput:>8.2f} {stats['mean_wait'] * 1000:>13.2f} {stats['max_wait'] * 1000:>12.2f}")
+
+def bench_bitmaps(args) -> None:
+    """Time bitmap-heavy operations on a large, mostly full drive with list and NumPy bitmaps."""
+    numpy = load_numpy()
+    if numpy is None:
+        print("NumPy is not installed; only the list bitmaps can be measured.")
+    fill = int(args.blocks * 0.9)
+    payload = "x" * (fill * CHAR_BLOCK_SIZE)
+    print(f"Bitmap benchmark: {args.blocks} data blocks, {fill} in use (times in ms)")
+    print(f"{'Bitmaps':<8} {'Create':>9} {'Alloc x10':>10} {'Free inode':>11} {'Usage':>8} {'Delete':>9}")
+    print("-" * 60)
+    for vectorised in [False, True]:
+        if vectorised and numpy is None:
+            break
+        start = time.perf_counter()
+        drive = make_drive(args.blocks, args.files + 1, vectorised=vectorised)
+        create = time.perf_counter() - start
+        drive.write_inode(payload, Inode("big", "File", 0, [], "bench", 0, [7,7,7], [], None, 0), drive.find_free_inode())
+        for i in range(args.files - 1):
+            drive.write_inode("", Inode(f"empty{i}", "File", 0, [], "bench", 0, [7,7,7], [], None, 0), drive.find_free_inode())
+
+        start = time.perf_counter()
+        for _ in range(10):
+            drive.find_free_data_blocks(1000)  # Free space starts 90% of the way in
+        alloc = time.perf_counter() - start
+        start = time.perf_counter()
+        drive.find_free_inode()
+        free_inode = time.perf_counter() - start
+        start = time.perf_counter()
+        drive.usage()
+        drive.dedup_stats()
+        usage = time.perf_counter() - start
+        start = time.perf_counter()
+        drive.delete_inode(1)
+        delete = time.perf_counter() - start
+        print(f"{'numpy' if vectorised else 'list':<8} {create * 1000:>9.1f} {alloc * 1000:>10.1f} {free_inode * 1000:>11.2f} {usage * 1000:>8.1f} {delete * 1000:>9.1f}")
+
+def bench_raid(args) -> None:
+    """Compare simulated write and read throughput of a single drive against storage pools of each RAID level."""
+    rng = random.Random(args.seed)
+    payloads = [make_payload("text", args.file_size, rng) for _ in range(args.files)]
+    total_blocks = make_drive(args.files * math.ceil(args.file_size / CHAR_BLOCK_SIZE), args.files + 1).block_list[0]["total_blocks"]
+    device = args.device if args.device != "none" else "hdd"
+    layouts = [("single", 1, False), ("raid0", 2, False), ("raid0", 4, False), ("raid1", 2, False), ("raid1", 3, False),
+               ("raid5", 3, False), ("raid5", 4, False), ("raid5", 4, True)]
+    print(f"RAID benchmark: {args.files} files x {args.file_size} chars on {device} members")
+    print(f"{'Layout':<18} {'Write MB/s':>11} {'Read MB/s':>10} {'Read speedup':>13} {'Stored blocks':>14}")
+    print("-" * 70)
+    baseline = None
+    for level, members, degraded in layouts:
+        if level == "single":
+            drive = Drive("BENCH", total_blocks, inode_count=args.files + 1, device=device)
+        else:
+            drive = create_pool("BENCH", level, members, total_blocks, inode_count=args.files + 1, device=device)
+        drive.device.reset()
+        for i, payload in enumerate(payloads):
+            inode = Inode(f"file{i}", "File", 0, [], "bench", 0, [7,7,7], [], None, 0)
+            drive.write_inode(payload, inode, drive.find_free_inode())
+        write_rate = drive.device.writes * drive.device.block_size / drive.device.elapsed / (1024 * 1024)
+
+        if degraded:
+            drive.block_list.fail(1)
+        drive.device.reset()
+        for i in range(1, args.files + 1):
+            assert drive.load_inode(i) == payloads[i - 1]
+        read_rate = drive.device.reads * drive.device.block_size / drive.device.elapsed / (1024 * 1024)
+        if baseline is None:
+            baseline = read_rate
+        stored = PooledBlockList.member_size(level, members, total_blocks) * members if level != "single" else total_blocks
+        layout = "single" if level == "single" else f"{level} x{members}" + (" degraded" if degraded else "")
+        print(f"{layout:<18} {write_rate:>11.2f} {read_rate:>10.2f} {read_rate / baseline:>12.2f}x {stored:>14}")
+
+def bench_churn(args) -> None:
+    """Compare fragmentation of files that grow by repeated rewrites under immediate, preallocated and delayed allocation."""
+    rng = random.Random(args.seed)
+    rounds = 8
+    payloads = [make_payload("text", args.file_size, rng) for _ in range(args.files)]
+    data_blocks = args.files * math.ceil(args.file_size / CHAR_BLOCK_SIZE) * 3 // 2
+    final_blocks = math.ceil(args.file_size / CHAR_BLOCK_SIZE)
+    print(f"Churn benchmark: {args.files} files growing to {args.file_size} chars over {rounds} rounds of interleaved rewrites")
+    print(f"{'Allocation':<22} {'Write ms':>9} {'Sim write ms':>13} {'Sim read ms':>12} {'Extents/file':>13} {'Max':>5}")
+    print("-" * 79)
+    for mode in ["immediate", "fallocate", "delalloc, sync/round", "delalloc"]:
+        drive = make_drive(data_blocks, args.files + 1, device=args.device, delalloc=mode.startswith("delalloc"))
+        files = []
+        for i in range(args.files):
+            index = drive.find_free_inode()
+            inode = Inode(f"file{i}", "File", 0, [], "bench", 0, [7,7,7], [], None, 0)
+            if mode == "fallocate":
+                inode.preallocated = final_blocks  # The final size is known up front
+            drive.write_inode("", inode, index)
+            files.append(index)
+        start = time.perf_counter()
+        for r in range(1, rounds + 1):
+            for i, index in enumerate(files):
+                inode = Inode(f"file{i}", "File", 0, [], "bench", 0, [7,7,7], [], None, 0)
+                drive.write_inode(payloads[i][:args.file_size * r // rounds], inode, index)
+            if mode == "delalloc, sync/round":
+                drive.flush()
+        drive.flush()
+        elapsed = time.perf_counter() - start
+        write_ms = simulated_ms(drive)
+
+        if drive.device is not None:
+            drive.device.reset()
+        for i, index in enumerate(files):
+            assert drive.load_inode(index) == payloads[i]
+        extents = [len(drive.get_inode(index)["pointers"]) for index in files]
+        print(f"{mode:<22} {elapsed * 1000:>9.1f} {write_ms:>13.1f} {simulated_ms(drive):>12.1f} {sum(extents) / len(extents):>13.2f} {max(extents):>5}")
+
+def bench_inodes(args) -> None:
+    """Show create latency staying flat as a drive fills with files, growing its inode table as it goes."""
+    drive = make_drive(args.inodes // (4096 // INODE_SIZE) * 2 + 1024, 64, inline_data=True, device="none")
+    checkpoints = [n for n in (1_000, 10_000, 100_000, 1_000_000, 10_000_000) if n < args.inodes] + [args.inodes]
+    scan_limit = min(args.inodes, 20_000)  # Rescanning from inode 0 is quadratic; stop comparing there
+    print(f"Inode allocation benchmark: {args.inodes} files created on a drive formatted with 64 inodes")
+    print(f"{'Files':>10} {'Create us':>10} {'Rescan us':>10} {'Reuse us':>9} {'Table runs':>11} {'Inodes':>10}")
+    print("-" * 65)
+    created = 0
+    for checkpoint in checkpoints:
+        batch = checkpoint - created
+        start = time.perf_counter()
+        for n in range(created, checkpoint):
+            drive.write_inode("x", Inode(f"f{n}", "File", 0, [], "bench", 0, [7,7,7], [], None, 0), drive.find_free_inode(0))
+        create = (time.perf_counter() - start) / batch
+        created = checkpoint
+
+        # The same allocation done the old way, scanning the bitmap from inode 0 every time
+        rescan = "-"
+        if checkpoint <= scan_limit:
+            start = time.perf_counter()
+            for _ in range(100):
+                drive._reset_inode_allocator()
+                drive.find_free_inode(0)
+            rescan = f"{(time.perf_counter() - start) / 100 * 1_000_000:.1f}"
+
+        # Delete a spread of files and create them again: freed inodes come back from the free heap
+        victims = list(range(1, checkpoint, max(1, checkpoint // 100)))
+        for i in victims:
+            drive.delete_inode(i)
+        start = time.perf_counter()
+        for i in victims:
+            drive.write_inode("y", Inode(f"r{i}", "File", 0, [], "bench", 0, [7,7,7], [], None, 0), drive.find_free_inode(0))
+        reuse = (time.perf_counter() - start) / len(victims)
+        runs = len(drive.block_list[0].get("inode_extents", [])) + 1
+        print(f"{checkpoint:>10} {create * 1_000_000:>10.1f} {rescan:>10} {reuse * 1_000_000:>9.1f} {runs:>11} {drive.usage()['inodes_total']:>10}")
+
+def bench_paths(args) -> None:
+    """Resolve a shell-like stream of paths with and without the path cache, creating a file now and then."""
+    rng = random.Random(args.seed)
+    drive = make_drive(1024, args.files * 8 + 64, inline_data=True, device="none")
+    directories = [()]
+    for n in range(args.files * 4):
+        parent = rng.choice(directories)
+        if len(parent) < 8:
+            directories.append(parent + (f"{rng.choice(WORDS)}{n}",))
+            drive.write_inode("", Inode(directories[-1][-1], "Directory", 0, [], "bench", 0, [7,7,7], [], None, drive.find_components(parent)), drive.find_free_inode(0))
+    # Absolute, relative and dotted inputs, typed repeatedly as they would be while completing and re-running commands
+    inputs = []
+    for components in rng.sample(directories[1:], min(200, len(directories) - 1)):
+        inputs += ["C:/" + "/".join(components), "/".join(components[1:]) or ".", "../" + "/".join(components[1:]) + "/./"]
+    stream = [rng.choice(inputs) for _ in range(50_000)]
+
+    print(f"Path resolution benchmark: {len(stream)} lookups of {len(inputs)} distinct paths, {len(directories)} directories, a new file every 100 lookups")
+    print(f"{'Resolver':<10} {'Total ms':>9} {'us/lookup':>10} {'Hit rate':>9}")
+    print("-" * 41)
+    for label, size in (("uncached", 0), ("cached", PATH_CACHE_SIZE)):
+        resolver = PathResolver({"C": drive}, {"drive": "C", "path": "/" + "/".join(directories[1][:1])}, size)
+        start = time.perf_counter()
+        for n, path in enumerate(stream):
+            resolver.resolve(path)
+            if n % 100 == 0:  # Namespace change: cached inodes are re-checked, normalised paths are kept
+                drive.write_inode("x", Inode(f"{label}{n}", "File", 1, [], "bench", 0, [7,7,7], [], None, 0), drive.find_free_inode(0))
+        elapsed = time.perf_counter() - start
+        stats = resolver.stats()
+        print(f"{label:<10} {elapsed * 1000:>9.1f} {elapsed / len(stream) * 1_000_000:>10.2f} {stats['hits'] / len(stream):>8.0%}")
+
+def bench_completion(args) -> None:
+    """Time Tab completion in one large directory: scanning its entries vs the sorted name index."""
+    rng = random.Random(args.seed)
+    drive = make_drive(args.entries // (4096 // INODE_SIZE) * 2 + 1024, 64, inline_data=True, device="none")
+    names = []
+    for n in range(args.entries):
+        names.append(f"{rng.choice(WORDS)}_{n:07d}{rng.choice(['.txt', '.json', ''])}")
+        kind = "Directory" if n % 10 == 0 else "File"
+        drive.write_inode("" if kind == "Directory" else "x", Inode(names[-1], kind, 0, [], "bench", 0, [7,7,7], [], None, 0), drive.find_free_inode(0))
+
+    def scan(prefix: str, file_type: str | None) -> list[str]:
+        # What completion did before the name index: check every entry in the directory
+        return [name for name, child in drive.list_directory(0).items()
+                if name.startswith(prefix) and (file_type is None or drive.get_inode(child)["file_type"].lower() == file_type)]
+
+    start = time.perf_counter()
+    drive.complete_names(0, "")
+    build = time.perf_counter() - start
+    print(f"Completion benchmark: {args.entries} entries in one directory (name index built in {build * 1000:.1f} ms on first Tab)")
+    print(f"{'Typed':<18} {'Type':<10} {'Matches':>8} {'Scan ms':>9} {'Index ms':>9}")
+    print("-" * 58)
+    sample = rng.choice(names)
+    queries = [(sample[:len(sample) // 2], None), (sample[:len(sample) - 2], "file"), (sample[:3], "directory"),
+               (sample[:3].upper(), None), (sample[0] + sample[-6:-3], "file")]
+    for prefix, file_type in queries:
+        timings = []
+        for complete in (scan, lambda p, t: drive.complete_names(0, p, t)):
+            start = time.perf_counter()
+            for _ in range(10):
+                matches = complete(prefix, file_type)
+            timings.append((time.perf_counter() - start) / 10)
+        print(f"{prefix:<18} {file_type or 'any':<10} {len(matches):>8} {timings[0] * 1000:>9.3f} {timings[1] * 1000:>9.3f}")
+
+def bench_startup(args) -> None:
+    """Time launching the shell for one-shot batch commands with a drive bay full of images, and the work it defers."""
+    import statistics
+    import subprocess
+    import sys
+    import tempfile
+    main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    with tempfile.TemporaryDirectory() as bay:
+        cwd = os.getcwd()
+        os.chdir(bay)
+        try:
+            image = make_drive(16_384, 256, device="none")
+            image.write_inode("x" * 4096, Inode("data", "File", 0, [], "bench", 0, [7,7,7], [], None, 0), image.find_free_inode())
+            save_drive(image, "IMG0.json")
+            for n in range(1, args.files):
+                shutil.copy(os.path.join(SAVE_PATH, "IMG0.json"), os.path.join(SAVE_PATH, f"IMG{n}.json"))
+            bay_mb = sum(os.path.getsize(os.path.join(SAVE_PATH, f)) for f in os.listdir(SAVE_PATH)) / (1024 * 1024)
+        finally:
+            os.chdir(cwd)
+
+        print(f"Startup benchmark: {args.files} images of 16384 blocks ({bay_mb:.1f} MB) in drive_bay, median of 5 launches")
+        print(f"{'Batch':<28} {'Wall ms':>9}")
+        print("-" * 38)
+        for label, commands in (("(empty)", ""), ("lsblk -a", "lsblk -a\n"), ("mount one image + cat", "mount -p D IMG0\ncat D:/data\n")):
+            times = []
+            for _ in range(5):
+                start = time.perf_counter()
+                subprocess.run([sys.executable, main_py, "--batch"], input=commands, cwd=bay, capture_output=True, text=True, check=True)
+                times.append(time.perf_counter() - start)
+            print(f"{label:<28} {statistics.median(times) * 1000:>9.1f}")
+
+    # Work the shell no longer does before its first command
+    import main
+    start = time.perf_counter()
+    factories = [getattr(main.MyApp, name) for name in dir(main.MyApp) if name.endswith("_parser") and not name.startswith("_")]
+    parsers = [factory() for factory in factories if callable(factory)]
+    built = time.perf_counter()
+    Drive("A", 64), Drive("B", 128)
+    drives = time.perf_counter()
+    numpy = subprocess.run([sys.executable, "-c", "import time; t = time.perf_counter(); import numpy; print(time.perf_counter() - t)"], capture_output=True, text=True)
+    print("Deferred until first use:")
+    print(f"  {len(parsers)} command parsers     {(built - start) * 1000:>7.1f} ms")
+    print(f"  sample drives A and B  {(drives - built) * 1000:>7.1f} ms")
+    if numpy.returncode == 0:
+        print(f"  numpy import           {float(numpy.stdout) * 1000:>7.1f} ms")
+
+def bench_durability(args) -> None:
+    """Time saving a drive image at each durability level, against the old unsafe in-place write."""
+    import statistics
+    import tempfile
+    import disk_simulator
+    drive = make_drive(4096, 128, device="none")
+    rng = random.Random(args.seed)
+    for n in range(args.files):
+        drive.write_inode(make_payload("text", args.file_size, rng), Inode(f"f{n}", "File", 0, [], "bench", 0, [7,7,7], [], None, 0), drive.find_free_inode())
+    image_kb = len(encode_drive(drive)) / 1024
+    saves = 30
+
+    def in_place() -> None:
+        with open(os.path.join(SAVE_PATH, "D.json"), "w") as f:
+            f.write(encode_drive(drive))
+
+    with tempfile.TemporaryDirectory() as bay:
+        cwd = os.getcwd()
+        os.chdir(bay)
+        try:
+            save_drive(drive, "D.json")
+            print(f"Durability benchmark: {args.files} files of {args.file_size} chars ({image_kb:.0f} KB image), median of {saves} saves")
+            print(f"{'Level':<22} {'Save ms':>9} {'Slowest ms':>11} {'Syncs':>6}")
+            print("-" * 51)
+            for level in ["in place (old)"] + DURABILITY_LEVELS:
+                if level in DURABILITY_LEVELS:
+                    set_durability(level)
+                    disk_simulator._last_sync = 0.0
+                times, syncs = [], 0
+                for _ in range(saves):
+                    synced = disk_simulator._last_sync
+                    start = time.perf_counter()
+                    in_place() if level not in DURABILITY_LEVELS else save_drive(drive, "D.json")
+                    times.append(time.perf_counter() - start)
+                    syncs += level == "commit" or disk_simulator._last_sync != synced
+                start = time.perf_counter()
+                sync_drives()  # What exiting the shell pays at the periodic level
+                leftover = time.perf_counter() - start
+                print(f"{level:<22} {statistics.median(times) * 1000:>9.3f} {max(times) * 1000:>11.3f} {syncs:>6}"
+                      + (f"   (final sync {leftover * 1000:.3f} ms)" if level == "periodic" else ""))
+        finally:
+            set_durability("commit")
+            os.chdir(cwd)
+
+def bench_writeback(args) -> None:
+    """Time write commands in the shell with synchronous saves and with the background write-back thread."""
+    import io
+    import statistics
+    import tempfile
+    import main
+    rng = random.Random(args.seed)
+    payloads = [make_payload("text", args.file_size, rng) for _ in range(args.files)]
+    with tempfile.TemporaryDirectory() as bay:
+        cwd = os.getcwd()
+        os.chdir(bay)
+        try:
+            print(f"Write-back benchmark: {args.files} write commands of {args.file_size} chars on a 16384-block drive")
+            print(f"{'Saving':<16} {'Median ms':>10} {'Max ms':>9} {'Image writes':>13} {'Unmount ms':>14}")
+            print("-" * 66)
+            for mode in ("synchronous", "write-back"):
+                app = main.MyApp()
+                app.stdout, app.quiet = io.StringIO(), True  # Command output and I/O feedback aren't part of the measurement
+                app.onecmd_plus_hooks(f"mkdrive -b 16384 -i 256 --device none W{mode[0].upper()}")
+                app.onecmd_plus_hooks(f"mount -p Q W{mode[0].upper()}")
+                if mode == "write-back":
+                    start_write_back()
+                times = []
+                for n, payload in enumerate(payloads):
+                    start = time.perf_counter()
+                    app.onecmd_plus_hooks(f'write Q:/f{n % 10}.txt "{payload}"')
+                    times.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                app.onecmd_plus_hooks("unmount Q")  # Writes what write-back still holds
+                final = time.perf_counter() - start
+                stats = write_back_stats()
+                stop_write_back()
+                writes = stats["writes"] if stats is not None else len(payloads)
+                print(f"{mode:<16} {statistics.median(times) * 1000:>10.3f} {max(times) * 1000:>9.3f} {writes:>13} {final * 1000:>14.3f}")
+        finally:
+            os.chdir(cwd)
+
+def bench_images(args) -> None:
+    """Image size and save/load time for the pretty and compact image formats."""
+    import tempfile
+    import disk_simulator
+    drive = make_drive(args.blocks, 1024, device="none")
+    rng = random.Random(args.seed)
+    for n in range(args.files):
+        drive.write_inode(make_payload("text", args.file_size, rng), Inode(f"f{n}", "File", 0, [], "bench", 0, [7,7,7], [], None, 0), drive.find_free_inode())
+    formats = [("pretty", "pretty", False), ("compact", "compact", False)]
+    if load_orjson() is not None:
+        formats.append(("compact + orjson", "compact", True))
+    orjson_module = disk_simulator.orjson
+
+    with tempfile.TemporaryDirectory() as bay:
+        cwd = os.getcwd()
+        os.chdir(bay)
+        try:
+            print(f"Image benchmark: {args.blocks} data blocks, {args.files} files of {args.file_size} chars")
+            print(f"{'Format':<18} {'Image KB':>10} {'Save ms':>9} {'Load ms':>9}")
+            print("-" * 49)
+            set_durability("none")  # Measure encoding, not the disk
+            for label, image_format, use_orjson in formats:
+                disk_simulator.orjson = orjson_module if use_orjson else None
+                disk_simulator._orjson_checked = True
+                set_image_format(image_format)
+                start = time.perf_counter()
+                save_drive(drive, "I.json")
+                saved = time.perf_counter()
+                loaded = load_drive("I.json")
+                finished = time.perf_counter()
+                assert loaded.block_list[0]["total_blocks"] == drive.block_list[0]["total_blocks"]
+                size = os.path.getsize(os.path.join(SAVE_PATH, "I.json")) / 1024
+                print(f"{label:<18} {size:>10.0f} {(saved - start) * 1000:>9.1f} {(finished - saved) * 1000:>9.1f}")
+        finally:
+            disk_simulator.orjson = orjson_module
+            set_image_format("compact")
+            set_durability("commit")
+            os.chdir(cwd)
+
+def bench_quota(args) -> None:
+    """Time du, df and quota answered from the usage counters against walking the tree and the inode table."""
+    drive = make_drive(args.blocks, args.inodes + args.groups + 1, device="none")
+    rng = random.Random(args.seed)
+    directories = [0]
+    for n in range(args.groups):
+        index = drive.find_free_inode(0, True)
+        drive.write_inode("", Inode(f"d{n}", "directory", 0, [], "bench", 0, [7,7,7], [], None, 0), index)
+        directories.append(index)
+    start = time.perf_counter()
+    for n in range(args.inodes):
+        parent = rng.choice(directories)
+        drive.write_inode(make_payload("text", rng.randrange(1, 4 * CHAR_BLOCK_SIZE), rng), Inode(f"f{n}", "File", 0, [], rng.choice(["alice", "bob"]),  0, [7,7,7], [], None, parent), drive.find_free_inode(parent))
+    created = time.perf_counter() - start
+
+    def scan_du(directory: int) -> list[int]:
+        total = list(drive._inode_charge(drive.get_inode(directory)))
+        for child in drive.list_directory(directory).values():
+            charge = scan_du(child) if drive.get_inode(child)["file_type"].lower() == "directory" else drive._inode_charge(drive.get_inode(child))
+            total = [a + b for a, b in zip(total, charge)]
+        return total
+
+    def scan_quota(uid: str) -> list[int]:
+        total = [0, 0, 0]
+        for _, inode in drive.used_inodes():
+            if inode["uid"] == uid:
+                total = [a + b for a, b in zip(total, drive._inode_charge(inode))]
+        return total
+
+    queries = [
+        ("du /", lambda: drive.disk_usage(0), lambda: scan_du(0)),
+        ("du /d0", lambda: drive.disk_usage(directories[1]), lambda: scan_du(directories[1])),
+        ("df", drive.space, drive.usage),
+        ("quota alice", lambda: drive.quota("alice"), lambda: scan_quota("alice")),
+    ]
+    print(f"Usage benchmark: {args.inodes} files in {args.groups} directories, created in {created:.2f} s ({created / args.inodes * 1e6:.1f} us/file with accounting)")
+    print(f"{'Query':<14} {'Counters us':>12} {'Scan ms':>10}")
+    print("-" * 38)
+    for label, counted, scanned in queries:
+        start = time.perf_counter()
+        for _ in range(1000):
+            counted()
+        fast = (time.perf_counter() - start) / 1000
+        start = time.perf_counter()
+        scanned()
+        slow = time.perf_counter() - start
+        print(f"{label:<14} {fast * 1e6:>12.2f} {slow * 1000:>10.1f}")
+    assert list(drive.disk_usage(0).values()) == scan_du(0)
+    assert drive.quota("alice")["blocks"] == scan_quota("alice")[1]
+
+def bench_permissions(args) -> None:
+    """Resolve and permission-check paths of growing depth with and without the access cache, creating a file now and then."""
+    rng = random.Random(args.seed)
+    print(f"Permission check benchmark: 20000 checks per depth, a new file every 100 checks")
+    print(f"{'Depth':>6} {'Resolve us':>11} {'Uncached us':>12} {'Cached us':>10} {'Hit rate':>9}")
+    print("-" * 52)
+    for depth in (1, 4, 16, 64):
+        drive = make_drive(256, depth * 4 + 512, inline_data=True, device="none")
+        paths = []
+        for branch in range(4):
+            parent, components = 0, []
+            for level in range(depth):
+                components.append(f"{rng.choice(WORDS)}{branch}_{level}")
+                index = drive.find_free_inode(parent, True)
+                drive.write_inode("", Inode(components[-1], "Directory", 0, [], "bench", 0, [7,5,5], [], None, parent, "bench"), index)
+                parent = index
+            paths.append("C:/" + "/".join(components) + "/file.txt")
+        stream = [rng.choice(paths) for _ in range(20_000)]
+        resolver = PathResolver({"C": drive}, {"drive": "C", "path": "/"})
+        timings = []
+        for size in (None, 0, ACCESS_CACHE_SIZE):
+            checker = AccessChecker("reader", ["readers"], size or 0)
+            start = time.perf_counter()
+            for n, path in enumerate(stream):
+                resolved = resolver.resolve(path)
+                if size is not None:
+                    checker.check(resolved, target=READ, parent=EXECUTE)
+                if n % 100 == 0:  # New entries don't invalidate cached decisions
+                    drive.write_inode("x", Inode(f"f{size}_{n}", "File", 1, [], "bench", 0, [7,7,7], [], None, 0), drive.find_free_inode(0))
+            timings.append((time.perf_counter() - start) / len(stream) * 1_000_000)
+        stats = checker.stats()
+        print(f"{depth:>6} {timings[0]:>11.2f} {timings[1]:>12.2f} {timings[2]:>10.2f} {stats['hits'] / (stats['hits'] + stats['misses']):>8.0%}")
+
+def bench_find(args) -> None:
+    """Time find queries served by the metadata indexes against scanning every inode, and what keeping the indexes costs creates."""
+    import fnmatch
+    owners = [f"user{n}" for n in range(100)]
+    extensions = ["txt", "log", "csv", "md", "json"]
+    timings = {}
+    for label, indexed in (("without indexes", False), ("with indexes", True)):
+        rng = random.Random(args.seed)  # The same files both times
+        drive = make_drive(args.blocks, args.inodes + 64, inline_data=True, device="none")
+        if indexed:
+            drive.find(name="-")  # Builds the indexes
+        start = time.perf_counter()
+        for n in range(args.inodes):
+            index = drive.find_free_inode(0)
+            drive.write_inode("x" * rng.randrange(1, 60), Inode(f"{rng.choice(WORDS)}{n}.{rng.choice(extensions)}", "File", 0, [], rng.choice(owners), 0, [7,7,7], [], None, 0), index)
+            if n % 1000 == 0:
+                drive.set_xattr(index, "user.tag", "important")
+        timings[label] = (time.perf_counter() - start) / args.inodes * 1_000_000
+
+    def scan(name=None, uid=None, size=(None, None), xattr=None) -> list[int]:
+        return [i for i, inode in drive.used_inodes() if i != inode["parent"]
+                and (name is None or fnmatch.fnmatchcase(inode["file_name"], name))
+                and (uid is None or inode["uid"] == uid)
+                and (size[0] is None or inode["size"] >= size[0]) and (size[1] is None or inode["size"] <= size[1])
+                and (xattr is None or inode.get("xattrs", {}).get(xattr[0]) == xattr[1])]
+
+    queries = [
+        ("owner", dict(uid="user7")),
+        ("size range", dict(size=(50, 52))),
+        ("name prefix", dict(name=f"{WORDS[0]}1*")),
+        ("xattr", dict(xattr=("user.tag", "important"))),
+        ("owner + size", dict(uid="user7", size=(0, 10))),
+        ("name suffix", dict(name="*.csv")),
+    ]
+    print(f"Find benchmark: {args.inodes} files; create {timings['without indexes']:.1f} us/file before the indexes exist, {timings['with indexes']:.1f} us/file while keeping them")
+    print(f"{'Query':<14} {'Matches':>8} {'Indexed ms':>11} {'Scan ms':>9}")
+    print("-" * 45)
+    for label, query in queries:
+        start = time.perf_counter()
+        found = drive.find(**query)
+        indexed = time.perf_counter() - start
+        start = time.perf_counter()
+        scanned = scan(**query)
+        elapsed = time.perf_counter() - start
+        assert sorted(found) == sorted(scanned)
+        print(f"{label:<14} {len(found):>8} {indexed * 1000:>11.2f} {elapsed * 1000:>9.1f}")
+
+def bench_timestamps(args) -> None:
+    """Cost of taking timestamps as strings against nanoseconds, and the image writes reads cause under each atime mode."""
+    import datetime
+    import io
+    import statistics
+    import tempfile
+    import main
+    updates = 100_000
+    start = time.perf_counter()
+    for _ in range(updates):
+        datetime.datetime.now().strftime(TIME_FORMAT)
+    formatted = (time.perf_counter() - start) / updates
+    start = time.perf_counter()
+    for _ in range(updates):
+        time.time_ns()
+    numeric = (time.perf_counter() - start) / updates
+    inodes = min(args.inodes, 100_000)
+    start = time.perf_counter()
+    make_drive(1024, inodes, device="none")
+    created = time.perf_counter() - start
+    print(f"Timestamps benchmark: formatted string {formatted * 1_000_000:.2f} us, epoch nanoseconds {numeric * 1_000_000:.3f} us per timestamp; "
+          f"{inodes} inode drive created in {created * 1000:.0f} ms")
+
+    saves = 0
+    def counting_save(drive, filename) -> bool:
+        nonlocal saves
+        saves += 1
+        return save_drive(drive, filename)
+
+    rng = random.Random(args.seed)
+    payloads = [make_payload("text", args.file_size, rng) for _ in range(10)]
+    with tempfile.TemporaryDirectory() as bay:
+        cwd = os.getcwd()
+        os.chdir(bay)
+        main.save_drive = counting_save
+        try:
+            print(f"{args.files} cat commands over 10 files of {args.file_size} chars")
+            print(f"{'Mount option':<14} {'Median ms':>10} {'Image writes':>13}")
+            print("-" * 39)
+            for mode in ATIME_MODES:
+                app = main.MyApp()
+                app.stdout, app.quiet = io.StringIO(), True  # Command output and I/O feedback aren't part of the measurement
+                app.onecmd_plus_hooks(f"mkdrive -b 16384 -i 256 --device none T{mode[0].upper()}")
+                app.onecmd_plus_hooks(f"mount -p Q -o {mode} T{mode[0].upper()}")
+                for n, payload in enumerate(payloads):
+                    app.onecmd_plus_hooks(f'write Q:/f{n}.txt "{payload}"')
+                times, saves = [], 0
+                for n in range(args.files):
+                    start = time.perf_counter()
+                    app.onecmd_plus_hooks(f"cat Q:/f{n % 10}.txt")
+                    times.append(time.perf_counter() - start)
+                app.onecmd_plus_hooks("unmount Q")
+                print(f"{mode:<14} {statistics.median(times) * 1000:>10.3f} {saves:>13}")
+        finally:
+            main.save_drive = save_drive
+            os.chdir(cwd)
+
+BENCHMARKS = {
+    "compression": bench_compression,
+    "inline": bench_inline,
+    "groups": bench_groups,
+    "schedulers": bench_schedulers,
+    "bitmaps": bench_bitmaps,
+    "raid": bench_raid,
+    "churn": bench_churn,
+    "inodes": bench_inodes,
+    "paths": bench_paths,
+    "completion": bench_completion,
+    "startup": bench_startup,
+    "durability": bench_durability,
+    "writeback": bench_writeback,
+    "images": bench_images,
+    "quota": bench_quota,
+    "permissions": bench_permissions,
+    "find": bench_find,
+    "timestamps": bench_timestamps,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Disk simulator benchmarks.")
+    parser.add_argument("benchmark", choices=list(BENCHMARKS.keys()), help="Benchmark to run")
+    parser.add_argument("--files", type=int, default=50, help="Number of files to write (default 50)")
+    parser.add_argument("--file-size", type=int, default=4096, help="Characters per file (default 4096)")
+    parser.add_argument("--blocks", type=int, default=1_000_000, help="Data blocks for the bitmaps benchmark (default 1000000)")
+    parser.add_argument("--inodes", type=int, default=1_000_000, help="Files to create in the inodes benchmark (default 1000000)")
+    parser.add_argument("--entries", type=int, default=100_000, help="Directory entries for the completion benchmark (default 100000)")
+    parser.add_argument("--groups", type=int, default=8, help="Directories and block groups for the groups benchmark, readers for the schedulers benchmark (default 8)")
+    parser.add_argument("--device", choices=list(DEVICE_MODELS.keys()), default="hdd", help="Timing model for simulated I/O time (default hdd)")
+    parser.add_argument("--seed", type=int, default=321, help="Random seed for generated content")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
@@ -0,0 +1,233 @@
+import math
+
+# Device timing models for the disk simulator.
+# A model is attached to a Drive and charged for every block the drive reads or
+# writes, accumulating simulated time so layouts and allocators can be compared
+# by what the I/O would cost on real hardware rather than by Python run time.
+
+class DeviceModel:
+    """
+    Base class for device timing models.
+    Subclasses implement _service_time(); the base class keeps the counters.
+    """
+    name = "none"
+
+    def __init__(self, block_size: int = 4096) -> None:
+        self.block_size = block_size
+        self.reset()
+
+    def reset(self) -> None:
+        """Clear the accumulated counters (the device state, like head position, is kept)."""
+        self.elapsed = 0.0    # Simulated seconds spent on I/O
+        self.reads = 0
+        self.writes = 0
+        self.head_movement = 0  # Blocks travelled by the head between requests (0 for devices without one)
+
+    def access(self, block: int, write: bool = False) -> float:
+        """Charge one block read or write and return its simulated service time in seconds."""
+        cost = self._service_time(block, write)
+        self.elapsed += cost
+        if write:
+            self.writes += 1
+        else:
+            self.reads += 1
+        return cost
+
+    def _service_time(self, block: int, write: bool) -> float:
+        raise NotImplementedError
+
+    def position(self, block: int) -> None:
+        """Move to a block without transferring anything (SCAN's run to the disk edge). A no-op without a head."""
+
+    def stats(self) -> dict:
+        """Return a copy of the counters."""
+        return {
+            "device": self.name,
+            "elapsed": self.elapsed,
+            "reads": self.reads,
+            "writes": self.writes,
+            "head_movement": self.head_movement
+        }
+
+
+class HDDModel(DeviceModel):
+    """
+    Spinning disk: seek + rotational latency + transfer time per block.
+    Blocks are laid out track by track. Seek time grows with the square root of
+    the distance between tracks, and rotational latency depends on where the
+    platter is when the seek finishes. A block that directly follows the
+    previous one costs only its transfer time (plus a track-to-track seek at a
+    track boundary - tracks are skewed so the next sector is arriving as the
+    head settles).
+    """
+    name = "hdd"
+
+    def __init__(self, block_size: int = 4096, total_blocks: int = 1024, rpm: int = 7200, blocks_per_track: int = 64,
+                 track_to_track_ms: float = 0.5, full_seek_ms: float = 8.0, transfer_mb_s: float = 150.0) -> None:
+        self.rotation = 60.0 / rpm  # Seconds per revolution
+        self.blocks_per_track = blocks_per_track
+        self.tracks = max(1, math.ceil(total_blocks / blocks_per_track))
+        self.track_to_track = track_to_track_ms / 1000
+        self.full_seek = full_seek_ms / 1000
+        self.transfer = block_size / (transfer_mb_s * 1024 * 1024)
+        self.head = 0          # Block the head last finished with
+        self.clock = 0.0       # Device time, used to work out the platter's angle
+        super().__init__(block_size)
+
+    def seek_time(self, from_block: int, to_block: int) -> float:
+        """Time to move the arm between the tracks holding two blocks."""
+        distance = abs(to_block // self.blocks_per_track - from_block // self.blocks_per_track)
+        if distance == 0:
+            return 0.0
+        return self.track_to_track + (self.full_seek - self.track_to_track) * math.sqrt(distance / self.tracks)
+
+    def _service_time(self, block: int, write: bool) -> float:
+        cost = self.seek_time(self.head, block)
+        if block != self.head + 1:
+            # Wait for the target sector to come round under the head
+            under_head = (self.clock + cost) / self.rotation * self.blocks_per_track
+            wait = (block % self.blocks_per_track - under_head) % self.blocks_per_track
+            cost += wait / self.blocks_per_track * self.rotation
+        cost += self.transfer
+        self.head_movement += abs(block - self.head)
+        self.head = block
+        self.clock += cost
+        return cost
+
+    def position(self, block: int) -> None:
+        cost = self.seek_time(self.head, block)
+        self.head_movement += abs(block - self.head)
+        self.head = block
+        self.clock += cost
+        self.elapsed += cost
+
+
+class SSDModel(DeviceModel):
+    """
+    Flash drive: fixed page read and program costs with no positional penalty.
+    Pages are never overwritten in place; rewriting a page leaves a stale copy
+    behind and every erase block's worth of stale pages costs one erase
+    (a simple amortised garbage-collection model).
+    """
+    name = "ssd"
+
+    def __init__(self, block_size: int = 4096, total_blocks: int = 1024, read_us: float = 25.0, program_us: float = 200.0,
+                 erase_ms: float = 1.5, pages_per_erase_block: int = 64) -> None:
+        self.read_cost = read_us / 1_000_000
+        self.program_cost = program_us / 1_000_000
+        self.erase_cost = erase_ms / 1000
+        self.pages_per_erase_block = pages_per_erase_block
+        self.programmed = set()  # Blocks that have been written at least once
+        self.stale = 0           # Stale pages waiting for garbage collection
+        super().__init__(block_size)
+
+    def reset(self) -> None:
+        super().reset()
+        self.erases = 0
+
+    def _service_time(self, block: int, write: bool) -> float:
+        if not write:
+            return self.read_cost
+        cost = self.program_cost
+        if block in self.programmed:
+            self.stale += 1
+            if self.stale == self.pages_per_erase_block:
+                self.stale = 0
+                self.erases += 1
+                cost += self.erase_cost
+        self.programmed.add(block)
+        return cost
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["erases"] = self.erases
+        return stats
+
+
+DEVICE_MODELS = {"none": None, "hdd": HDDModel, "ssd": SSDModel}
+
+def make_device(name: str, block_size: int = 4096, total_blocks: int = 1024) -> DeviceModel | None:
+    """Create the timing model with the given name, or None for "none" (no timing)."""
+    model = DEVICE_MODELS.get(name)
+    if model is None:
+        return None
+    return model(block_size=block_size, total_blocks=total_blocks)
+
+
+# I/O schedulers. Each one picks the next request to service from the pending
+# queue given the head position and sweep direction (+1 towards higher blocks,
+# -1 towards lower). Pending entries are (submit_time, sequence, block, write, stream).
+# Returns (index into pending, new direction, block to sweep to first or None).
+
+def _schedule_fcfs(pending: list, head: int, direction: int, edge: int) -> tuple[int, int, int | None]:
+    """First come, first served: oldest request first, ignoring the head position."""
+    return min(range(len(pending)), key=lambda i: pending[i][1]), direction, None
+
+def _schedule_sstf(pending: list, head: int, direction: int, edge: int) -> tuple[int, int, int | None]:
+    """Shortest seek time first: the request closest to the head (may starve far requests)."""
+    return min(range(len(pending)), key=lambda i: (abs(pending[i][2] - head), pending[i][1])), direction, None
+
+def _schedule_scan(pending: list, head: int, direction: int, edge: int) -> tuple[int, int, int | None]:
+    """Elevator: keep moving in one direction, running on to the edge of the disk before reversing."""
+    ahead = [i for i in range(len(pending)) if (pending[i][2] - head) * direction >= 0]
+    sweep = None
+    if not ahead:
+        sweep = edge if direction > 0 else 0
+        direction = -direction
+        ahead = range(len(pending))
+    return min(ahead, key=lambda i: (abs(pending[i][2] - head), pending[i][1])), direction, sweep
+
+def _schedule_clook(pending: list, head: int, direction: int, edge: int) -> tuple[int, int, int | None]:
+    """Circular LOOK: service upwards only, then jump back to the lowest pending request."""
+    ahead = [i for i in range(len(pending)) if pending[i][2] >= head]
+    if not ahead:
+        ahead = range(len(pending))
+    return min(ahead, key=lambda i: (pending[i][2], pending[i][1])), 1, None
+
+SCHEDULERS = {"fcfs": _schedule_fcfs, "sstf": _schedule_sstf, "scan": _schedule_scan, "clook": _schedule_clook}
+
+def run_queue(device: DeviceModel, streams: list[list[tuple]], scheduler: str, edge: int) -> dict:
+    """
+    Service concurrent block request streams on a device through an I/O scheduler.
+    Each stream is one operation's (block, write) requests in issue order; a stream
+    submits its next request once the previous one completes, so the queue holds at
+    most one request per stream and the scheduler chooses among them.
+    edge is the highest block number, used by SCAN when it sweeps to the end.
+    Returns what this run added to the device counters plus per-request wait times.
+    """
+    choose = SCHEDULERS[scheduler]
+    before = device.stats()
+    positions = [0] * len(streams)
+    pending = []
+    sequence = 0
+    for s, stream in enumerate(streams):
+        if stream:
+            pending.append((device.elapsed, sequence, stream[0][0], stream[0][1], s))
+            sequence += 1
+
+    head = getattr(device, "head", 0)
+    direction = 1
+    waits = []
+    while pending:
+        index, direction, sweep = choose(pending, head, direction, edge)
+        if sweep is not None:
+            device.position(sweep)
+            head = sweep
+        submitted, _, block, write, s = pending.pop(index)
+        device.access(block, write)
+        head = block
+        waits.append(device.elapsed - submitted)
+        positions[s] += 1
+        if positions[s] < len(streams[s]):
+            block, write = streams[s][positions[s]]
+            pending.append((device.elapsed, sequence, block, write, s))
+            sequence += 1
+
+    stats = device.stats()
+    for key, value in before.items():
+        if key != "device":
+            stats[key] -= value
+    stats["requests"] = len(waits)
+    stats["mean_wait"] = sum(waits) / len(waits) if waits else 0.0
+    stats["max_wait"] = max(waits, default=0.0)
+    return stats
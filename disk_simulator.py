@@ -1,23 +1,209 @@
 import json
 import math
 import os
+import sys
+import time
+import threading
 import datetime
+import hashlib
+import heapq
+import bisect
+import fnmatch
+import itertools
+import base64
+import zlib
+import lzma
+from device import *
+from pool import *
+
+np = None  # Optional NumPy for vectorised bitmaps on very large drives, imported by load_numpy when first needed
+_numpy_checked = False
+
+def load_numpy():
+    """Import NumPy the first time a drive needs it. Returns the module, or None if it isn't installed."""
+    global np, _numpy_checked
+    if not _numpy_checked:
+        _numpy_checked = True
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            pass
+    return np
+
+orjson = None  # Optional fast JSON encoder/decoder for compact images, imported by load_orjson when first needed
+_orjson_checked = False
+
+def load_orjson():
+    """Import orjson the first time an image is encoded or decoded. Returns the module, or None if it isn't installed."""
+    global orjson, _orjson_checked
+    if not _orjson_checked:
+        _orjson_checked = True
+        try:
+            import orjson as module
+            orjson = module
+        except ImportError:
+            pass
+    return orjson
 
 # Directory where virtual drive files are stored
 SAVE_PATH = "drive_bay"
+INODE_SIZE = 256  # Bytes reserved for each inode record in the inode table
+INLINE_DATA_MAX = INODE_SIZE // 4  # Files this small are stored in the inode's block pointer area (a quarter of the record)
+CHAR_BLOCK_SIZE = 32  # Number of characters per data block (small for demo purposes)
+COMPRESSION_CLUSTER = 32 * CHAR_BLOCK_SIZE  # Characters compressed together as one independent unit
+COMPRESSION_ALGORITHMS = ["none", "zlib", "lzma"]
+NUMPY_MIN_BLOCKS = 1 << 16  # Drives with at least this many data blocks get NumPy bitmaps (when NumPy is installed)
+BITMAP_WINDOW = 1 << 16  # Bitmap entries examined per vectorised step when searching for free space
+IMAGE_SCHEMA = 3  # Version of the drive image layout, recorded in the superblock; older images are upgraded when loaded
+IMAGE_FORMATS = ["compact", "pretty"]  # Compact: run-length encoded, unindented JSON. Pretty: every block written out, indented
+DURABILITY_LEVELS = ["none", "commit", "periodic"]  # How hard save_drive pushes images to stable storage
+DURABILITY_INTERVAL = 5.0  # Seconds between syncs at the "periodic" durability level
+WRITE_BACK_IDLE = 0.5  # Seconds without further saves before the write-back thread writes dirty images
+WRITE_BACK_INTERVAL = 5.0  # Longest a dirty image waits for the write-back thread while saves keep coming
+USAGE_SUMMARY_CELLS = 512  # Buckets in the per-drive usage summary behind displaydata's overview
+DELALLOC_FLUSH_BLOCKS = 512  # Blocks reserved by delayed writes that force them to be placed on disk
+ATIME_MODES = ["relatime", "strictatime", "noatime"]  # When reading a file updates its access time (a mount option)
+RELATIME_INTERVAL = 24 * 3600 * 10**9  # Nanoseconds after which relatime refreshes an access time that is already newer than the modification
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"  # How timestamps are shown; inodes store them as integer nanoseconds since the epoch
+
+def _compress_bytes(raw: bytes, algorithm: str) -> bytes:
+    if algorithm == "zlib":
+        return zlib.compress(raw, 6)
+    # Raw LZMA2 stream - the .xz container header would eat most of the saving on small clusters
+    return lzma.compress(raw, format=lzma.FORMAT_RAW, filters=[{"id": lzma.FILTER_LZMA2, "preset": 6}])
+
+def _decompress_bytes(packed: bytes, algorithm: str) -> bytes:
+    if algorithm == "zlib":
+        return zlib.decompress(packed)
+    return lzma.decompress(packed, format=lzma.FORMAT_RAW, filters=[{"id": lzma.FILTER_LZMA2, "preset": 6}])
+
+def compress_data(data: str, algorithm: str) -> tuple[str, list]:
+    """
+    Compress file data cluster by cluster for storage in data blocks.
+    Each cluster is compressed independently and Base85 encoded so it stays a
+    JSON-safe string; clusters that don't shrink are stored as-is.
+    Returns the stored string and a list of [stored_length, compressed] per cluster.
+    """
+    stored = []
+    clusters = []
+    for i in range(0, len(data), COMPRESSION_CLUSTER):
+        raw = data[i:i + COMPRESSION_CLUSTER]
+        packed = base64.b85encode(_compress_bytes(raw.encode(), algorithm)).decode()
+        if len(packed) < len(raw):
+            stored.append(packed)
+            clusters.append([len(packed), True])
+        else:
+            stored.append(raw)
+            clusters.append([len(raw), False])
+    return "".join(stored), clusters
+
+def decompress_data(stored: str, algorithm: str, clusters: list) -> str:
+    """Reverse compress_data using the per-cluster layout recorded in the inode."""
+    data = []
+    offset = 0
+    for (length, compressed) in clusters:
+        chunk = stored[offset:offset + length]
+        offset += length
+        data.append(_decompress_bytes(base64.b85decode(chunk), algorithm).decode() if compressed else chunk)
+    return "".join(data)
+
+class SortedList:
+    """
+    A sorted list stored as sorted chunks of up to SortedList.CHUNK * 2 items,
+    so adding or removing an item shifts at most one chunk instead of the whole
+    list. Used for the metadata indexes, which can hold every inode on a drive.
+    """
+    CHUNK = 512
+
+    def __init__(self, items=()) -> None:
+        items = sorted(items)
+        self.chunks = [items[i:i + self.CHUNK] for i in range(0, len(items), self.CHUNK)]
+        self.maxes = [chunk[-1] for chunk in self.chunks]  # Last item of each chunk, to find the right one by bisection
+        self.length = len(items)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self.chunks)
+
+    def add(self, item) -> None:
+        self.length += 1
+        if not self.chunks:
+            self.chunks.append([item])
+            self.maxes.append(item)
+            return
+        k = bisect.bisect_left(self.maxes, item)
+        if k == len(self.chunks):  # Past the end: append to the last chunk
+            k -= 1
+            self.chunks[k].append(item)
+            self.maxes[k] = item
+        else:
+            bisect.insort(self.chunks[k], item)
+        chunk = self.chunks[k]
+        if len(chunk) > 2 * self.CHUNK:
+            self.chunks[k:k + 1] = [chunk[:self.CHUNK], chunk[self.CHUNK:]]
+            self.maxes[k:k + 1] = [chunk[self.CHUNK - 1], chunk[-1]]
+
+    def remove(self, item) -> bool:
+        """Remove an item; returns False if it isn't in the list."""
+        k = bisect.bisect_left(self.maxes, item)
+        if k == len(self.chunks):
+            return False
+        chunk = self.chunks[k]
+        i = bisect.bisect_left(chunk, item)
+        if i == len(chunk) or chunk[i] != item:
+            return False
+        del chunk[i]
+        self.length -= 1
+        if not chunk:
+            del self.chunks[k]
+            del self.maxes[k]
+        elif i == len(chunk):
+            self.maxes[k] = chunk[-1]
+        return True
+
+    def irange(self, low=None, high=None):
+        """Yield the items from low (inclusive) to high (exclusive) in order; None leaves that end open."""
+        k = bisect.bisect_left(self.maxes, low) if low is not None else 0
+        for chunk in self.chunks[k:]:
+            start = bisect.bisect_left(chunk, low) if low is not None else 0
+            for item in itertools.islice(chunk, start, None):
+                if high is not None and item >= high:
+                    return
+                yield item
+
+class QuotaExceeded(Exception):
+    """A change that would take an owner past their quota; the message is shown to the user as is."""
+
+
+DEFAULT_GROUP = "users"  # Group of new inodes unless the creator names one, and of inodes from before groups were recorded
+
+def format_time(ns: int | None) -> str:
+    """Show a stored timestamp (nanoseconds since the epoch) in local time, or "-" if it was never set."""
+    if not ns:
+        return "-"
+    return time.strftime(TIME_FORMAT, time.localtime(ns // 1_000_000_000))
+
+def parse_time(text: str) -> int:
+    """Nanoseconds since the epoch for a local time written as TIME_FORMAT."""
+    return int(datetime.datetime.strptime(text, TIME_FORMAT).timestamp()) * 1_000_000_000
 
 class Inode:
     """
     Represents a file system inode containing metadata about files and directories.
     Each inode stores file information, block pointers, and timestamps.
     """
-    def __init__(self,file_name: str, file_type: str, size: int, pointers: list[tuple], uid: str, time: str, permissions: list[int], mli_pointer: list = []) -> None:
-        self.file_name = file_name                                              # Name of the file or directory
+    def __init__(self,file_name: str, file_type: str, size: int, pointers: list[tuple], uid: str, time: int, permissions: list[int], mli_pointer: list = [], compression: str | None = None, parent: int = 0, gid: str = DEFAULT_GROUP) -> None:
+        self.file_name = file_name                                              # Name of the file or directory, relative to its parent
+        self.parent = parent                                                    # Inode index of the containing directory
         self.file_type = file_type                                              # 'file' or 'directory'
         self.size = size                                                        # size in bytes
         self.pointers = pointers                                                # list of block indices. Each tuple is (start_block, length)
         self.uid = uid                                                          # File creator
-        self.time_accessed = time                                               # Last accessed time
+        self.gid = gid                                                          # Group the group permissions apply to
+        self.time_accessed = time                                               # Last accessed time (nanoseconds since the epoch, like the others)
         self.time_modified = time                                               # Last modified time
         self.time_created = time                                                # Creation time
         self.time_deleted = None                                                # Deletion time (None if not deleted)
@@ -25,6 +211,11 @@ class Inode:
         self.update_blocks_used()                                               # Calculate number of blocks used by this file
         self.permissions = permissions                                          # 3 ints for user, group, others (rwx as 4+2+1)
         self.mli_pointer = mli_pointer                                          # Pointers for Multi-Level Indexing (if needed)
+        self.compression = compression                                          # 'zlib'/'lzma', 'none', or None to use the drive default
+        self.clusters = []                                                      # [stored_length, compressed] per compression cluster
+        self.inline_data = None                                                 # Content of small files stored directly in the inode
+        self.preallocated = 0                                                   # Data blocks reserved by fallocate (the file keeps at least this many)
+        self.xattrs = {}                                                        # User extended attributes, name -> value
     
     # def __init__(self, pointers: list[tuple], mli_pointer: list = [], MLI_TRUE = True): # Multi-Level Indexing constructor
     #     self.pointers = pointers
@@ -35,16 +226,15 @@ class Inode:
     
     def update_access_time(self) -> None:
         """Update the last accessed timestamp to current time."""
-        self.time_accessed = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.time_accessed = time.time_ns()
     
     def update_modified_time(self) -> None:
         """Update both modified and accessed timestamps to current time."""
-        self.time_modified = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.update_access_time()
+        self.time_modified = self.time_accessed = time.time_ns()
     
     def update_deleted_time(self) -> None:
         """Mark file as deleted by setting deletion timestamp and updating modified time."""
-        self.time_deleted = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.time_deleted = time.time_ns()
         self.update_modified_time()
     
     def update_blocks_used(self) -> None:
@@ -56,8 +246,30 @@ class Drive:
     Represents a virtual disk drive with blocks, inodes, and a file system structure.
     Uses a Unix-like inode system with superblock, bitmaps, and data blocks.
     """
-    def __init__(self, name: str, total_blocks: int, block_list: list = None, block_size: int = 4096, inode_count: int = 80) -> None:
-        self.block_list = block_list if block_list is not None else [None] * total_blocks
+    def __init__(self, name: str, total_blocks: int, block_list: list = None, block_size: int = 4096, inode_count: int = 80, snapshots: dict = None, dedup: bool = False, compression: str = "none", inline_data: bool = True, groups: int = 1, device: str = "hdd", vectorised: bool | None = None, delalloc: bool = False) -> None:
+        self.snapshots = snapshots if snapshots is not None else {}   # Point-in-time snapshots, keyed by name
+        self.dedup_index: dict[bytes, int] = {}                       # Content hash -> data block (dedup drives only)
+        self.directory_index: dict[int, dict[str, int]] = {}          # Directory inode -> {child name: child inode}
+        self.generation = 0                                           # Bumped whenever a directory entry changes, so cached path lookups can be checked
+        self.access_generation = 0                                    # Bumped whenever an owner, group or permission may change, so cached access decisions can be checked
+        self.name_index: dict[int, dict[str, list]] = {}              # Directory inode -> {"file"/"directory": sorted [(folded name, name)]}, built on first completion
+        self.metadata_index: dict | None = None                       # Secondary indexes for find(), built on first search (see _build_metadata_index)
+        self.io_trace: list | None = None                             # Block requests being recorded by trace_io()
+        self.dirty: dict[int, tuple[str, int]] = {}                   # Inode -> (stored data, blocks reserved) awaiting delayed allocation
+        self.reserved_blocks = 0                                      # Free blocks promised to delayed writes
+        self.inode_hints: dict[int, int] = {}                         # Inode range start -> lowest index that may be free
+        self.inode_free: dict[int, list[int]] = {}                    # Inode range start -> heap of inodes freed below its hint
+        self.tree_usage: dict[int, list[int]] = {}                    # Directory inode -> [inodes, blocks, bytes] in its subtree, itself included
+        self.owner_usage: dict[str, list[int]] = {}                   # Owner (uid) -> [inodes, blocks, bytes] they own
+        self.atime_mode = "relatime"                                  # When reads update access times (one of ATIME_MODES, chosen per mount)
+        if block_list is not None:
+            # Existing drive image - the layout is already on disk, don't reformat it
+            self.block_list = block_list
+            self.attach_device()
+            self._init_bitmaps(vectorised)
+            self._build_indexes()
+            return
+        self.block_list = [None] * total_blocks
         
         # Calculate filesystem layout - similar to Unix filesystem structure
         inode_bitmap_start = 1  # Block 0 is superblock, block 1 is inode bitmap
@@ -67,6 +279,22 @@ class Drive:
         inode_size = math.ceil(inode_count / inode_per_block)  # Number of blocks needed for inodes
         data_size = total_blocks - (inode_start + inode_size)  # Remaining blocks for data
 
+        # Block groups (ext-style): each group is its own slice of the inode table followed
+        # by its own data blocks, so a directory's files can sit next to their inodes.
+        # The bitmaps stay one list each; group g owns a contiguous range of both.
+        group_table = None
+        if groups > 1:
+            inode_size = math.ceil(inode_count / groups / inode_per_block)  # Inode table blocks per group
+            inodes_per_group = inode_size * inode_per_block
+            inode_count = inodes_per_group * groups
+            data_blocks_per_group = (total_blocks - inode_start) // groups - inode_size
+            group_table = []
+            block = inode_start
+            for g in range(groups):
+                group_table.append({"inode_table": block, "data_start": block + inode_size})
+                block += inode_size + data_blocks_per_group
+            data_size = total_blocks - inode_start - groups * inode_size  # The last group takes any leftover blocks
+
 
         # Initialize superblock (block 0) with filesystem metadata
         self.block_list[0] = { # Superblock
@@ -80,130 +308,916 @@ class Drive:
             "inode_start": inode_start,
             "inode_size": inode_size,
             "data_start": inode_start + inode_size,
-            "data_size": data_size
+            "data_size": data_size,
+            "dedup": dedup,
+            "compression": compression,
+            "inline_data": inline_data,
+            "device": device,
+            "delalloc": delalloc,
+            "schema": IMAGE_SCHEMA
             }
+        self.attach_device()  # Timing model charged for every block access
+        if group_table is not None:
+            self.block_list[0]["groups"] = group_table
+            self.block_list[0]["inodes_per_group"] = inodes_per_group
+            self.block_list[0]["data_blocks_per_group"] = data_blocks_per_group
         
         # Initialize filesystem structures
         self.block_list[inode_bitmap_start] = [False] * inode_count # Track which inodes are in use
-        self.block_list[data_bitmap_start] = [False] * data_size # Track which data blocks are in use
+        self.block_list[data_bitmap_start] = [0] * data_size # Reference count per data block (0 = free)
+        self._init_bitmaps(vectorised)
+        self._build_usage_summary()
         
         # Initialize inode table blocks
-        for i in range(inode_start, inode_start + inode_size): # initialize inode blocks
+        for i in self._inode_table_blocks(): # initialize inode blocks
             self.block_list[i] = [None] * inode_per_block
         
         # Mark all inodes as free initially
         for i in range(inode_count): # initialize inodes as free
-            self.block_list[inode_start + (i // inode_per_block)][i % inode_per_block] = Inode(file_name='' ,file_type="free", size=0, pointers=[], uid='', time=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), permissions=[7,7,7]).__dict__
+            self._store_inode(i, Inode(file_name='' ,file_type="free", size=0, pointers=[], uid='', time=0, permissions=[7,7,7]).__dict__)
         
-        # Initialize data blocks as empty
-        for i in range(self.block_list[0]["data_start"], total_blocks): # initialize data blocks
-            self.block_list[i] = ''
+        # Initialize data blocks as empty, one contiguous run per block group
+        for g in range(self.group_count()): # initialize data blocks
+            blocks = self.group_data_blocks(g)
+            start = self.data_block_address(blocks.start)
+            self.block_list[start:start + len(blocks)] = [''] * len(blocks)
 
         # Create root directory (inode 0)
-        root_inode = Inode(file_name='/', file_type='directory', size=0, pointers=[], uid='system', time=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), permissions=[7,7,7])
+        root_inode = Inode(file_name='/', file_type='directory', size=0, pointers=[], uid='system', time=time.time_ns(), permissions=[7,7,7])
         self.write_inode('', root_inode, 0) # Create root directory inode
 
-    def find_free_inode(self) -> int | None:
+    def attach_device(self) -> None:
+        """(Re)create the timing model named in the superblock; pools get one model per member."""
+        superblock = self.block_list[0]
+        device = superblock.get("device", "hdd")
+        if isinstance(self.block_list, PooledBlockList) and device != "none":
+            self.device = PoolDevice(self.block_list, device, superblock["block_size"])
+        else:
+            self.device = make_device(device, superblock["block_size"], superblock["total_blocks"])
+
+    def _init_bitmaps(self, vectorised: bool | None) -> None:
+        """
+        Choose the in-memory representation of the bitmaps.
+        With NumPy the inode bitmap becomes a bool array and the data bitmap a
+        uint32 array of reference counts, so free space searches, extent
+        updates and usage counts run as array operations instead of per-block
+        Python loops. By default only drives of NUMPY_MIN_BLOCKS data blocks
+        or more use it. Saved images are plain JSON lists either way.
+        """
+        superblock = self.block_list[0]
+        if vectorised is None:
+            vectorised = superblock["data_size"] >= NUMPY_MIN_BLOCKS
+        self.vectorised = vectorised and load_numpy() is not None
+        if self.vectorised:
+            self.block_list[superblock["inode_bitmap_start"]] = np.array(self.block_list[superblock["inode_bitmap_start"]], dtype=bool)
+            self.block_list[superblock["data_bitmap_start"]] = np.array(self.block_list[superblock["data_bitmap_start"]], dtype=np.uint32)
+
+    def _count_free(self, bitmap, start: int = 0, end: int | None = None) -> int:
+        """Count the free (zero) entries of a bitmap between start and end."""
+        end = len(bitmap) if end is None else end
+        if self.vectorised:
+            return int(end - start - np.count_nonzero(bitmap[start:end]))
+        return bitmap[start:end].count(0)  # False counts as 0 in the inode bitmap
+
+    def _used_indices(self, bitmap) -> list[int]:
+        """Return the indices of every in-use (non-zero) bitmap entry."""
+        if self.vectorised:
+            return np.flatnonzero(bitmap).tolist()
+        return [i for i, used in enumerate(bitmap) if used]
+
+    def _free_indices(self, bitmap, ranges: list[range], count: int) -> list[int]:
+        """
+        Return up to count free indices of a NumPy bitmap, searching the ranges in order.
+        BITMAP_WINDOW entries are examined per step, so a search that succeeds
+        early never touches the rest of a huge bitmap.
+        """
+        found = []
+        for r in ranges:
+            for window in range(r.start, r.stop, BITMAP_WINDOW):
+                chunk = bitmap[window:min(window + BITMAP_WINDOW, r.stop)]
+                free = np.flatnonzero(chunk == 0)[:count - len(found)]
+                found.extend((free + window).tolist())
+                if len(found) == count:
+                    return found
+        return found
+
+    def usage(self, group: int | None = None) -> dict:
+        """Count used and total inodes and data blocks, for the whole drive or one block group."""
+        superblock = self.block_list[0]
+        inode_bitmap = self.block_list[superblock["inode_bitmap_start"]]
+        data_bitmap = self.block_list[superblock["data_bitmap_start"]]
+        inodes = [range(len(inode_bitmap))] if group is None else self.inode_ranges(group)
+        blocks = range(len(data_bitmap)) if group is None else self.group_data_blocks(group)
+        return {
+            "inodes_used": sum(len(r) - self._count_free(inode_bitmap, r.start, r.stop) for r in inodes),
+            "inodes_total": sum(len(r) for r in inodes),
+            "blocks_used": len(blocks) - self._count_free(data_bitmap, blocks.start, blocks.stop),
+            "blocks_total": len(blocks)
+        }
+
+    def _build_usage_summary(self) -> None:
+        """
+        Rebuild the usage summary: the number of used data blocks in each of
+        USAGE_SUMMARY_CELLS equal buckets. It is kept up to date as blocks are
+        allocated and freed, so a whole-drive usage overview costs the same
+        however large the drive is.
+        """
+        data_bitmap = self.block_list[self.block_list[0]["data_bitmap_start"]]
+        self.summary_size = max(1, math.ceil(len(data_bitmap) / USAGE_SUMMARY_CELLS))  # Blocks per bucket
+        buckets = range(0, len(data_bitmap), self.summary_size)
+        self.usage_summary = [min(b + self.summary_size, len(data_bitmap)) - b - self._count_free(data_bitmap, b, min(b + self.summary_size, len(data_bitmap))) for b in buckets]
+
+    def _summarise_run(self, start: int, length: int, delta: int) -> None:
+        """Adjust the usage summary for a run of data blocks that became used (+1) or free (-1)."""
+        end = start + length
+        while start < end:
+            bucket = start // self.summary_size
+            stop = min(end, (bucket + 1) * self.summary_size)
+            self.usage_summary[bucket] += delta * (stop - start)
+            start = stop
+
+    def _summarise_blocks(self, blocks, delta: int) -> None:
+        """Adjust the usage summary for an array of data blocks that became used (+1) or free (-1)."""
+        if len(blocks):
+            buckets, counts = np.unique(blocks // self.summary_size, return_counts=True)
+            for bucket, count in zip(buckets.tolist(), counts.tolist()):
+                self.usage_summary[bucket] += delta * count
+
+    def usage_cells(self, start: int, end: int, cell_blocks: int) -> list[tuple[int, int]]:
+        """
+        Return (used, total) data block counts for each cell of cell_blocks blocks from start to end.
+        Cells that line up with the usage summary buckets are read from the summary;
+        anything finer is counted from the data bitmap.
+        """
+        data_bitmap = self.block_list[self.block_list[0]["data_bitmap_start"]]
+        size = self.summary_size
+        cells = []
+        if start % size == 0 and cell_blocks % size == 0 and (end % size == 0 or end == len(data_bitmap)):
+            per_cell = cell_blocks // size
+            for bucket in range(start // size, math.ceil(end / size), per_cell):
+                last = min(bucket + per_cell, math.ceil(end / size))
+                cells.append((sum(self.usage_summary[bucket:last]), min(end, last * size) - bucket * size))
+            return cells
+        for cell in range(start, end, cell_blocks):
+            stop = min(end, cell + cell_blocks)
+            cells.append((stop - cell - self._count_free(data_bitmap, cell, stop), stop - cell))
+        return cells
+
+    def extent_owners(self, start: int, end: int):
+        """Yield (inode index, first block, end block) for every file extent overlapping data blocks start to end."""
+        for i, inode in self.used_inodes():
+            for (first, length) in inode["pointers"]:
+                if first < end and first + length > start:
+                    yield i, max(first, start), min(first + length, end)
+
+    def _inode_location(self, inode_index: int) -> tuple[int, int]:
+        """Return the (block, slot) position of an inode inside the inode table."""
+        superblock = self.block_list[0]
+        inode_per_block = superblock["block_size"] // INODE_SIZE
+        extents = superblock.get("inode_extents")
+        if extents and inode_index >= extents[0]["first_inode"]:
+            # Added by _grow_inode_table: the inode lives in a run of data blocks
+            for extent in reversed(extents):
+                if inode_index >= extent["first_inode"]:
+                    offset = inode_index - extent["first_inode"]
+                    return self.data_block_address(extent["start"] + offset // inode_per_block), offset % inode_per_block
+        if "groups" not in superblock:
+            return superblock["inode_start"] + (inode_index // inode_per_block), inode_index % inode_per_block
+        group, offset = divmod(inode_index, superblock["inodes_per_group"])
+        return superblock["groups"][group]["inode_table"] + (offset // inode_per_block), offset % inode_per_block
+
+    def _inode_table_blocks(self) -> list[int]:
+        """Return the block numbers holding the inode table (one run per block group, then any runs it grew into)."""
+        superblock = self.block_list[0]
+        grown = [self.data_block_address(extent["start"] + b) for extent in superblock.get("inode_extents", []) for b in range(extent["blocks"])]
+        if "groups" not in superblock:
+            return list(range(superblock["inode_start"], superblock["inode_start"] + superblock["inode_size"])) + grown
+        return [group["inode_table"] + b for group in superblock["groups"] for b in range(superblock["inode_size"])] + grown
+
+    def data_block_address(self, block: int) -> int:
+        """Return the position in block_list of a data block (an index into the data bitmap)."""
+        superblock = self.block_list[0]
+        if "groups" not in superblock:
+            return superblock["data_start"] + block
+        per_group = superblock["data_blocks_per_group"]
+        group = min(block // per_group, len(superblock["groups"]) - 1)
+        return superblock["groups"][group]["data_start"] + block - group * per_group
+
+    def data_block_group(self, block: int) -> int:
+        """Return the block group a data block belongs to."""
+        superblock = self.block_list[0]
+        if "groups" not in superblock:
+            return 0
+        return min(block // superblock["data_blocks_per_group"], len(superblock["groups"]) - 1)
+
+    def group_count(self) -> int:
+        """Number of block groups (a drive without groups is one group)."""
+        return len(self.block_list[0].get("groups", [None]))
+
+    def inode_group(self, inode_index: int) -> int:
+        """Return the block group an inode belongs to."""
+        superblock = self.block_list[0]
+        if "groups" not in superblock:
+            return 0
+        extents = superblock.get("inode_extents")
+        if extents and inode_index >= extents[0]["first_inode"]:
+            extent = next(e for e in reversed(extents) if inode_index >= e["first_inode"])
+            return self.data_block_group(extent["start"])
+        return inode_index // superblock["inodes_per_group"]
+
+    def group_inodes(self, group: int) -> range:
+        """Return the inode indices a block group was formatted with (see inode_ranges for any added since)."""
+        superblock = self.block_list[0]
+        extents = superblock.get("inode_extents")
+        inode_count = extents[0]["first_inode"] if extents else len(self.block_list[superblock["inode_bitmap_start"]])
+        if "groups" not in superblock:
+            return range(inode_count)
+        return range(group * superblock["inodes_per_group"], min((group + 1) * superblock["inodes_per_group"], inode_count))
+
+    def inode_ranges(self, group: int) -> list[range]:
+        """Return every run of inode indices owned by a block group, including table growth placed in its data blocks."""
+        per_block = self.block_list[0]["block_size"] // INODE_SIZE
+        ranges = [self.group_inodes(group)]
+        for extent in self.block_list[0].get("inode_extents", []):
+            if self.data_block_group(extent["start"]) == group:
+                ranges.append(range(extent["first_inode"], extent["first_inode"] + extent["blocks"] * per_block))
+        return ranges
+
+    def group_data_blocks(self, group: int) -> range:
+        """Return the data block indices owned by a block group."""
+        superblock = self.block_list[0]
+        if "groups" not in superblock:
+            return range(superblock["data_size"])
+        per_group = superblock["data_blocks_per_group"]
+        end = superblock["data_size"] if group == len(superblock["groups"]) - 1 else (group + 1) * per_group
+        return range(group * per_group, end)
+
+    def _charge(self, block: int, write: bool = False) -> None:
+        """Charge one block access to the drive's timing model, if it has one."""
+        if self.io_trace is not None:
+            self.io_trace.append((block, write))  # Queued for an I/O scheduler instead
+        elif self.device is not None:
+            self.device.access(block, write)
+
+    def trace_io(self, operations: list) -> list[list[tuple]]:
+        """
+        Run each operation (a callable) and record the block requests it issues
+        instead of charging them to the timing model. Returns one stream of
+        (block, write) requests per operation, for run_queue() to schedule as if
+        the operations had been running at the same time.
+        """
+        streams = []
+        for operation in operations:
+            self.io_trace = []
+            try:
+                operation()
+            finally:
+                streams.append(self.io_trace)
+                self.io_trace = None
+        return streams
+
+    def get_inode(self, inode_index: int) -> dict:
+        """Return the inode record stored at the given index."""
+        block, slot = self._inode_location(inode_index)
+        return self.block_list[block][slot]
+
+    def _store_inode(self, inode_index: int, inode: dict) -> None:
+        """Write an inode record into its slot in the inode table."""
+        block, slot = self._inode_location(inode_index)
+        self.block_list[block][slot] = inode
+
+    def _commit_inode(self, inode_index: int, inode: dict) -> None:
+        """Store an inode, mark it used and link it into its parent directory."""
+        if self.block_list[self.block_list[0]["inode_bitmap_start"]][inode_index]:
+            replaced = self.get_inode(inode_index)
+            self._account(inode_index, replaced, -1)
+            self._index_metadata(inode_index, replaced, False)
+            if (replaced["uid"], replaced.get("gid"), replaced["permissions"]) != (inode["uid"], inode.get("gid"), inode["permissions"]):
+                self.access_generation += 1
+        self._store_inode(inode_index, inode)
+        self._account(inode_index, inode, 1)
+        self._index_metadata(inode_index, inode, True)
+        self._charge(self._inode_location(inode_index)[0], write=True)
+        self._charge(self.block_list[0]["inode_bitmap_start"], write=True)
+        self.block_list[self.block_list[0]["inode_bitmap_start"]][inode_index] = True  # Mark inode as used
+        if inode["file_type"].lower() == "directory":
+            self.directory_index.setdefault(inode_index, {})
+        if inode_index != inode["parent"]:  # The root directory is its own parent
+            siblings = self.directory_index.setdefault(inode["parent"], {})
+            previous = siblings.get(inode["file_name"])
+            if previous != inode_index:
+                if previous is not None:
+                    self._index_name(inode["parent"], inode["file_name"], self.get_inode(previous)["file_type"], False)
+                siblings[inode["file_name"]] = inode_index
+                self._index_name(inode["parent"], inode["file_name"], inode["file_type"], True)
+                self.generation += 1
+
+    @staticmethod
+    def _inode_charge(inode: dict) -> list[int]:
+        """What an inode counts against its owner and its directories: [inodes, blocks, bytes]."""
+        return [1, sum(length for (start, length) in inode["pointers"]), inode["size"]]
+
+    def _charge_ancestors(self, directory: int, charge: list[int], sign: int) -> None:
+        """Add a charge to the subtree totals of a directory and every directory above it."""
+        while True:
+            totals = self.tree_usage.setdefault(directory, [0, 0, 0])
+            for n in range(3):
+                totals[n] += sign * charge[n]
+            parent = self.get_inode(directory)["parent"]
+            if parent == directory:  # The root is its own parent
+                return
+            directory = parent
+
+    def _account(self, inode_index: int, inode: dict, sign: int) -> None:
+        """Add (sign 1) or remove (sign -1) an inode's charge from its owner's and its directories' usage counters."""
+        charge = self._inode_charge(inode)
+        owner = self.owner_usage.setdefault(inode["uid"], [0, 0, 0])
+        for n in range(3):
+            owner[n] += sign * charge[n]
+        if inode["file_type"].lower() == "directory":
+            totals = self.tree_usage.setdefault(inode_index, [0, 0, 0])
+            for n in range(3):
+                totals[n] += sign * charge[n]
+        if inode_index != inode["parent"]:
+            self._charge_ancestors(inode["parent"], charge, sign)
+
+    def _build_usage_counters(self) -> None:
+        """Rebuild the per-owner and per-directory usage counters from the inode table (on mount and after rollbacks)."""
+        self.tree_usage = {}
+        self.owner_usage = {}
+        for i, inode in self.used_inodes():
+            self._account(i, inode, 1)
+
+    def _subtree_charge(self, inode_index: int) -> list[int]:
+        """[inodes, blocks, bytes] of a directory's subtree, or of a single file."""
+        inode = self.get_inode(inode_index)
+        if inode["file_type"].lower() == "directory":
+            return list(self.tree_usage.get(inode_index, [0, 0, 0]))
+        return self._inode_charge(inode)
+
+    def disk_usage(self, inode_index: int) -> dict:
+        """Inodes, data blocks and bytes under a directory (or of a single file), from the usage counters."""
+        inodes, blocks, size = self._subtree_charge(inode_index)
+        return {"inodes": inodes, "blocks": blocks, "bytes": size}
+
+    def space(self) -> dict:
+        """Used and total inodes and data blocks for the whole drive, from the usage counters and summary instead of the bitmaps."""
+        superblock = self.block_list[0]
+        return {
+            "inodes_used": self.tree_usage.get(0, [0])[0],
+            "inodes_total": len(self.block_list[superblock["inode_bitmap_start"]]),
+            "blocks_used": sum(self.usage_summary),
+            "blocks_reserved": self.reserved_blocks,
+            "blocks_total": superblock["data_size"]
+        }
+
+    def quota(self, uid: str) -> dict:
+        """An owner's usage and limits (0 for no limit)."""
+        inodes, blocks, size = self.owner_usage.get(uid, [0, 0, 0])
+        limits = self.block_list[0].get("quotas", {}).get(uid, {})
+        return {"inodes": inodes, "blocks": blocks, "bytes": size, "inode_limit": limits.get("inodes", 0), "block_limit": limits.get("blocks", 0)}
+
+    def set_quota(self, uid: str, blocks: int | None = None, inodes: int | None = None) -> None:
+        """Set an owner's block and/or inode limit; 0 removes that limit. Usage already over a new limit is kept."""
+        quotas = self.block_list[0].setdefault("quotas", {})
+        limits = quotas.setdefault(uid, {})
+        for key, value in (("blocks", blocks), ("inodes", inodes)):
+            if value is not None:
+                limits[key] = value
+                if not value:
+                    del limits[key]
+        if not limits:
+            del quotas[uid]
+
+    def _check_quota(self, inode_index: int, uid: str, blocks: int) -> None:
+        """
+        Raise QuotaExceeded if storing an inode owned by uid with this many data
+        blocks at inode_index would take uid past a limit. Changes that don't
+        add to an owner's usage are always allowed, even when over the limit.
+        """
+        limits = self.block_list[0].get("quotas", {}).get(uid)
+        if not limits:
+            return
+        inodes, used = self.owner_usage.get(uid, [0, 0, 0])[:2]
+        current = None
+        if self.block_list[self.block_list[0]["inode_bitmap_start"]][inode_index]:
+            current = self.get_inode(inode_index)
+        if current is None or current["uid"] != uid:
+            if limits.get("inodes") and inodes + 1 > limits["inodes"]:
+                raise QuotaExceeded(f"Error: {uid} would go over their quota of {limits['inodes']} inodes.")
+            owned = 0
+        else:
+            owned = self._inode_charge(current)[1]
+        if limits.get("blocks") and blocks > owned and used - owned + blocks > limits["blocks"]:
+            raise QuotaExceeded(f"Error: {uid} would go over their quota of {limits['blocks']} data blocks ({used} in use, {blocks - owned} more needed).")
+
+    def _reference_blocks(self, pointers: list) -> None:
+        """
+        Increment the reference count of every data block in the given extents.
+        The data bitmap doubles as the reference count table, so a block shared
+        by a file and its snapshots stays allocated until the last user lets go.
+        """
+        data_bitmap = self.block_list[self.block_list[0]["data_bitmap_start"]]
+        for (start, length) in pointers:
+            if self.vectorised:
+                extent = data_bitmap[start:start + length]
+                self._summarise_blocks(np.flatnonzero(extent == 0) + start, 1)
+                extent += 1
+                continue
+            for j in range(start, start + length):
+                if not data_bitmap[j]:
+                    self._summarise_run(j, 1, 1)
+                data_bitmap[j] += 1
+
+    def _release_blocks(self, pointers: list) -> None:
+        """Decrement the reference count of every data block in the given extents."""
+        data_bitmap = self.block_list[self.block_list[0]["data_bitmap_start"]]
+        for (start, length) in pointers:
+            if self.vectorised:
+                extent = data_bitmap[start:start + length]  # A view, updated in place
+                freed = np.flatnonzero(extent == 1) + start
+                extent -= (extent > 0).astype(np.uint32)
+                self._summarise_blocks(freed, -1)
+                if self.dedup_index:
+                    for j in freed:
+                        self._forget_block(int(j))
+                continue
+            for j in range(start, start + length):
+                if data_bitmap[j]:
+                    data_bitmap[j] -= 1  # Block becomes free once nothing references it
+                    if not data_bitmap[j]:
+                        self._summarise_run(j, 1, -1)
+                        if self.dedup_index:
+                            self._forget_block(j)
+
+    @staticmethod
+    def _block_digest(block_data: str) -> bytes:
+        """Content hash used to find identical data blocks."""
+        return hashlib.blake2b(block_data.encode(), digest_size=16).digest()
+
+    @staticmethod
+    def _blocks_to_extents(blocks: list[int]) -> list[tuple]:
+        """Collapse a list of data block indices into (start_block, length) extents."""
+        extents = []
+        for block in blocks:
+            if extents and extents[-1][0] + extents[-1][1] == block:
+                extents[-1] = (extents[-1][0], extents[-1][1] + 1)
+            else:
+                extents.append((block, 1))
+        return extents
+
+    def _build_dedup_index(self) -> None:
+        """Rebuild the content-hash index from the allocated data blocks (dedup drives only)."""
+        self.dedup_index = {}
+        if not self.block_list[0].get("dedup", False):
+            return
+        data_bitmap = self.block_list[self.block_list[0]["data_bitmap_start"]]
+        for i in self._used_indices(data_bitmap):
+            block = self.block_list[self.data_block_address(i)]
+            if isinstance(block, str):  # Skip inode table blocks the table has grown into
+                self.dedup_index.setdefault(self._block_digest(block), i)
+
+    def _forget_block(self, block: int) -> None:
+        """Drop a freed data block from the dedup index."""
+        digest = self._block_digest(self.block_list[self.data_block_address(block)])
+        if self.dedup_index.get(digest) == block:
+            del self.dedup_index[digest]
+
+    def _write_deduplicated(self, data: str, group: int = 0) -> list[tuple] | None:
         """
-        Search for the first available inode in the inode bitmap.
-        Returns the inode index or None if no free inodes exist.
+        Write file data storing each distinct block content only once.
+        Chunks whose content is already on disk take another reference to the
+        existing block; only new content gets freshly allocated (first-fit) blocks,
+        starting in the given block group.
+        Returns the file's extents or None if there isn't enough space.
         """
+        data_bitmap = self.block_list[self.block_list[0]["data_bitmap_start"]]
+        chunks = [data[i:i + CHAR_BLOCK_SIZE] for i in range(0, len(data), CHAR_BLOCK_SIZE)]
+        digests = [self._block_digest(chunk) for chunk in chunks]
+
+        # Count the blocks that actually need allocating before touching anything
+        pending = {}
+        new_blocks = 0
+        for chunk, digest in zip(chunks, digests):
+            existing = self.dedup_index.get(digest)
+            if existing is not None and self.block_list[self.data_block_address(existing)] == chunk:
+                continue
+            if pending.get(digest) == chunk:
+                continue
+            if existing is None and digest not in pending:
+                pending[digest] = chunk
+            new_blocks += 1
+
+        free_blocks = []
+        if new_blocks:
+            free_blocks = self.find_free_data_blocks(new_blocks, group)
+            if free_blocks is None:
+                return None
+        free_iter = (start + j for (start, length) in free_blocks for j in range(length))
+
+        blocks = []
+        for chunk, digest in zip(chunks, digests):
+            block = self.dedup_index.get(digest)
+            if block is None or self.block_list[self.data_block_address(block)] != chunk:
+                block = next(free_iter)
+                self.block_list[self.data_block_address(block)] = chunk  # Write data to block
+                self._charge(self.data_block_address(block), write=True)
+                self.dedup_index.setdefault(digest, block)  # A hash collision is simply left unindexed
+            if not data_bitmap[block]:
+                self._summarise_run(block, 1, 1)
+            data_bitmap[block] += 1
+            blocks.append(block)
+        return self._blocks_to_extents(blocks)
+
+    def dedup_stats(self) -> dict:
+        """
+        Summarise space saved by deduplication and the memory used by the hash index.
+        Logical blocks count every reference (files and snapshots), physical blocks
+        count distinct allocated blocks.
+        """
+        data_bitmap = self.block_list[self.block_list[0]["data_bitmap_start"]]
+        logical = int(data_bitmap.sum()) if self.vectorised else sum(data_bitmap)
+        physical = len(data_bitmap) - self._count_free(data_bitmap)
+        index_bytes = sys.getsizeof(self.dedup_index) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in self.dedup_index.items())
+        return {
+            "enabled": self.block_list[0].get("dedup", False),
+            "logical_blocks": logical,
+            "physical_blocks": physical,
+            "saved_blocks": logical - physical,
+            "saved_bytes": (logical - physical) * CHAR_BLOCK_SIZE,
+            "index_entries": len(self.dedup_index),
+            "index_bytes": index_bytes
+        }
+
+    def find_free_inode(self, parent: int | None = None, directory: bool = False) -> int | None:
+        """
+        Find the lowest free inode, growing the inode table if every one is in use.
+        On a drive with block groups the search starts in the parent directory's
+        group so a directory's entries stay together. New top-level directories
+        are spread out instead, starting in the group with the most free inodes.
+        Each run of the table keeps a next-free hint and a heap of inodes freed
+        below it, so allocation doesn't rescan the bitmap from the start.
+        Returns the inode index or None if no inode can be found or added.
+        """
+        groups = self.group_count()
+        goal = 0
+        if parent is not None and groups > 1:
+            goal = self._inode_goal_group(parent, directory)
+        for g in range(goal, goal + groups):
+            for inodes in self.inode_ranges(g % groups):
+                found = self._free_inode_in(inodes)
+                if found is not None:
+                    return found
+        return self._grow_inode_table(goal)
+
+    def _free_inode_in(self, inodes: range) -> int | None:
+        """Return the lowest free inode in one run of the inode table, or None if it is full."""
         inode_bitmap = self.block_list[self.block_list[0]["inode_bitmap_start"]]
-        for i, used in enumerate(inode_bitmap):
-            if not used:
-                return i
-        return None
+        freed = self.inode_free.setdefault(inodes.start, [])
+        while freed and inode_bitmap[freed[0]]:
+            heapq.heappop(freed)  # Reused since it was freed
+        if freed:
+            return freed[0]
+        hint = self.inode_hints.get(inodes.start, inodes.start)
+        if self.vectorised:
+            found = self._free_indices(inode_bitmap, [range(hint, inodes.stop)], 1)
+            hint = found[0] if found else inodes.stop
+        else:
+            while hint < inodes.stop and inode_bitmap[hint]:
+                hint += 1
+        self.inode_hints[inodes.start] = hint  # Everything below the hint is in use or in the heap
+        return hint if hint < inodes.stop else None
+
+    def _release_inode(self, inode_index: int) -> None:
+        """Mark an inode free and make it available to the allocator again."""
+        self.block_list[self.block_list[0]["inode_bitmap_start"]][inode_index] = False
+        for inodes in self.inode_ranges(self.inode_group(inode_index)):
+            if inode_index in inodes:
+                if inode_index < self.inode_hints.get(inodes.start, inodes.start):
+                    heapq.heappush(self.inode_free.setdefault(inodes.start, []), inode_index)
+                return
+
+    def _reset_inode_allocator(self) -> None:
+        """Forget the allocation hints; they are rebuilt lazily from the bitmap (on mount and after rollbacks)."""
+        self.inode_hints = {}
+        self.inode_free = {}
+
+    def _grow_inode_table(self, group: int = 0) -> int | None:
+        """
+        Add inodes when the table is full, instead of failing. The table grows
+        by half its size into a contiguous run of data blocks (smaller runs are
+        tried if the data area is fragmented), recorded in the superblock's
+        inode_extents. Returns the first new inode, or None if no blocks are free.
+        """
+        superblock = self.block_list[0]
+        per_block = superblock["block_size"] // INODE_SIZE
+        inode_bitmap = self.block_list[superblock["inode_bitmap_start"]]
+        blocks = max(1, math.ceil(len(inode_bitmap) / 2 / per_block))
+        data_bitmap = self.block_list[superblock["data_bitmap_start"]]
+        start = None
+        while blocks and blocks <= self._count_free(data_bitmap) - self.reserved_blocks:
+            start = self._find_free_run(blocks, group)
+            if start is not None:
+                break
+            blocks //= 2
+        if start is None:
+            return None
+
+        self._reference_blocks([(start, blocks)])
+        for b in range(start, start + blocks):
+            self.block_list[self.data_block_address(b)] = [None] * per_block
+            self._charge(self.data_block_address(b), write=True)
+        first = len(inode_bitmap)
+        if self.vectorised:
+            self.block_list[superblock["inode_bitmap_start"]] = np.concatenate((inode_bitmap, np.zeros(blocks * per_block, dtype=bool)))
+        else:
+            inode_bitmap.extend([False] * (blocks * per_block))
+        superblock.setdefault("inode_extents", []).append({"start": start, "blocks": blocks, "first_inode": first})
+        self._charge(0, write=True)
+        return first
     
-    def find_free_data_blocks(self, count: int) -> list[tuple] | None:
+    def _inode_goal_group(self, parent: int, directory: bool) -> int:
+        """Block group to start looking for a free inode in (see find_free_inode)."""
+        if directory and parent == 0:
+            inode_bitmap = self.block_list[self.block_list[0]["inode_bitmap_start"]]
+            return max(range(self.group_count()), key=lambda g: sum(self._count_free(inode_bitmap, r.start, r.stop) for r in self.inode_ranges(g)))
+        return self.inode_group(parent)
+
+    def find_free_data_blocks(self, count: int, group: int = 0) -> list[tuple] | None:
         """
         Find contiguous free data blocks for file storage.
         Returns list of (start_block, length) tuples or None if insufficient space.
-        Uses first-fit allocation strategy.
+        Uses first-fit allocation strategy, starting at the given block group
+        and wrapping around to the others when it is full.
         """
         data_bitmap = self.block_list[self.block_list[0]["data_bitmap_start"]]
         free_blocks = []
-        start = None
-        length = 0
         progress = 0
 
         if count <= 0:
             return None
 
-        for i, used in enumerate(data_bitmap):
-            if not used:
-                if start is None:
-                    start = i
-                length += 1
+        first = self.group_data_blocks(group).start
+        if self.vectorised:
+            found = self._free_indices(data_bitmap, [range(first, len(data_bitmap)), range(first)], count)
+            if len(found) == count:
+                return self._blocks_to_extents(found)
+            return None
+
+        for i in itertools.chain(range(first, len(data_bitmap)), range(first)):
+            if not data_bitmap[i]:
+                if free_blocks and free_blocks[-1][0] + free_blocks[-1][1] == i:
+                    free_blocks[-1] = (free_blocks[-1][0], free_blocks[-1][1] + 1)
+                else:
+                    free_blocks.append((i, 1))
                 progress += 1
                 if progress == count:
-                    free_blocks.append((start, length))
                     return free_blocks
-            else:
-                if start is not None:
-                    free_blocks.append((start, length))
-                    start = None
-                    length = 0
         
         print("ERROR")
         return None
     
+    def _find_free_run(self, count: int, group: int = 0) -> int | None:
+        """
+        Return the first data block of a run of count contiguous free blocks,
+        searching from the given block group to the end and then from the start.
+        Returns None if no run is long enough.
+        """
+        data_bitmap = self.block_list[self.block_list[0]["data_bitmap_start"]]
+        first = self.group_data_blocks(group).start
+        for r in (range(first, len(data_bitmap)), range(first)):
+            if self.vectorised:
+                free = np.concatenate(([0], data_bitmap[r.start:r.stop] == 0, [0])).astype(np.int8)
+                edges = np.diff(free)
+                starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+                long_enough = np.flatnonzero(ends - starts >= count)
+                if len(long_enough):
+                    return int(starts[long_enough[0]]) + r.start
+                continue
+            run = 0
+            for i in r:
+                run = run + 1 if not data_bitmap[i] else 0
+                if run == count:
+                    return i - count + 1
+        return None
+
+    def _allocate_blocks(self, inode_index: int, count: int, old_pointers: list, contiguous: bool = False) -> list[tuple] | None:
+        """
+        Choose and reference count data blocks for a file being (re)written.
+        Blocks the file already owns outright are reused, so a rewrite stays where
+        it was; blocks shared with a snapshot are left to it (copy-on-write) and
+        owned blocks the file no longer needs are freed.
+        Extra blocks come first-fit from the file's block group. With contiguous
+        (delayed allocation and fallocate, where the final size is known) the
+        file is instead grown in place when the blocks after it are free, or moved
+        to the first free run that holds all of it, before falling back to first fit.
+        Returns the extents, or None (with nothing changed) if the drive is full.
+        """
+        data_bitmap = self.block_list[self.block_list[0]["data_bitmap_start"]]
+        group = self.inode_group(inode_index)
+        old_blocks = [b for (start, length) in old_pointers for b in range(start, start + length)]
+        owned = [b for b in old_blocks if data_bitmap[b] == 1]
+        shared = [b for b in old_blocks if data_bitmap[b] > 1]
+        extra = count - len(owned)
+        if extra > 0 and extra > self._count_free(data_bitmap) - self.reserved_blocks:
+            return None
+        self._release_blocks(self._blocks_to_extents(shared))
+        if extra <= 0:
+            self._release_blocks(self._blocks_to_extents(owned[count:]))
+            return self._blocks_to_extents(owned[:count])
+
+        if contiguous:
+            extents = self._blocks_to_extents(owned)
+            if len(extents) == 1 and extents[0][0] + count <= len(data_bitmap) and self._count_free(data_bitmap, extents[0][0] + extents[0][1], extents[0][0] + count) == extra:
+                self._reference_blocks([(extents[0][0] + extents[0][1], extra)])
+                return [(extents[0][0], count)]
+            run = self._find_free_run(count, group)
+            if run is not None:
+                self._release_blocks(extents)
+                self._reference_blocks([(run, count)])
+                return [(run, count)]
+
+        new_extents = self.find_free_data_blocks(extra, group)
+        self._reference_blocks(new_extents)
+        return self._blocks_to_extents(owned + [b for (start, length) in new_extents for b in range(start, start + length)])
+
+    def _write_blocks(self, inode_index: int, data: str, old_pointers: list, preallocated: int, contiguous: bool = False) -> list[tuple] | None:
+        """
+        Allocate blocks for data (at least preallocated of them) and write it out.
+        Returns the file's extents or None if there isn't enough space.
+        """
+        needed = math.ceil(len(data) / CHAR_BLOCK_SIZE)
+        extents = self._allocate_blocks(inode_index, max(needed, preallocated), old_pointers, contiguous)
+        if extents is None:
+            return None
+        blocks = (start + j for (start, length) in extents for j in range(length))
+        for n, block in zip(range(needed), blocks):
+            self.block_list[self.data_block_address(block)] = data[n * CHAR_BLOCK_SIZE:(n + 1) * CHAR_BLOCK_SIZE]  # Write data to block
+            self._charge(self.data_block_address(block), write=True)
+        self._charge(self.block_list[0]["data_bitmap_start"], write=True)
+        return extents
+
+    def _delay_write(self, inode_index: int, data: str, old_pointers: list, preallocated: int) -> bool:
+        """
+        Buffer a file's data instead of placing it (delayed allocation).
+        Only the number of extra blocks it will need is reserved now, so running
+        out of space is still reported at write time; flush() places the data once
+        its final size is known. Returns False if the reservation can't be met.
+        """
+        data_bitmap = self.block_list[self.block_list[0]["data_bitmap_start"]]
+        owned = sum(1 for (start, length) in old_pointers for b in range(start, start + length) if data_bitmap[b] == 1)
+        reserve = max(0, max(math.ceil(len(data) / CHAR_BLOCK_SIZE), preallocated) - owned)
+        previous = self.dirty.get(inode_index, ("", 0))[1]
+        if reserve > self._count_free(data_bitmap) - self.reserved_blocks + previous:
+            return False
+        self.reserved_blocks += reserve - previous
+        self.dirty[inode_index] = (data, reserve)
+        return True
+
+    def _drop_dirty(self, inode_index: int) -> None:
+        """Forget any delayed write pending for an inode and its reservation."""
+        data, reserve = self.dirty.pop(inode_index, ("", 0))
+        self.reserved_blocks -= reserve
+
+    def flush(self) -> int:
+        """
+        Place every delayed write on disk, now that the files' final sizes are known.
+        Each file is grown in place or given one contiguous run where possible.
+        Returns the number of files written.
+        """
+        flushed = 0
+        for inode_index in sorted(self.dirty):
+            data, reserve = self.dirty.pop(inode_index)
+            self.reserved_blocks -= reserve
+            inode = self.get_inode(inode_index)
+            self._account(inode_index, inode, -1)
+            inode["pointers"] = self._write_blocks(inode_index, data, inode["pointers"], inode.get("preallocated", 0), contiguous=True)
+            self._account(inode_index, inode, 1)
+            self._charge(self._inode_location(inode_index)[0], write=True)
+            flushed += 1
+        return flushed
+
+    def fallocate(self, inode_index: int, blocks: int) -> bool:
+        """
+        Preallocate data blocks for a file so it owns at least blocks of them,
+        in one contiguous run where possible. Rewrites keep the preallocated
+        blocks, so a file growing towards its preallocated size stays in place.
+        Returns False if there isn't enough space. Raises QuotaExceeded if the
+        owner doesn't have that many blocks left.
+        """
+        inode = self.get_inode(inode_index)
+        self.flush()
+        self._check_quota(inode_index, inode["uid"], max(blocks, self._inode_charge(inode)[1]))
+        data = self.load_inode(inode_index) if inode.get("inline_data") is not None else None  # Inline content moves out to the blocks
+        stored = data if data is not None else ""
+        if data is None and inode["pointers"]:
+            stored = "".join(self.block_list[self.data_block_address(start + j)] for (start, length) in inode["pointers"] for j in range(length))
+            stored = stored[:sum(length for (length, compressed) in inode["clusters"]) if inode.get("clusters") else inode["size"]]
+        pointers = self._write_blocks(inode_index, stored, inode["pointers"], blocks, contiguous=True)
+        if pointers is None:
+            return False
+        self._account(inode_index, inode, -1)
+        inode["pointers"] = pointers
+        self._account(inode_index, inode, 1)
+        inode["inline_data"] = None
+        inode["preallocated"] = blocks
+        self._charge(self._inode_location(inode_index)[0], write=True)
+        return True
+
     def write_inode(self, data: str, file_inode: Inode, inode_index: int) -> bool:
         """
         Write file data and inode to disk.
         For directories: only creates inode without data blocks.
-        For files: allocates data blocks and writes content.
+        For files: allocates data blocks and writes content. Writing to an inode
+        that already holds a file rewrites it in place, reusing its blocks.
+        On a drive with delayed allocation the data is buffered and placed by flush().
         Returns True on success, False on failure (insufficient space).
+        Raises QuotaExceeded, before anything is allocated, if the owner's quota doesn't allow the write.
         """
-        INODE_BLOCK_START = self.block_list[0]["inode_bitmap_start"]
+        self._check_quota(inode_index, file_inode.uid, 0)
+        # Rewriting an existing file: start from its blocks and keep its preallocation
+        inode_bitmap = self.block_list[self.block_list[0]["inode_bitmap_start"]]
+        old_pointers = []
+        if inode_bitmap[inode_index] and self.get_inode(inode_index)["file_type"].lower() != "directory":
+            old_pointers = self.get_inode(inode_index)["pointers"]
+            file_inode.preallocated = max(file_inode.preallocated, self.get_inode(inode_index).get("preallocated", 0))
+            file_inode.xattrs = {**self.get_inode(inode_index).get("xattrs", {}), **file_inode.xattrs}
 
         if file_inode.file_type.lower() == "directory":
             # For directories, no data blocks are allocated, just set up the inode
+            self._release_blocks(old_pointers)
+            self._drop_dirty(inode_index)
             file_inode.pointers = []
             file_inode.size = 0
             file_inode.update_modified_time()
-            self.block_list[self.block_list[0]["inode_start"] + (inode_index // (self.block_list[0]["block_size"] // 256))][inode_index % (self.block_list[0]["block_size"] // 256)] = file_inode.__dict__
-            self.block_list[INODE_BLOCK_START][inode_index] = True  # Mark inode as used
+            self._commit_inode(inode_index, file_inode.__dict__)
             return True
 
         # File handling: allocate data blocks and write content
-        CHAR_BLOCK_SIZE = 32  # Number of characters per data block (small for demo purposes)
-        
-        # Handle empty files specially
-        if len(data) == 0:
+        # Handle empty files specially (unless they have blocks preallocated)
+        if len(data) == 0 and not file_inode.preallocated:
             # For empty files, no data blocks are needed, just create the inode
+            self._release_blocks(old_pointers)
+            self._drop_dirty(inode_index)
             file_inode.pointers = []
             file_inode.size = 0
+            file_inode.compression = None
+            file_inode.inline_data = None
             file_inode.update_modified_time()
-            self.block_list[self.block_list[0]["inode_start"] + (inode_index // (self.block_list[0]["block_size"] // 256))][inode_index % (self.block_list[0]["block_size"] // 256)] = file_inode.__dict__
-            self.block_list[INODE_BLOCK_START][inode_index] = True  # Mark inode as used
+            self._commit_inode(inode_index, file_inode.__dict__)
             return True
-        
-        DATA_BLOCKS_NEEDED = math.ceil(len(data) / CHAR_BLOCK_SIZE)
-        FREE_DATA_BLOCKS = self.find_free_data_blocks(DATA_BLOCKS_NEEDED)
 
-        if FREE_DATA_BLOCKS is None:
-            return False
+        # Small files live inside the inode itself - no data blocks, bitmap updates or extents.
+        # A rewrite that grows past the limit simply takes the block path below.
+        file_inode.inline_data = None
+        if len(data) <= INLINE_DATA_MAX and self.block_list[0].get("inline_data", True) and not file_inode.preallocated:
+            self._release_blocks(old_pointers)
+            self._drop_dirty(inode_index)
+            file_inode.pointers = []
+            file_inode.size = len(data)
+            file_inode.compression = None
+            file_inode.inline_data = data
+            file_inode.update_modified_time()
+            self._commit_inode(inode_index, file_inode.__dict__)
+            return True
+
+        # Optionally compress the content; the per-file setting overrides the drive default
+        file_size = len(data)
+        algorithm = file_inode.compression if file_inode.compression is not None else self.block_list[0].get("compression", "none")
+        file_inode.compression = None
+        file_inode.clusters = []
+        if algorithm != "none":
+            stored, clusters = compress_data(data, algorithm)
+            if any(compressed for (length, compressed) in clusters):
+                data = stored
+                file_inode.compression = algorithm
+                file_inode.clusters = clusters
+        self._check_quota(inode_index, file_inode.uid, max(math.ceil(len(data) / CHAR_BLOCK_SIZE), file_inode.preallocated))
         
-        # Write data to allocated blocks
-        DATA_BITMAP_START = self.block_list[0]["data_bitmap_start"]
-        DATA_START = self.block_list[0]["data_start"]
-        data_offset = 0
-        for (start, length) in FREE_DATA_BLOCKS:
-            for j in range(length):
-                self.block_list[DATA_BITMAP_START][start + j] = True  # Mark data block as used
-                block_data = data[data_offset:data_offset+CHAR_BLOCK_SIZE]  # Extract chunk for this block
-                self.block_list[DATA_START + start + j] = block_data  # Write data to block
-                data_offset += CHAR_BLOCK_SIZE
+        if self.block_list[0].get("dedup", False):
+            # Identical blocks are stored once and shared between files
+            FREE_DATA_BLOCKS = self._write_deduplicated(data, self.inode_group(inode_index))
+            if FREE_DATA_BLOCKS is None:
+                return False
+            self._release_blocks(old_pointers)  # After the new references, so content the file keeps stays allocated
+            self._charge(self.block_list[0]["data_bitmap_start"], write=True)
+        elif self.block_list[0].get("delalloc", False):
+            # Delayed allocation: keep the old blocks until flush() places the new content
+            if not self._delay_write(inode_index, data, old_pointers, file_inode.preallocated):
+                return False
+            FREE_DATA_BLOCKS = old_pointers
+        else:
+            FREE_DATA_BLOCKS = self._write_blocks(inode_index, data, old_pointers, file_inode.preallocated)  # Keep data near its inode
+            if FREE_DATA_BLOCKS is None:
+                return False
 
         # Update inode metadata and store in inode table
         file_inode.pointers = FREE_DATA_BLOCKS
-        file_inode.size = len(data)
+        file_inode.size = file_size
         file_inode.update_modified_time()
-        self.block_list[self.block_list[0]["inode_start"] + (inode_index // (self.block_list[0]["block_size"] // 256))][inode_index % (self.block_list[0]["block_size"] // 256)] = file_inode.__dict__
-
-        
-
-        self.block_list[INODE_BLOCK_START][inode_index] = True  # Mark inode as used
+        self._commit_inode(inode_index, file_inode.__dict__)
+        if self.reserved_blocks >= DELALLOC_FLUSH_BLOCKS:
+            self.flush()
         return True
     
     def load_inode(self, inode_index: int) -> str | None:
@@ -216,88 +1230,1108 @@ class Drive:
             return None
         
         # Reconstruct file data from blocks pointed to by inode
-        data_inode = self.block_list[self.block_list[0]["inode_start"] + (inode_index // (self.block_list[0]["block_size"] // 256))][inode_index % (self.block_list[0]["block_size"] // 256)]
-        data = ""
-        for (start, length) in data_inode["pointers"]:
-            for j in range(length):
-                data += self.block_list[self.block_list[0]["data_start"] + start + j]
+        data_inode = self.get_inode(inode_index)
+        self._charge(self._inode_location(inode_index)[0])
+        if data_inode.get("inline_data") is not None:
+            return data_inode["inline_data"]
+        if inode_index in self.dirty:
+            data = self.dirty[inode_index][0]  # Delayed write still in memory
+        else:
+            # Only the blocks holding data are read; the rest of a preallocation is empty
+            stored = sum(length for (length, compressed) in data_inode["clusters"]) if data_inode.get("clusters") else data_inode["size"]
+            blocks = (start + j for (start, length) in data_inode["pointers"] for j in range(length))
+            data = ""
+            for n, block in zip(range(math.ceil(stored / CHAR_BLOCK_SIZE)), blocks):
+                data += self.block_list[self.data_block_address(block)]
+                self._charge(self.data_block_address(block))
+        if data_inode.get("clusters"):
+            data = decompress_data(data, data_inode["compression"], data_inode["clusters"])
         return data
     
+    def touch_atime(self, inode_index: int) -> bool:
+        """
+        Record a read of a file in its access time, as the drive's atime mode allows:
+        strictatime on every read, relatime only when the access time isn't newer
+        than the last modification or is more than a day old, noatime never.
+        Returns True if the inode changed and the drive needs saving.
+        """
+        if self.atime_mode == "noatime":
+            return False
+        inode = self.get_inode(inode_index)
+        now = time.time_ns()
+        if self.atime_mode == "relatime" and inode["time_accessed"] > inode["time_modified"] and now - inode["time_accessed"] < RELATIME_INTERVAL:
+            return False
+        # A new record rather than an update in place: snapshots and expanded image runs may share the old one
+        self._store_inode(inode_index, {**inode, "time_accessed": now})
+        self._charge(self._inode_location(inode_index)[0], write=True)
+        return True
+
     def delete_inode(self, inode_index: int) -> bool:
         """
         Delete a file by freeing its inode and all associated data blocks.
         Returns True on success, False if inode wasn't in use.
         """
         inode_bitmap = self.block_list[self.block_list[0]["inode_bitmap_start"]]
-        data_bitmap = self.block_list[self.block_list[0]["data_bitmap_start"]]
         if not inode_bitmap[inode_index]:
             return False
         
-        # Free all data blocks associated with this inode
-        data_inode = self.block_list[self.block_list[0]["inode_start"] + (inode_index // (self.block_list[0]["block_size"] // 256))][inode_index % (self.block_list[0]["block_size"] // 256)]
-        for (start, length) in data_inode["pointers"]:
-            for j in range(length):
-                data_bitmap[start + j] = False  # Mark data block as free
+        # Drop this inode's reference to its data blocks (blocks shared with snapshots stay allocated)
+        data_inode = self.get_inode(inode_index)
+        self._account(inode_index, data_inode, -1)
+        self._index_metadata(inode_index, data_inode, False)
+        self.tree_usage.pop(inode_index, None)
+        self._drop_dirty(inode_index)
+        self._release_blocks(data_inode["pointers"])
+        if data_inode["pointers"]:
+            self._charge(self.block_list[0]["data_bitmap_start"], write=True)
 
-        inode_bitmap[inode_index] = False  # Mark inode as free
+        # Unlink from the parent directory
+        siblings = self.directory_index.get(data_inode["parent"], {})
+        if siblings.get(data_inode["file_name"]) == inode_index:
+            del siblings[data_inode["file_name"]]
+            self._index_name(data_inode["parent"], data_inode["file_name"], data_inode["file_type"], False)
+        self.directory_index.pop(inode_index, None)
+        self.name_index.pop(inode_index, None)
+        self.generation += 1
+        self.access_generation += 1  # The inode may come back with another owner
+
+        self._release_inode(inode_index)  # Mark inode as free
+        self._charge(self.block_list[0]["inode_bitmap_start"], write=True)
         
         return True
     
     def find_file(self, file_name: str) -> int | None:
         """
-        Search for a file by name across all inodes.
+        Look up a file or directory by absolute path (e.g. "/docs/notes.txt").
+        Walks the directory index one component at a time, so the cost is
+        proportional to the path depth rather than the number of inodes.
         Returns inode index if found, None otherwise.
         """
+        return self.find_components([component for component in file_name.split("/") if component != ""])
+
+    def find_components(self, components) -> int | None:
+        """Look up an inode by its path components, like ("docs", "notes.txt"). Returns None if it doesn't exist."""
+        current = 0  # Root directory
+        for component in components:
+            children = self.directory_index.get(current)
+            if children is None or component not in children:
+                return None
+            current = children[component]
+        return current
+
+    def list_directory(self, dir_index: int) -> dict[str, int]:
+        """Return the {name: inode index} entries of a directory (empty if not a directory)."""
+        return self.directory_index.get(dir_index, {})
+
+    def _name_lists(self, dir_index: int) -> dict[str, list]:
+        """Sorted name lists of a directory, split by type, building them on first use."""
+        lists = self.name_index.get(dir_index)
+        if lists is None:
+            lists = {"file": [], "directory": []}
+            for name, child in self.list_directory(dir_index).items():
+                kind = "directory" if self.get_inode(child)["file_type"].lower() == "directory" else "file"
+                lists[kind].append((name.casefold(), name))
+            for entries in lists.values():
+                entries.sort()
+            self.name_index[dir_index] = lists
+        return lists
+
+    def _index_name(self, parent: int, name: str, file_type: str, add: bool) -> None:
+        """Add or remove a name in its directory's sorted name list, if that list has been built."""
+        lists = self.name_index.get(parent)
+        if lists is None:
+            return
+        entries = lists["directory" if file_type.lower() == "directory" else "file"]
+        entry = (name.casefold(), name)
+        if add:
+            bisect.insort(entries, entry)
+        else:
+            position = bisect.bisect_left(entries, entry)
+            if position < len(entries) and entries[position] == entry:
+                del entries[position]
+
+    def complete_names(self, dir_index: int, prefix: str, file_type: str | None = None) -> list[str]:
+        """
+        Names in a directory matching what has been typed, optionally limited to 'file' or 'directory'.
+        Names starting with prefix are found by binary search in the directory's sorted
+        name lists. When there are none, names starting with it in any case are offered,
+        then names starting with its first character and containing the rest in order
+        ("rdme" matches "README.md"), which only scans names sharing that first character.
+        """
+        lists = self._name_lists(dir_index)
+        kinds = [file_type] if file_type is not None else ["directory", "file"]
+        folded = prefix.casefold()
+
+        def starting_with(start: str) -> list[tuple[str, str]]:
+            matches = []
+            for kind in kinds:
+                entries = lists[kind]
+                matches += entries[bisect.bisect_left(entries, (start,)):bisect.bisect_left(entries, (start + "\U0010ffff",))]
+            return matches
+
+        candidates = [name for _, name in starting_with(folded)]
+        exact = [name for name in candidates if name.startswith(prefix)]
+        if exact or candidates or len(folded) < 2:
+            return exact or candidates
+
+        def fuzzy(key: str) -> bool:
+            remaining = iter(key[1:])
+            return all(character in remaining for character in folded[1:])
+        return [name for key, name in starting_with(folded[0]) if fuzzy(key)]
+
+    def path_of(self, inode_index: int) -> str:
+        """Rebuild the absolute path of an inode by walking up its parents."""
+        components = []
+        while inode_index != 0:
+            inode = self.get_inode(inode_index)
+            components.append(inode["file_name"])
+            inode_index = inode["parent"]
+        return "/" + "/".join(reversed(components))
+
+    def _build_directory_index(self) -> None:
+        """
+        Rebuild the in-memory directory index from the inode table.
+        Images written before names were stored relative to the parent hold the
+        full path in file_name; those inodes are converted in place.
+        """
+        self.directory_index = {0: {}}
+        self.name_index = {}
+        self.generation += 1
+        self.access_generation += 1
+        legacy = []
+        for i, inode in self.used_inodes():
+            if "parent" not in inode:
+                legacy.append((inode["file_name"].count("/"), i, inode))
+                continue
+            if inode["file_type"].lower() == "directory":
+                self.directory_index.setdefault(i, {})
+            if i != inode["parent"]:
+                self.directory_index.setdefault(inode["parent"], {})[inode["file_name"]] = i
+
+        # Convert full-path names, shallowest first so parents are indexed before children
+        for depth, i, inode in sorted(legacy, key=lambda entry: entry[:2]):
+            if inode["file_name"] == "/":
+                inode["parent"] = 0
+                continue
+            parent_path, name = inode["file_name"].rsplit("/", 1)
+            parent = self.find_file(parent_path)
+            inode["file_name"] = name
+            inode["parent"] = parent if parent is not None else 0
+            if inode["file_type"].lower() == "directory":
+                self.directory_index.setdefault(i, {})
+            self.directory_index.setdefault(inode["parent"], {})[name] = i
+
+    def _build_indexes(self) -> None:
+        """Rebuild all in-memory indexes after loading or restoring the inode table."""
+        self._build_directory_index()
+        self._build_dedup_index()
+        self._build_usage_summary()
+        self._build_usage_counters()
+        self.metadata_index = None
+        self._reset_inode_allocator()
+
+    def is_ancestor(self, ancestor: int, inode_index: int) -> bool:
+        """Return True if ancestor is inode_index itself or one of its parent directories."""
+        while True:
+            if inode_index == ancestor:
+                return True
+            if inode_index == 0:
+                return False
+            inode_index = self.get_inode(inode_index)["parent"]
+
+    def chmod(self, inode_index: int, permissions: list[int]) -> None:
+        """Set an inode's rwx permissions for its owner, group and everyone else, like [7, 5, 5]."""
+        self.get_inode(inode_index)["permissions"] = list(permissions)
+        self._charge(self._inode_location(inode_index)[0], write=True)
+        self.access_generation += 1
+
+    def chown(self, inode_index: int, uid: str | None = None, gid: str | None = None) -> None:
+        """
+        Change an inode's owner and/or group. Its usage moves to the new owner.
+        Raises QuotaExceeded if the new owner doesn't have room for it.
+        """
+        inode = self.get_inode(inode_index)
+        if uid is not None and uid != inode["uid"]:
+            self._check_quota(inode_index, uid, self._inode_charge(inode)[1])
+            self._account(inode_index, inode, -1)
+            self._index_metadata(inode_index, inode, False)
+            inode["uid"] = uid
+            self._account(inode_index, inode, 1)
+            self._index_metadata(inode_index, inode, True)
+        if gid is not None:
+            inode["gid"] = gid
+        self._charge(self._inode_location(inode_index)[0], write=True)
+        self.access_generation += 1
+
+    def rename(self, inode_index: int, new_parent: int, new_name: str, replace: bool = False) -> bool:
+        """
+        Move an inode to a new parent directory and/or name.
+        Names are stored relative to the parent, so this only touches the one
+        inode and two directory entries regardless of the size of the subtree.
+        With replace, a file already holding the target name is deleted in the
+        same step; otherwise, or if it is a directory, a taken name fails.
+        Returns False if the target name is taken or the move would put a
+        directory inside itself.
+        """
+        existing = self.list_directory(new_parent).get(new_name)
+        if existing == inode_index or self.is_ancestor(inode_index, new_parent):
+            return False
+        if existing is not None and (not replace or self.get_inode(existing)["file_type"].lower() == "directory"):
+            return False
+        if existing is not None:
+            self.delete_inode(existing)
+        inode = self.get_inode(inode_index)
+        if new_parent != inode["parent"]:  # The whole subtree's usage moves with it
+            moved = self._subtree_charge(inode_index)
+            self._charge_ancestors(inode["parent"], moved, -1)
+            self._charge_ancestors(new_parent, moved, 1)
+        del self.directory_index[inode["parent"]][inode["file_name"]]
+        self._index_name(inode["parent"], inode["file_name"], inode["file_type"], False)
+        self._index_metadata(inode_index, inode, False)
+        inode["file_name"] = new_name
+        inode["parent"] = new_parent
+        self._index_metadata(inode_index, inode, True)
+        self.directory_index.setdefault(new_parent, {})[new_name] = inode_index
+        self._index_name(new_parent, new_name, inode["file_type"], True)
+        self.generation += 1
+        self.access_generation += 1  # The paths above the moved entry changed
+        return True
+
+    def set_xattr(self, inode_index: int, name: str, value: str) -> None:
+        """Set a user extended attribute on an inode."""
+        inode = self.get_inode(inode_index)
+        self._index_metadata(inode_index, inode, False)
+        inode["xattrs"] = {**inode.get("xattrs", {}), name: value}  # A new dict: snapshots and copies may share the old one
+        self._index_metadata(inode_index, inode, True)
+        self._charge(self._inode_location(inode_index)[0], write=True)
+
+    def remove_xattr(self, inode_index: int, name: str) -> bool:
+        """Remove a user extended attribute. Returns False if the inode doesn't have it."""
+        inode = self.get_inode(inode_index)
+        if name not in inode.get("xattrs", {}):
+            return False
+        self._index_metadata(inode_index, inode, False)
+        inode["xattrs"] = {key: value for key, value in inode["xattrs"].items() if key != name}
+        self._index_metadata(inode_index, inode, True)
+        self._charge(self._inode_location(inode_index)[0], write=True)
+        return True
+
+    def _build_metadata_index(self) -> None:
+        """
+        Build the secondary indexes find() plans its searches with: (value, inode)
+        lists sorted by name, size and modification time, and sets of inodes keyed
+        by owner, type and extended attribute (both (name, None) and (name, value)).
+        They are kept up to date from then on as inodes are written, renamed,
+        changed and deleted. The root directory isn't indexed.
+        """
+        index = {"name": [], "size": [], "mtime": [], "uid": {}, "type": {}, "xattr": {}}
+        for i, inode in self.used_inodes():
+            if i == inode["parent"]:
+                continue
+            index["name"].append((inode["file_name"], i))
+            index["size"].append((inode["size"], i))
+            index["mtime"].append((inode["time_modified"], i))
+            for key, value in self._metadata_keys(inode):
+                index[key].setdefault(value, set()).add(i)
+        for key in ("name", "size", "mtime"):
+            index[key] = SortedList(index[key])
+        self.metadata_index = index
+
+    @staticmethod
+    def _metadata_keys(inode: dict) -> list[tuple[str, object]]:
+        """The hashed index entries for an inode: (index name, key) pairs."""
+        keys = [("uid", inode["uid"]), ("type", inode["file_type"].lower())]
+        for name, value in inode.get("xattrs", {}).items():
+            keys += [("xattr", (name, None)), ("xattr", (name, value))]
+        return keys
+
+    def _index_metadata(self, inode_index: int, inode: dict, add: bool) -> None:
+        """Add or remove an inode in the secondary indexes, if they have been built."""
+        index = self.metadata_index
+        if index is None or inode_index == inode["parent"]:
+            return
+        for key, value in (("name", inode["file_name"]), ("size", inode["size"]), ("mtime", inode["time_modified"])):
+            if add:
+                index[key].add((value, inode_index))
+            else:
+                index[key].remove((value, inode_index))
+        for key, value in self._metadata_keys(inode):
+            if add:
+                index[key].setdefault(value, set()).add(inode_index)
+            else:
+                members = index[key].get(value)
+                if members is not None:
+                    members.discard(inode_index)
+                    if not members:
+                        del index[key][value]
+
+    def find(self, under: int = 0, name: str | None = None, file_type: str | None = None, uid: str | None = None,
+             size: tuple[int | None, int | None] = (None, None), modified: tuple[str | None, str | None] = (None, None),
+             xattr: tuple[str, str | None] | None = None) -> list[int]:
+        """
+        Inodes below the directory under matching every given predicate: a name
+        glob, type ('file' or 'directory'), owner, size range in bytes (inclusive),
+        modification time range (from inclusive, to exclusive) and an extended
+        attribute (name, value), with a value of None matching any value.
+        The candidates come from whichever index narrows the search most, and
+        only those are checked against the other predicates, so a search costs
+        about the number of candidates rather than the number of inodes.
+        """
+        if self.metadata_index is None:
+            self._build_metadata_index()
+        index = self.metadata_index
+
+        def sorted_range(key: str, low, high, high_inclusive: bool) -> list[int]:
+            end = None if high is None else (high, math.inf) if high_inclusive else (high,)
+            return [i for _, i in index[key].irange(None if low is None else (low,), end)]
+
+        # Every index that applies offers a candidate list; the shortest wins
+        candidates = []
+        if uid is not None:
+            candidates.append(index["uid"].get(uid, set()))
+        if file_type is not None:
+            candidates.append(index["type"].get(file_type, set()))
+        if xattr is not None:
+            candidates.append(index["xattr"].get(xattr, set()))
+        if size != (None, None):
+            candidates.append(sorted_range("size", size[0], size[1], True))
+        if modified != (None, None):
+            candidates.append(sorted_range("mtime", modified[0], modified[1], False))
+        if name is not None:
+            prefix = name[:min((name.index(c) for c in "*?[" if c in name), default=len(name))]  # Literal start of the glob
+            if prefix:
+                candidates.append(sorted_range("name", prefix, prefix + "\U0010ffff", True))
+        if not candidates:  # Nothing narrows it down: match names straight from the name index, without loading inodes
+            candidates.append([i for n, i in index["name"] if name is None or fnmatch.fnmatchcase(n, name)])
+
+        matches = []
+        for i in min(candidates, key=len):
+            inode = self.get_inode(i)
+            if ((uid is None or inode["uid"] == uid)
+                    and (file_type is None or inode["file_type"].lower() == file_type)
+                    and (xattr is None or (xattr[0] in inode.get("xattrs", {}) and xattr[1] in (None, inode["xattrs"][xattr[0]])))
+                    and (size[0] is None or inode["size"] >= size[0]) and (size[1] is None or inode["size"] <= size[1])
+                    and (modified[0] is None or inode["time_modified"] >= modified[0]) and (modified[1] is None or inode["time_modified"] < modified[1])
+                    and (name is None or fnmatch.fnmatchcase(inode["file_name"], name))
+                    and i != under and (under == 0 or self.is_ancestor(under, i))):
+                matches.append(i)
+        return matches
+
+    def remove_tree(self, inode_index: int) -> int:
+        """
+        Delete an inode and, for directories, everything beneath it.
+        Only the subtree is visited. Returns the number of inodes removed.
+        """
+        removed = 0
+        stack = [inode_index]
+        order = []
+        while stack:
+            current = stack.pop()
+            order.append(current)
+            stack.extend(self.list_directory(current).values())
+        for current in reversed(order):  # Children before their parents
+            if self.delete_inode(current):
+                removed += 1
+        return removed
+
+    def copy_tree(self, inode_index: int, target: "Drive", new_parent: int, new_name: str, owner: tuple[str, str] | None = None) -> int | None:
+        """
+        Copy a file or directory tree to new_parent/new_name on target (which may be this drive).
+        On the same drive, copied files share the source's extents (reference counted,
+        copy-on-write); across drives the content is written out again.
+        The copies belong to owner, a (uid, gid) pair, or keep the source's owner and group if it's None.
+        The caller must not copy a directory into its own subtree.
+        Returns the new inode index, or None if the target ran out of inodes or space.
+        """
+        self.flush()  # Delayed writes have no blocks yet for the copy to share
+        source = self.get_inode(inode_index)
+        new_index = target.find_free_inode(new_parent, source["file_type"].lower() == "directory")
+        if new_index is None:
+            return None
+        copy = dict(source, file_name=new_name, parent=new_parent, pointers=[list(p) for p in source["pointers"]])
+        copy["time_created"] = time.time_ns()
+        if owner is not None:
+            copy["uid"], copy["gid"] = owner
+
+        if source["file_type"].lower() == "directory" or target is self or source.get("inline_data") is not None:
+            # Metadata-only copy: directories have no blocks, same-drive files share theirs
+            target._check_quota(new_index, copy["uid"], self._inode_charge(copy)[1])
+            if target is self:
+                self._reference_blocks(copy["pointers"])
+            else:
+                copy["pointers"] = []
+                copy["compression"] = None
+                copy["clusters"] = []
+            target._commit_inode(new_index, copy)
+        else:
+            data_inode = Inode(new_name, source["file_type"], 0, [], copy["uid"], copy["time_created"], list(source["permissions"]), [], source.get("compression"), new_parent, copy.get("gid", DEFAULT_GROUP))
+            data_inode.xattrs = dict(source.get("xattrs", {}))
+            if not target.write_inode(self.load_inode(inode_index), data_inode, new_index):
+                return None
+
+        for name, child in list(self.list_directory(inode_index).items()):
+            if self.copy_tree(child, target, new_index, name, owner) is None:
+                return None
+        return new_index
+
+    def used_inodes(self):
+        """Yield (index, inode) pairs for every allocated inode."""
         inode_bitmap = self.block_list[self.block_list[0]["inode_bitmap_start"]]
-        inode_start = self.block_list[0]["inode_start"]
-        inode_size = self.block_list[0]["inode_size"]
-        inode_per_block = self.block_list[0]["block_size"] // 256
-
-        for i in range(len(inode_bitmap)):
-            if inode_bitmap[i]:
-                inode = self.block_list[inode_start + (i // inode_per_block)][i % inode_per_block]
-                if inode["file_name"] == file_name:
-                    return i
-        return None
+        for i in self._used_indices(inode_bitmap):
+            yield i, self.get_inode(i)
+
+    def seek_distance(self, dir_index: int = 0) -> dict:
+        """
+        Measure locality by simulating a disk head reading every file under a directory.
+        Entries are visited in listing order; each file costs a move to its inode
+        block and then to each of its extents. Distance is the total number of
+        blocks the head travels between reads, so layouts that keep a directory's
+        inodes and data together score lower.
+        """
+        head = self._inode_location(dir_index)[0]
+        stats = {"files": 0, "seeks": 0, "distance": 0}
+        stack = [dir_index]
+        while stack:
+            for name, child in sorted(self.list_directory(stack.pop()).items(), reverse=True):
+                inode = self.get_inode(child)
+                if inode["file_type"].lower() == "directory":
+                    stack.append(child)
+                    continue
+                stats["files"] += 1
+                targets = [(self._inode_location(child)[0], 1)]
+                targets += [(self.data_block_address(start), length) for (start, length) in inode["pointers"]]
+                for (block, length) in targets:
+                    if block != head:
+                        stats["seeks"] += 1
+                        stats["distance"] += abs(block - head)
+                    head = block + length - 1
+        return stats
+
+    def create_snapshot(self, snapshot_name: str) -> bool:
+        """
+        Record a read-only point-in-time snapshot of the file system.
+        Only inode metadata is copied; data blocks are shared with the live drive
+        by bumping their reference counts. Rewrites only reuse blocks a file owns
+        outright, so shared blocks are never modified in place (copy-on-write).
+        Returns False if a snapshot with that name already exists.
+        """
+        if snapshot_name in self.snapshots:
+            return False
+        self.flush()
+        inodes = {}
+        for i, inode in self.used_inodes():
+            inodes[str(i)] = dict(inode, pointers=[list(p) for p in inode["pointers"]])
+            self._reference_blocks(inode["pointers"])
+        self.snapshots[snapshot_name] = {
+            "time": time.time_ns(),
+            "inodes": inodes
+        }
+        return True
+
+    def delete_snapshot(self, snapshot_name: str) -> bool:
+        """
+        Remove a snapshot and release its references to data blocks.
+        Returns False if the snapshot doesn't exist.
+        """
+        snapshot = self.snapshots.pop(snapshot_name, None)
+        if snapshot is None:
+            return False
+        for inode in snapshot["inodes"].values():
+            self._release_blocks(inode["pointers"])
+        return True
+
+    def rollback_snapshot(self, snapshot_name: str) -> bool:
+        """
+        Restore the live file system to the state captured by a snapshot.
+        The snapshot itself is kept. Returns False if the snapshot doesn't exist.
+        """
+        if snapshot_name not in self.snapshots:
+            return False
+        self.flush()
+        inode_bitmap = self.block_list[self.block_list[0]["inode_bitmap_start"]]
+        for i, inode in list(self.used_inodes()):
+            self._release_blocks(inode["pointers"])
+            inode_bitmap[i] = False
+        for index, inode in self.snapshots[snapshot_name]["inodes"].items():
+            self._store_inode(int(index), dict(inode, pointers=[list(p) for p in inode["pointers"]]))
+            self._reference_blocks(inode["pointers"])
+            inode_bitmap[int(index)] = True
+        self._build_indexes()
+        return True
+
+    def clone(self, clone_name: str, snapshot_name: str | None = None) -> "Drive | None":
+        """
+        Create a new writable drive from the live state or from a snapshot.
+        Bitmaps and the inode table are copied, but data blocks are shared by
+        reference with this drive: block contents are immutable strings and a
+        rewrite replaces them in this drive's block list only.
+        Returns None if the snapshot doesn't exist.
+        """
+        if snapshot_name is not None and snapshot_name not in self.snapshots:
+            return None
+        self.flush()
+        superblock = self.block_list[0]
+        block_list = list(self.block_list)  # Shallow copy: data block strings are shared
+        block_list[0] = dict(superblock, name=clone_name)
+        if "inode_extents" in superblock:
+            block_list[0]["inode_extents"] = [dict(extent) for extent in superblock["inode_extents"]]  # The clone's table may grow on its own
+
+        # Fresh copies of the metadata blocks so the clone can diverge
+        for b in self._inode_table_blocks():
+            block_list[b] = [dict(inode) if inode is not None else None for inode in self.block_list[b]]
+        block_list[superblock["inode_bitmap_start"]] = self.block_list[superblock["inode_bitmap_start"]].copy()
+        block_list[superblock["data_bitmap_start"]] = [0] * superblock["data_size"]
+
+        clone = Drive(clone_name, superblock["total_blocks"], block_list=block_list, vectorised=self.vectorised)
+        inode_bitmap = clone.block_list[superblock["inode_bitmap_start"]]
+        if snapshot_name is not None:
+            inode_bitmap[:] = [False] * len(inode_bitmap)
+            for index, inode in self.snapshots[snapshot_name]["inodes"].items():
+                clone._store_inode(int(index), dict(inode, pointers=[list(p) for p in inode["pointers"]]))
+                inode_bitmap[int(index)] = True
+
+        # Rebuild reference counts from the inodes the clone actually owns (and any inode table growth)
+        clone._reference_blocks([(extent["start"], extent["blocks"]) for extent in superblock.get("inode_extents", [])])
+        for i, inode in clone.used_inodes():
+            clone._reference_blocks(inode["pointers"])
+        clone._build_indexes()
+        return clone
     
 
-def save_drive(drive: Drive, filename: str) -> None:
+def _json_default(value):
+    """Serialise NumPy bitmaps as the plain lists the image format uses."""
+    if np is not None and isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+# Compact images (format 2) describe the block list instead of spelling it out:
+#   {"run": n, "of": block}     n identical consecutive blocks (mostly empty data blocks)
+#   {"rle": [v, n, v, n, ...]}  a bitmap as (value, run length) pairs
+#   {"inodes": [r, n, ...]}     an inode table block as (record, run length) pairs, where a
+#                               record is a list of field values in "inode_fields" order with
+#                               the extents flattened to [start, length, start, length, ...]
+# Anything else is a block as is, so images written in the pretty format decode the same way.
+INODE_FIELDS = list(Inode("", "free", 0, [], "", 0, [7,7,7]).__dict__)
+
+_image_format = "compact"
+
+def set_image_format(image_format: str) -> None:
+    """Choose whether save_drive writes compact or pretty (readable) images. Both load the same way."""
+    global _image_format
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image format: {image_format}")
+    _image_format = image_format
+
+def get_image_format() -> str:
+    return _image_format
+
+def _run_lengths(values) -> list:
+    """Run-length encode a sequence as a flat [value, count, value, count, ...] list."""
+    if np is not None and isinstance(values, np.ndarray):
+        if not len(values):
+            return []
+        starts = np.concatenate(([0], np.flatnonzero(values[1:] != values[:-1]) + 1))
+        counts = np.diff(np.append(starts, len(values)))
+        return [item for pair in zip(values[starts].tolist(), counts.tolist()) for item in pair]
+    runs = []
+    for value, group in itertools.groupby(values):
+        runs += (value, sum(1 for _ in group))
+    return runs
+
+def _expand_runs(runs: list) -> list:
+    values = []
+    for i in range(0, len(runs), 2):
+        values.extend([runs[i]] * runs[i + 1])
+    return values
+
+def _inode_record(inode: dict | None) -> list | dict | None:
+    """An inode as a list of field values. Inodes with fields this version doesn't know stay dicts."""
+    if inode is None or not inode.keys() <= _INODE_FIELD_SET:
+        return inode
+    defaults = _inode_defaults() if len(inode) < len(INODE_FIELDS) else None  # Images from before a field existed
+    record = [inode[field] if field in inode else defaults[field] for field in INODE_FIELDS]
+    record[_POINTERS] = [n for extent in record[_POINTERS] for n in extent]
+    return record
+
+def _inode_from_record(record: list | dict | None, fields: list[str]) -> dict | None:
+    if not isinstance(record, list):
+        return record
+    inode = dict(zip(fields, record))
+    pointers = inode["pointers"]
+    inode["pointers"] = [[pointers[i], pointers[i + 1]] for i in range(0, len(pointers), 2)]
+    if len(fields) < len(INODE_FIELDS):
+        inode = {**_inode_defaults(), **inode}
+    return inode
+
+def _inode_defaults() -> dict:
+    return Inode("", "free", 0, [], "", 0, [7,7,7]).__dict__
+
+_INODE_FIELD_SET = set(INODE_FIELDS)
+_POINTERS = INODE_FIELDS.index("pointers")
+
+def compact_blocks(blocks) -> list:
+    """Encode a block list (or a pool member's blocks) in the compact image format."""
+    compact = []
+    i, count = 0, len(blocks)
+    while i < count:
+        block = blocks[i]
+        if block is None or isinstance(block, str):
+            j = i + 1
+            while j < count and type(blocks[j]) is type(block) and blocks[j] == block:
+                j += 1
+            compact.append(block if j == i + 1 else {"run": j - i, "of": block})
+            i = j
+            continue
+        if np is not None and isinstance(block, np.ndarray):
+            compact.append({"rle": _run_lengths(block)})
+        elif isinstance(block, list) and block and (block[0] is None or isinstance(block[0], dict)):
+            compact.append({"inodes": _run_lengths([_inode_record(inode) for inode in block])})
+        elif isinstance(block, list) and block and isinstance(block[0], (bool, int)):
+            compact.append({"rle": _run_lengths(block)})
+        else:
+            compact.append(block)
+        i += 1
+    return compact
+
+def expand_blocks(compact: list, fields: list[str] = INODE_FIELDS) -> list:
+    """Decode a block list written by compact_blocks; blocks written out in full pass through unchanged."""
+    blocks = []
+    for block in compact:
+        if isinstance(block, dict):
+            if "run" in block:
+                blocks.extend([block["of"]] * block["run"])
+                continue
+            if "rle" in block:
+                blocks.append(_expand_runs(block["rle"]))
+                continue
+            if "inodes" in block:
+                blocks.append([_inode_from_record(record, fields) for record in _expand_runs(block["inodes"])])
+                continue
+        blocks.append(block)
+    return blocks
+
+def _dump_image(image: dict) -> str:
+    """Serialise an image dict in the current image format."""
+    if _image_format == "pretty":
+        return json.dumps(image, indent=4, default=_json_default)
+    if load_orjson() is not None:
+        return orjson.dumps(image, default=_json_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode()
+    return json.dumps(image, separators=(",", ":"), default=_json_default)
+
+def _load_image(text: str):
+    return orjson.loads(text) if load_orjson() is not None else json.loads(text)
+
+def _image_blocks(blocks) -> dict:
+    """The block list part of an image, in the current image format."""
+    if _image_format == "pretty":
+        return {"block_list": blocks}
+    return {"inode_fields": INODE_FIELDS, "block_list": compact_blocks(blocks)}
+
+def encode_drive(drive: Drive) -> str:
+    """Return the JSON text that save_drive writes for a drive."""
+    return _dump_image({**_image_blocks(drive.block_list), "snapshots": drive.snapshots})
+
+def upgrade_drive(drive: Drive) -> int | None:
+    """
+    Bring a drive loaded from an older image up to IMAGE_SCHEMA.
+    Returns the schema it was upgraded from, or None if it was already current.
+      1 -> 2  the compact image format; the blocks themselves are unchanged
+      2 -> 3  timestamps stored as nanoseconds since the epoch instead of formatted strings
+    """
+    superblock = drive.block_list[0]
+    schema = superblock.get("schema", 1)
+    if schema >= IMAGE_SCHEMA:
+        return None
+    if schema < 3:
+        def convert(inode: dict) -> dict:
+            times = {field: parse_time(inode[field]) if inode.get(field) and inode["file_type"] != "free" else 0
+                     for field in ("time_accessed", "time_modified", "time_created")}
+            if inode.get("time_deleted"):
+                times["time_deleted"] = parse_time(inode["time_deleted"])
+            return {**inode, **times}
+        for block in drive._inode_table_blocks():
+            drive.block_list[block] = [inode if inode is None else convert(inode) for inode in drive.block_list[block]]
+        for snapshot in drive.snapshots.values():
+            snapshot["time"] = parse_time(snapshot["time"])
+            snapshot["inodes"] = {index: convert(inode) for index, inode in snapshot["inodes"].items()}
+        drive.metadata_index = None  # Built from the string times if a search already ran
+    superblock["schema"] = IMAGE_SCHEMA
+    return schema
+
+_deferred_saves: dict[str, Drive] | None = None  # Filename -> drive awaiting its save, while saves are deferred
+
+def defer_saves() -> None:
+    """Hold back save_drive writes until flush_saves (used by batch runs to write each image once)."""
+    global _deferred_saves
+    if _deferred_saves is None:
+        _deferred_saves = {}
+
+def flush_saves() -> tuple[int, int]:
+    """Write every deferred image and go back to saving immediately. Returns (images written, images that failed)."""
+    global _deferred_saves
+    pending, _deferred_saves = _deferred_saves or {}, None
+    written = sum(save_drive(drive, filename) for filename, drive in pending.items())
+    return written, len(pending) - written
+
+def discard_saves() -> None:
+    """Drop every deferred image without writing it and go back to saving immediately."""
+    global _deferred_saves
+    _deferred_saves = None
+
+def drive_names() -> list[str]:
+    """Names of the drive images in the drive bay, plus drives whose first save is still deferred or waiting for write-back."""
+    names = [f[:-5] for f in os.listdir(SAVE_PATH) if f.endswith(".json")] if os.path.exists(SAVE_PATH) else []
+    pending = list(_deferred_saves or {}) + (_write_back.filenames() if _write_back is not None else [])
+    return names + [f[:-5] for f in dict.fromkeys(pending) if f[:-5] not in names]
+
+def discard_save(filename: str) -> bool:
+    """Forget a deferred or dirty image (its drive file is being removed). Returns True if one was pending."""
+    if _write_back is not None and _write_back.discard(filename):
+        return True
+    return _deferred_saves is not None and _deferred_saves.pop(filename, None) is not None
+
+def _pending_save(filename: str) -> Drive | None:
+    """The drive behind an image that hasn't been written yet, if there is one."""
+    if _deferred_saves is not None and filename in _deferred_saves:
+        return _deferred_saves[filename]
+    return _write_back.pending(filename) if _write_back is not None else None
+
+_durability = "commit"
+_unsynced: set[str] = set()  # Images renamed into place but not yet synced, at the "periodic" level
+_last_sync = 0.0
+
+def set_durability(level: str) -> None:
+    """
+    Choose how save_drive makes images durable:
+      none      atomic rename only; a power loss may lose recent saves
+      commit    sync the image and the drive bay before every save returns
+      periodic  sync whatever was saved at most every DURABILITY_INTERVAL seconds
+    """
+    global _durability
+    if level not in DURABILITY_LEVELS:
+        raise ValueError(f"Unknown durability level: {level}")
+    if _durability == "periodic" and level != "periodic":
+        sync_drives()  # Don't strand images saved under the old level
+    _durability = level
+
+def get_durability() -> str:
+    return _durability
+
+def _sync_directory(path: str) -> None:
+    """Sync a directory so renames inside it survive a power loss (directories can't be opened on Windows)."""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def sync_drives() -> int:
+    """Sync every image saved since the last sync. Returns the number of images synced."""
+    global _last_sync
+    synced = 0
+    for path in _unsynced:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            continue  # Removed since it was saved
+        try:
+            os.fsync(fd)
+            synced += 1
+        finally:
+            os.close(fd)
+    _unsynced.clear()
+    if synced:
+        _sync_directory(SAVE_PATH)
+    _last_sync = time.monotonic()
+    return synced
+
+def _write_image(path: str, text: str) -> None:
+    """
+    Replace an image file atomically: write a temporary file beside it, then
+    rename it over the old one, so a crash leaves either the old or the new image.
+    """
+    temp = os.path.join(os.path.dirname(path), "." + os.path.basename(path) + ".tmp")
+    try:
+        with open(temp, "w") as f:
+            f.write(text)
+            if _durability == "commit":
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+    if _durability == "commit":
+        _sync_directory(os.path.dirname(path))
+    elif _durability == "periodic":
+        _unsynced.add(path)
+        if time.monotonic() - _last_sync >= DURABILITY_INTERVAL:
+            sync_drives()
+
+def save_drive(drive: Drive, filename: str) -> bool:
     """
     Serialize a Drive object to JSON file for persistent storage.
     Creates the save directory if it doesn't exist.
+    The file is replaced atomically and synced according to the durability level.
+    While saves are deferred the drive is only remembered, and written by flush_saves;
+    while write-back is running it is marked dirty and written by the write-back thread.
+    Returns False (after reporting why on stderr) if the image couldn't be written;
+    the previous image is then left as it was.
+    """
+    if _deferred_saves is not None:
+        _deferred_saves[filename] = drive
+        return True
+    if _write_back is not None:
+        _write_back.mark(drive, filename)
+        return True
+    return _write_images(_encode_images(drive, filename))
+
+def pool_member_file(pool_name: str, member: int) -> str:
+    """File name of a pool member's image in the drive bay."""
+    return f"{pool_name}.{member}.json"
+
+def _encode_images(drive: Drive, filename: str) -> list[tuple[str, str]]:
+    """
+    Encode the files that make up a drive's image, in the order they should be written.
+    A pool has one image per member that is online, followed by its descriptor.
     """
-    if not os.path.exists(SAVE_PATH):
-        os.makedirs(SAVE_PATH)
+    drive.flush()  # Images only ever hold placed data
+    if not isinstance(drive.block_list, PooledBlockList):
+        return [(filename, encode_drive(drive))]
+    pool = drive.block_list
+    pool.update_parity()
+    images = []
+    for k in pool.online():
+        member = _image_blocks(pool.members[k])
+        member["blocks"] = member.pop("block_list")
+        images.append((pool_member_file(pool.name, k), _dump_image({"pool_member": {"pool": pool.name, "member": k}, **member})))
+    images.append((filename, _dump_image({"pool": pool.descriptor(), "snapshots": drive.snapshots})))
+    return images
+
+def _write_images(images: list[tuple[str, str]]) -> bool:
+    """Write encoded image files to the drive bay. Returns False (after reporting why on stderr) if one couldn't be written."""
     try:
-        with open(os.path.join(SAVE_PATH, filename), "w") as f:
-            json.dump(drive.__dict__, f, indent=4)
+        if not os.path.exists(SAVE_PATH):
+            os.makedirs(SAVE_PATH)
+        for filename, text in images:
+            _write_image(os.path.join(SAVE_PATH, filename), text)
+        return True
     except Exception as e:
-        print(f"Error writing to file: {e}")
+        print(f"Error writing to file {filename}: {e}", file=sys.stderr)
+        return False
+
+drive_lock = threading.RLock()  # Held while a command works on drives, and while the write-back thread encodes one
+
+class WriteBack:
+    """
+    Background writer for drive images. save_drive only marks a drive dirty; the
+    thread writes it once saves have paused for WRITE_BACK_IDLE seconds, or after
+    WRITE_BACK_INTERVAL seconds at the latest, so repeated saves of the same drive
+    are coalesced into one write and commands don't wait for serialisation.
+    Drives are encoded while holding drive_lock, then written without it.
+    """
+    def __init__(self) -> None:
+        self.condition = threading.Condition()
+        self.dirty: dict[str, Drive] = {}    # Filename -> drive saved since its last write
+        self.failed: dict[str, Drive] = {}   # Background writes that failed, retried by flush
+        self.writing: dict[str, Drive] = {}  # Images being written right now
+        self.first_dirty = 0.0
+        self.last_dirty = 0.0
+        self.running = True
+        self.saves = 0
+        self.writes = 0
+        self.thread = threading.Thread(target=self._run, name="write-back", daemon=True)
+        self.thread.start()
+
+    def mark(self, drive: Drive, filename: str) -> None:
+        with self.condition:
+            now = time.monotonic()
+            if not self.dirty:
+                self.first_dirty = now
+            self.last_dirty = now
+            self.dirty[filename] = drive
+            self.failed.pop(filename, None)  # Superseded by the new save
+            self.saves += 1
+            self.condition.notify()
+
+    def pending(self, filename: str) -> Drive | None:
+        with self.condition:
+            for images in (self.dirty, self.writing, self.failed):
+                if filename in images:
+                    return images[filename]
+            return None
+
+    def filenames(self) -> list[str]:
+        with self.condition:
+            return list({**self.dirty, **self.writing, **self.failed})
+
+    def discard(self, filename: str) -> bool:
+        """Drop a dirty image, after any write of it in progress has finished. Returns True if one was pending."""
+        with self.condition:
+            while self.writing:
+                self.condition.wait()
+            return self.dirty.pop(filename, None) is not None or self.failed.pop(filename, None) is not None
+
+    def _run(self) -> None:
+        while True:
+            with self.condition:
+                while self.running:
+                    if not self.dirty:
+                        self.condition.wait()
+                        continue
+                    due = min(self.last_dirty + WRITE_BACK_IDLE, self.first_dirty + WRITE_BACK_INTERVAL)
+                    if time.monotonic() >= due:
+                        break
+                    self.condition.wait(due - time.monotonic())
+                if not self.running:
+                    return
+            with drive_lock:  # Wait for the running command to finish with the drives
+                self._write(retry=False)
+
+    def _write(self, retry: bool) -> tuple[int, int]:
+        """Encode and write the dirty images (plus failed ones if retry). Call with drive_lock held."""
+        with self.condition:
+            while self.writing:
+                self.condition.wait()
+            self.writing, self.dirty = self.dirty, {}
+            if retry:
+                self.writing.update(self.failed)
+                self.failed.clear()
+        encoded, failed = [], {}
+        for filename, drive in self.writing.items():
+            try:
+                encoded.append((filename, drive, _encode_images(drive, filename)))
+            except Exception as e:
+                print(f"Error encoding {filename}: {e}", file=sys.stderr)
+                failed[filename] = drive
+        drive_lock.release()  # Writing doesn't touch the drives
+        try:
+            for filename, drive, images in encoded:
+                if not _write_images(images):
+                    failed[filename] = drive
+        finally:
+            with self.condition:  # Before taking drive_lock back, or a waiting flush would deadlock
+                for filename, drive in failed.items():
+                    self.failed.setdefault(filename, drive)
+                written = len(self.writing) - len(failed)
+                self.writes += written
+                self.writing = {}
+                self.condition.notify_all()
+            drive_lock.acquire()
+        return written, len(failed)
+
+    def flush(self) -> tuple[int, int]:
+        """Write every dirty image now, retrying failed ones. Returns (images written, images that failed)."""
+        with drive_lock:
+            return self._write(retry=True)
+
+    def stop(self) -> tuple[int, int]:
+        """Flush and stop the thread."""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
+        return self.flush()
+
+    def stats(self) -> dict:
+        with self.condition:
+            return {"saves": self.saves, "writes": self.writes, "dirty": len(self.dirty) + len(self.failed)}
+
+_write_back: WriteBack | None = None
+
+def start_write_back() -> None:
+    """Save drives in the background from now on (see WriteBack)."""
+    global _write_back
+    if _write_back is None:
+        _write_back = WriteBack()
+
+def stop_write_back() -> tuple[int, int]:
+    """Write every dirty image and go back to saving immediately. Returns (images written, images that failed)."""
+    global _write_back
+    write_back, _write_back = _write_back, None
+    return write_back.stop() if write_back is not None else (0, 0)
+
+def sync_saves() -> tuple[int, int]:
+    """Write every dirty image now, if write-back is running. Returns (images written, images that failed)."""
+    return _write_back.flush() if _write_back is not None else (0, 0)
+
+def write_back_stats() -> dict | None:
+    """Saves made and images written since write-back started, or None if it isn't running."""
+    return _write_back.stats() if _write_back is not None else None
+
+def _load_pool(descriptor: dict) -> PooledBlockList | None:
+    """Read a pool's member images. Missing members leave the pool degraded, if its level can survive that."""
+    members = []
+    for k in range(descriptor["members"]):
+        try:
+            with open(os.path.join(SAVE_PATH, pool_member_file(descriptor["name"], k)), "r") as f:
+                member = _load_image(f.read())
+            members.append(expand_blocks(member["blocks"], member.get("inode_fields", INODE_FIELDS)))
+        except FileNotFoundError:
+            print(f"Pool {descriptor['name']}: member {k} is missing.")
+            members.append(None)
+    missing = members.count(None)
+    if not PooledBlockList.tolerates(descriptor["level"], len(members), missing):
+        print(f"Pool {descriptor['name']} ({descriptor['level']}) cannot run with {missing} missing member(s).")
+        return None
+    return PooledBlockList(descriptor["name"], descriptor["level"], members, descriptor["length"])
+
+def create_pool(name: str, level: str, members: int, total_blocks: int, **options) -> Drive:
+    """
+    Format a new drive of total_blocks logical blocks and spread it over a pool of
+    members. Options are passed on to Drive (block_size, inode_count, groups, device, ...).
+    """
+    drive = Drive(name, total_blocks, **options)
+    drive.block_list = PooledBlockList.from_blocks(name, level, members, drive.block_list)
+    drive.attach_device()
+    return drive
 
 def load_drive(filename: str) -> Drive | None:
     """
     Load a Drive object from JSON file.
     Returns Drive instance or None if file not found or corrupted.
+    A drive whose save is still deferred or dirty is returned as is, since its file is out of date.
     """
+    pending = _pending_save(filename)
+    if pending is not None:
+        return pending
     try:
         with open(os.path.join(SAVE_PATH, filename), "r") as f:
-            data = json.load(f)
-            # Reconstruct Drive object from saved data
-            drive = Drive(name=data["block_list"][0]["name"], total_blocks=data["block_list"][0]["total_blocks"], block_list=data["block_list"])
-            return drive
+            data = _load_image(f.read())
     except FileNotFoundError:
         print(f"File {filename} not found.")
         return None
-    except json.JSONDecodeError:
+    except json.JSONDecodeError:  # orjson's decode error is a subclass
         print(f"Error decoding JSON from file {filename}.")
         return None
+    if "pool_member" in data:
+        print(f"{filename} is member {data['pool_member']['member']} of pool {data['pool_member']['pool']}; mount the pool instead.")
+        return None
+    if "pool" in data:
+        block_list = _load_pool(data["pool"])
+        if block_list is None:
+            return None
+        drive = Drive(name=data["pool"]["name"], total_blocks=data["pool"]["length"], block_list=block_list, snapshots=data.get("snapshots"))
+    else:
+        # Reconstruct Drive object from saved data
+        block_list = expand_blocks(data["block_list"], data.get("inode_fields", INODE_FIELDS))
+        drive = Drive(name=block_list[0]["name"], total_blocks=block_list[0]["total_blocks"], block_list=block_list, snapshots=data.get("snapshots"))
+    old_schema = upgrade_drive(drive)
+    if old_schema is not None:
+        # Rewrite the old file straight away so the upgrade only happens once
+        print(f"Upgraded {filename} from image format {old_schema} to {IMAGE_SCHEMA}.")
+        save_drive(drive, filename)
+    return drive
 
 if __name__ == "__main__":
     # Demo/testing code for the disk simulator
     MainDrive = Drive("A", total_blocks=64)
     drive = MainDrive.block_list
-    test_inode = Inode("test.txt", "File", 1, [], "user", datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), [7,7,7], [])
-    test_inode2 = Inode("test2.txt", "File", 1, [], "user", datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), [7,7,7], [])
+    test_inode = Inode("test.txt", "File", 1, [], "user", time.time_ns(), [7,7,7], [])
+    test_inode2 = Inode("test2.txt", "File", 1, [], "user", time.time_ns(), [7,7,7], [])
 
     MainDrive.write_inode("Hello, World! This is a test file.", test_inode, MainDrive.find_free_inode())
     print(MainDrive.load_inode(1))
@@ -1,11 +1,50 @@
+import argparse
 import cmd2
+import sys
 from disk_simulator import *
+from paths import *
+from access import *
 import time
 
+class MountTable(dict):
+    """
+    Mounted drives keyed by path letter. A drive can be mounted as a factory that
+    builds it the first time it is looked up, so starting the shell costs nothing
+    for drives a session never touches.
+    """
+    def __init__(self, factories: dict) -> None:
+        super().__init__(dict.fromkeys(factories))  # None marks a drive not built yet
+        self.factories = dict(factories)
+
+    def __getitem__(self, path: str) -> Drive:
+        drive = super().__getitem__(path)
+        if drive is None and path in self.factories:
+            drive = self.factories.pop(path)()
+            super().__setitem__(path, drive)
+        return drive
+
+    def __setitem__(self, path: str, drive: Drive) -> None:
+        self.factories.pop(path, None)
+        super().__setitem__(path, drive)
+
+    def __delitem__(self, path: str) -> None:
+        self.factories.pop(path, None)
+        super().__delitem__(path)
+
+    def get(self, path: str, default=None) -> Drive | None:
+        return self[path] if path in self else default
+
+    def values(self) -> list[Drive]:
+        return [self[path] for path in self]
+
+    def items(self) -> list[tuple[str, Drive]]:
+        return [(path, self[path]) for path in self]
+
 # Global state for the file system simulator
-mounted_drives: dict[str, Drive] = {"A": Drive("A", 64), "B": Drive("B", 128)}  # Pre-mount sample drives
-drive_choices:list[str] = [f[:-5] for f in os.listdir(SAVE_PATH) if f.endswith(".json")] if os.path.exists(SAVE_PATH) else []  # Available drive files
+mounted_drives = MountTable({"A": lambda: Drive("A", 64), "B": lambda: Drive("B", 128)})  # Sample drives, built when first used
 pwd = {"drive": None, "path": "/"}  # Current working directory state
+resolver = PathResolver(mounted_drives, pwd)  # Shared, cached path resolution for commands and completers
+access = AccessChecker()  # The session's user and groups, with cached permission decisions
 
 class MyApp(cmd2.Cmd):
     """
@@ -17,6 +56,109 @@ class MyApp(cmd2.Cmd):
         self.intro = "Welcome to MyApp! Type help or ? to list commands.\nDemo available with 'demo' command."
         self.prompt = "AFS$ "
         self.set_window_title("AFS Command Line Interface")
+        self.batch = False              # Batch mode: never prompt, stop at the first failing command
+        self.command_failed = False     # Set by perror while a command runs
+        self.command_completed = False  # Set once a command gets past argument parsing and runs to the end
+        self.register_postcmd_hook(self._command_completed)
+        self.durability = get_durability()
+        self.add_settable(cmd2.Settable('durability', str, 'How drive images reach stable storage: none, commit or periodic', self,
+                                        choices=DURABILITY_LEVELS, onchange_cb=self._durability_changed))
+        self.image_format = get_image_format()
+        self.add_settable(cmd2.Settable('image_format', str, 'How drive images are written: compact or pretty (indented, every block written out)', self,
+                                        choices=IMAGE_FORMATS, onchange_cb=self._image_format_changed))
+
+    def _durability_changed(self, name: str, old: str, new: str) -> None:
+        set_durability(new)
+
+    def _image_format_changed(self, name: str, old: str, new: str) -> None:
+        set_image_format(new)
+
+    def onecmd(self, statement: cmd2.Statement | str, *, add_to_history: bool = True) -> bool:
+        """
+        Run a command while holding the drive lock, so the write-back thread never encodes a drive mid-change.
+        A write refused by a quota is reported as the command's error, however deep in the command it happened.
+        """
+        with drive_lock:
+            try:
+                return super().onecmd(statement, add_to_history=add_to_history)
+            except QuotaExceeded as e:
+                self.perror(str(e))
+                return False
+
+    def _command_completed(self, data: cmd2.plugin.PostcommandData) -> cmd2.plugin.PostcommandData:
+        """Postcommand hook; cmd2 skips it when a command's arguments fail to parse."""
+        self.command_completed = True
+        return data
+
+    def perror(self, msg: object = '', *, end: str = '\n', apply_style: bool = True) -> None:
+        """Print an error and remember that the current command failed."""
+        self.command_failed = True
+        super().perror(msg, end=end, apply_style=apply_style)
+
+    def pfeedback(self, msg: object, *, end: str = '\n') -> None:
+        """Print feedback like I/O timings; cmd2 sends it through perror, which mustn't count as a failure."""
+        failed = self.command_failed
+        super().pfeedback(msg, end=end)
+        self.command_failed = failed
+
+    def _ask(self, message: str) -> str | None:
+        """Prompt for a missing value. Batch mode never prompts and returns None instead."""
+        if self.batch:
+            return None
+        self.poutput(message)
+        return input()
+
+    def run_batch(self, source: str) -> int:
+        """
+        Run commands from a file ("-" for stdin) without prompting, one per line; blank lines and # comments are skipped.
+        Stops at the first command that fails. Drive images are written once, after every command has succeeded,
+        so a failed batch leaves the drive bay as it was (removed drive files aside).
+        Returns the exit code: 0 on success, 1 if a command failed, 2 if the batch can't be read.
+        """
+        try:
+            if source == "-":
+                lines = sys.stdin.read().splitlines()
+            else:
+                with open(source, "r") as f:
+                    lines = f.read().splitlines()
+        except OSError as e:
+            self.perror(f"Error: Cannot read batch file {source}: {e}")
+            return 2
+
+        self.batch = True
+        defer_saves()
+        timings: dict[str, list] = {}  # Command name -> [runs, total seconds, slowest seconds]
+        start = time.perf_counter()
+        for number, line in enumerate(lines, 1):
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            self.command_failed = False
+            self.command_completed = False
+            began = time.perf_counter()
+            stop = self.onecmd_plus_hooks(line)
+            elapsed = time.perf_counter() - began
+            timing = timings.setdefault(line.split()[0], [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += elapsed
+            timing[2] = max(timing[2], elapsed)
+            if self.command_failed or not self.command_completed:
+                discard_saves()
+                self.perror(f"Batch stopped at line {number}: {line.strip()}")
+                return 1
+            if stop:  # quit
+                break
+
+        saving = time.perf_counter()
+        saved, unsaved = flush_saves()
+        finished = time.perf_counter()
+        if unsaved:
+            self.perror(f"Batch finished, but {unsaved} drive image{'s' if unsaved != 1 else ''} could not be saved.")
+            return 1
+        self.pfeedback(f"{'Command':<12} {'Runs':>6} {'Total ms':>10} {'Mean ms':>9} {'Max ms':>9}")
+        for name, (runs, total, slowest) in sorted(timings.items(), key=lambda item: -item[1][1]):
+            self.pfeedback(f"{name:<12} {runs:>6} {total * 1000:>10.2f} {total / runs * 1000:>9.3f} {slowest * 1000:>9.3f}")
+        self.pfeedback(f"Batch: {sum(t[0] for t in timings.values())} commands in {(saving - start) * 1000:.2f} ms, {saved} drive image{'s' if saved != 1 else ''} saved in {(finished - saving) * 1000:.2f} ms")
+        return 0
     
     # Remove unwanted cmd2 built-in commands for security/simplicity
     delattr(cmd2.Cmd, 'do_shell')
@@ -26,292 +168,61 @@ class MyApp(cmd2.Cmd):
     delattr(cmd2.Cmd, 'do_edit')
 
     # Completion functions for tab completion
-    def _complete_path_directories(self, text: str, line: str, begidx: int, endidx: int) -> list[str]:
-        """Complete directory paths for commands like cd and ls."""
+    def _matching_children(self, resolved: ResolvedPath, prefix: str, file_type: str | None = None) -> list[str]:
+        """Names of the entries in a resolved directory matching prefix (see Drive.complete_names), optionally limited to 'file' or 'directory'."""
+        if not resolved.is_directory():
+            return []
+        return resolved.drive.complete_names(resolved.inode, prefix, file_type)
+
+    def _complete_path(self, text: str, file_type: str | None, include_root: bool) -> list[str]:
+        """Shared implementation of the path completers below."""
         completions = []
-        
-        # If text contains ':', parse drive and path parts
-        if ':' in text:
-            try:
-                drive_part, path_part = text.split(':', 1)
-                drive_letter = drive_part.upper()
-                
-                if drive_letter not in mounted_drives:
-                    return []
-                
-                drive = mounted_drives[drive_letter]
-                
-                # Handle root directory completion
-                if path_part == "/" or path_part == "":
-                    completions.append(f"{drive_letter}:/")
-                    # Add direct children of root
-                    inode_bitmap = drive.block_list[drive.block_list[0]["inode_bitmap_start"]]
-                    inode_start = drive.block_list[0]["inode_start"]
-                    inode_per_block = drive.block_list[0]["block_size"] // 256
-                    
-                    for i in range(len(inode_bitmap)):
-                        if inode_bitmap[i]:
-                            inode = drive.block_list[inode_start + (i // inode_per_block)][i % inode_per_block]
-                            if inode["file_type"].lower() == "directory" and inode["file_name"] != "/":
-                                dir_name = inode["file_name"]
-                                if dir_name.startswith("/") and "/" not in dir_name[1:]:
-                                    completions.append(f"{drive_letter}:{dir_name}")
-                else:
-                    # Handle subdirectory completion
-                    if path_part.startswith('/'):
-                        path_part = path_part[1:]
-                    
-                    path_components = path_part.split('/')
-                    current_dir = "/" + "/".join(path_components[:-1]) if len(path_components) > 1 else "/"
-                    
-                    inode_bitmap = drive.block_list[drive.block_list[0]["inode_bitmap_start"]]
-                    inode_start = drive.block_list[0]["inode_start"]
-                    inode_per_block = drive.block_list[0]["block_size"] // 256
-                    
-                    for i in range(len(inode_bitmap)):
-                        if inode_bitmap[i]:
-                            inode = drive.block_list[inode_start + (i // inode_per_block)][i % inode_per_block]
-                            if inode["file_type"].lower() == "directory":
-                                dir_name = inode["file_name"]
-                                if current_dir == "/":
-                                    if dir_name.startswith("/") and dir_name != "/" and "/" not in dir_name[1:]:
-                                        if dir_name[1:].startswith(path_components[-1]):
-                                            completions.append(f"{drive_letter}:{dir_name}")
-                                else:
-                                    prefix = current_dir + "/"
-                                    if dir_name.startswith(prefix):
-                                        remaining = dir_name[len(prefix):]
-                                        if "/" not in remaining and remaining.startswith(path_components[-1]):
-                                            completions.append(f"{drive_letter}:{dir_name}")
-            except ValueError:
-                pass
+
+        # Split off the directory being completed in; it is resolved through the shared cache
+        if '/' in text:
+            dir_text, prefix = text[:text.rindex('/') + 1], text[text.rindex('/') + 1:]
+        elif ':' in text:
+            dir_text, prefix = text + '/', ""
         else:
-            # No drive specified, suggest mounted drives and relative paths
+            dir_text, prefix = "", text
+            # No drive specified, suggest mounted drives as well as relative paths
             for drive_letter in mounted_drives.keys():
-                if drive_letter.lower().startswith(text.lower()) or text == "":
+                if drive_letter.lower().startswith(text.lower()):
                     completions.append(f"{drive_letter}:/")
-            
-            # Add relative path completions if we have a current directory
-            if pwd["drive"] is not None:
-                drive = mounted_drives[pwd["drive"]]
-                current_path = pwd["path"]
-                
-                # Handle relative path completion
-                if text in [".", ".."]:
-                    completions.append(text)
-                elif "/" in text:
-                    # Complex relative path
-                    pass
-                else:
-                    # Simple relative directory name
-                    inode_bitmap = drive.block_list[drive.block_list[0]["inode_bitmap_start"]]
-                    inode_start = drive.block_list[0]["inode_start"]
-                    inode_per_block = drive.block_list[0]["block_size"] // 256
-                    
-                    target_prefix = current_path + "/" if current_path != "/" else "/"
-                    
-                    for i in range(len(inode_bitmap)):
-                        if inode_bitmap[i]:
-                            inode = drive.block_list[inode_start + (i // inode_per_block)][i % inode_per_block]
-                            if inode["file_type"].lower() == "directory":
-                                dir_name = inode["file_name"]
-                                if dir_name.startswith(target_prefix) and dir_name != current_path:
-                                    relative_name = dir_name[len(target_prefix):]
-                                    if "/" not in relative_name and relative_name.startswith(text):
-                                        completions.append(relative_name)
-        
+            if file_type == "directory" and text in [".", ".."]:
+                completions.append(text)
+
+        try:
+            resolved = resolver.resolve(dir_text or ".")
+            access.check(resolved, target=READ | EXECUTE)
+        except PathError:
+            return completions
+        if include_root and resolved.is_root() and prefix == "" and ':' in dir_text:
+            completions.append(dir_text)
+        for name in self._matching_children(resolved, prefix, file_type):
+            completions.append(f"{dir_text}{name}")
         return completions
 
+    def _complete_path_directories(self, text: str, line: str, begidx: int, endidx: int) -> list[str]:
+        """Complete directory paths for commands like cd and ls."""
+        return self._complete_path(text, "directory", True)
+
     def _complete_path_files(self, text: str, line: str, begidx: int, endidx: int) -> list[str]:
         """Complete file paths for commands like cat."""
-        completions = []
-        
-        # If text contains ':', parse drive and path parts
-        if ':' in text:
-            try:
-                drive_part, path_part = text.split(':', 1)
-                drive_letter = drive_part.upper()
-                
-                if drive_letter not in mounted_drives:
-                    return []
-                
-                drive = mounted_drives[drive_letter]
-                
-                # Handle root directory completion
-                if path_part == "/" or path_part == "":
-                    # Add direct children of root (files and directories)
-                    inode_bitmap = drive.block_list[drive.block_list[0]["inode_bitmap_start"]]
-                    inode_start = drive.block_list[0]["inode_start"]
-                    inode_per_block = drive.block_list[0]["block_size"] // 256
-                    
-                    for i in range(len(inode_bitmap)):
-                        if inode_bitmap[i]:
-                            inode = drive.block_list[inode_start + (i // inode_per_block)][i % inode_per_block]
-                            if inode["file_type"].lower() == "file" and inode["file_name"] != "/":
-                                file_name = inode["file_name"]
-                                if file_name.startswith("/") and "/" not in file_name[1:]:
-                                    completions.append(f"{drive_letter}:{file_name}")
-                else:
-                    # Handle subdirectory completion
-                    if path_part.startswith('/'):
-                        path_part = path_part[1:]
-                    
-                    path_components = path_part.split('/')
-                    current_dir = "/" + "/".join(path_components[:-1]) if len(path_components) > 1 else "/"
-                    
-                    inode_bitmap = drive.block_list[drive.block_list[0]["inode_bitmap_start"]]
-                    inode_start = drive.block_list[0]["inode_start"]
-                    inode_per_block = drive.block_list[0]["block_size"] // 256
-                    
-                    for i in range(len(inode_bitmap)):
-                        if inode_bitmap[i]:
-                            inode = drive.block_list[inode_start + (i // inode_per_block)][i % inode_per_block]
-                            if inode["file_type"].lower() == "file":
-                                file_name = inode["file_name"]
-                                if current_dir == "/":
-                                    if file_name.startswith("/") and file_name != "/" and "/" not in file_name[1:]:
-                                        if file_name[1:].startswith(path_components[-1]):
-                                            completions.append(f"{drive_letter}:{file_name}")
-                                else:
-                                    prefix = current_dir + "/"
-                                    if file_name.startswith(prefix):
-                                        remaining = file_name[len(prefix):]
-                                        if "/" not in remaining and remaining.startswith(path_components[-1]):
-                                            completions.append(f"{drive_letter}:{file_name}")
-            except ValueError:
-                pass
-        else:
-            # No drive specified, suggest mounted drives and relative paths
-            for drive_letter in mounted_drives.keys():
-                if drive_letter.lower().startswith(text.lower()) or text == "":
-                    completions.append(f"{drive_letter}:/")
-            
-            # Add relative path completions if we have a current directory
-            if pwd["drive"] is not None:
-                drive = mounted_drives[pwd["drive"]]
-                current_path = pwd["path"]
-                
-                # Handle relative path completion for files
-                if "/" in text:
-                    # Complex relative path
-                    pass
-                else:
-                    # Simple relative file name
-                    inode_bitmap = drive.block_list[drive.block_list[0]["inode_bitmap_start"]]
-                    inode_start = drive.block_list[0]["inode_start"]
-                    inode_per_block = drive.block_list[0]["block_size"] // 256
-                    
-                    target_prefix = current_path + "/" if current_path != "/" else "/"
-                    
-                    for i in range(len(inode_bitmap)):
-                        if inode_bitmap[i]:
-                            inode = drive.block_list[inode_start + (i // inode_per_block)][i % inode_per_block]
-                            if inode["file_type"].lower() == "file":
-                                file_name = inode["file_name"]
-                                if file_name.startswith(target_prefix):
-                                    relative_name = file_name[len(target_prefix):]
-                                    if "/" not in relative_name and relative_name.startswith(text):
-                                        completions.append(relative_name)
-        
-        return completions
+        return self._complete_path(text, "file", False)
 
     def _complete_path_files_and_dirs(self, text: str, line: str, begidx: int, endidx: int) -> list[str]:
         """Complete file and directory paths for commands like write and mkdir."""
-        completions = []
-        
-        # If text contains ':', parse drive and path parts
-        if ':' in text:
-            try:
-                drive_part, path_part = text.split(':', 1)
-                drive_letter = drive_part.upper()
-                
-                if drive_letter not in mounted_drives:
-                    return []
-                
-                drive = mounted_drives[drive_letter]
-                
-                # Handle root directory completion
-                if path_part == "/" or path_part == "":
-                    completions.append(f"{drive_letter}:/")
-                    # Add direct children of root (files and directories)
-                    inode_bitmap = drive.block_list[drive.block_list[0]["inode_bitmap_start"]]
-                    inode_start = drive.block_list[0]["inode_start"]
-                    inode_per_block = drive.block_list[0]["block_size"] // 256
-                    
-                    for i in range(len(inode_bitmap)):
-                        if inode_bitmap[i]:
-                            inode = drive.block_list[inode_start + (i // inode_per_block)][i % inode_per_block]
-                            if inode["file_name"] != "/":
-                                item_name = inode["file_name"]
-                                if item_name.startswith("/") and "/" not in item_name[1:]:
-                                    completions.append(f"{drive_letter}:{item_name}")
-                else:
-                    # Handle subdirectory completion
-                    if path_part.startswith('/'):
-                        path_part = path_part[1:]
-                    
-                    path_components = path_part.split('/')
-                    current_dir = "/" + "/".join(path_components[:-1]) if len(path_components) > 1 else "/"
-                    
-                    inode_bitmap = drive.block_list[drive.block_list[0]["inode_bitmap_start"]]
-                    inode_start = drive.block_list[0]["inode_start"]
-                    inode_per_block = drive.block_list[0]["block_size"] // 256
-                    
-                    for i in range(len(inode_bitmap)):
-                        if inode_bitmap[i]:
-                            inode = drive.block_list[inode_start + (i // inode_per_block)][i % inode_per_block]
-                            item_name = inode["file_name"]
-                            if current_dir == "/":
-                                if item_name.startswith("/") and item_name != "/" and "/" not in item_name[1:]:
-                                    if item_name[1:].startswith(path_components[-1]):
-                                        completions.append(f"{drive_letter}:{item_name}")
-                            else:
-                                prefix = current_dir + "/"
-                                if item_name.startswith(prefix):
-                                    remaining = item_name[len(prefix):]
-                                    if "/" not in remaining and remaining.startswith(path_components[-1]):
-                                        completions.append(f"{drive_letter}:{item_name}")
-            except ValueError:
-                pass
-        else:
-            # No drive specified, suggest mounted drives and relative paths
-            for drive_letter in mounted_drives.keys():
-                if drive_letter.lower().startswith(text.lower()) or text == "":
-                    completions.append(f"{drive_letter}:/")
-            
-            # Add relative path completions if we have a current directory
-            if pwd["drive"] is not None:
-                drive = mounted_drives[pwd["drive"]]
-                current_path = pwd["path"]
-                
-                # Handle relative path completion
-                if "/" in text:
-                    # Complex relative path
-                    pass
-                else:
-                    # Simple relative file/directory name
-                    inode_bitmap = drive.block_list[drive.block_list[0]["inode_bitmap_start"]]
-                    inode_start = drive.block_list[0]["inode_start"]
-                    inode_per_block = drive.block_list[0]["block_size"] // 256
-                    
-                    target_prefix = current_path + "/" if current_path != "/" else "/"
-                    
-                    for i in range(len(inode_bitmap)):
-                        if inode_bitmap[i]:
-                            inode = drive.block_list[inode_start + (i // inode_per_block)][i % inode_per_block]
-                            item_name = inode["file_name"]
-                            if item_name.startswith(target_prefix):
-                                relative_name = item_name[len(target_prefix):]
-                                if "/" not in relative_name and relative_name.startswith(text):
-                                    completions.append(relative_name)
-        
-        return completions
+        return self._complete_path(text, None, True)
 
 
     # Sample command demonstrating cmd2 argument parsing
-    greet_parser = cmd2.Cmd2ArgumentParser(description='Greet the user.')
-    greet_parser.add_argument('-g', '--goodbye', action='store_true', help='switch to say goodbye')
-    greet_parser.add_argument('name', nargs='+', help='name of the person to greet')
+    @staticmethod
+    def greet_parser() -> cmd2.Cmd2ArgumentParser:
+        greet_parser = cmd2.Cmd2ArgumentParser(description='Greet the user.')
+        greet_parser.add_argument('-g', '--goodbye', action='store_true', help='switch to say goodbye')
+        greet_parser.add_argument('name', nargs='+', help='name of the person to greet')
+        return greet_parser
     @cmd2.with_argparser(greet_parser)
     def do_greet(self, args) -> None:
         if args.goodbye:
@@ -321,8 +232,11 @@ class MyApp(cmd2.Cmd):
 
 
     # File system management commands
-    lsblk_parser = cmd2.Cmd2ArgumentParser(description='List block devices.')
-    lsblk_parser.add_argument('-a', '--all', action='store_true', help='include unmounted devices')
+    @staticmethod
+    def lsblk_parser() -> cmd2.Cmd2ArgumentParser:
+        lsblk_parser = cmd2.Cmd2ArgumentParser(description='List block devices.')
+        lsblk_parser.add_argument('-a', '--all', action='store_true', help='include unmounted devices')
+        return lsblk_parser
     @cmd2.with_argparser(lsblk_parser)
     def do_lsblk(self, args) -> None:
         """Display mounted drives and optionally available drive files."""
@@ -343,30 +257,31 @@ class MyApp(cmd2.Cmd):
                 self.poutput("    Mounted drives:")
                 for path, drive in mounted_drives.items():
                     self.poutput(f"Drive: {path}, Size: {drive.block_list[0]["total_blocks"]}")
-            unmounted_drives = []
-            try:
-                for file in os.listdir(SAVE_PATH):
-                    if file.endswith(".json"):
-                        unmounted_drives.append(file)
-            except FileNotFoundError:
-                pass
+            unmounted_drives = drive_names()
             if unmounted_drives:
                 self.poutput("    Raw drive files:")
-                for file in unmounted_drives:
-                    self.poutput(f"Drive file: {file[0:-5]}")
-                    if file not in drive_choices:
-                        drive_choices.append(file[0:-5])
+                for name in unmounted_drives:
+                    self.poutput(f"Drive file: {name}")
 
 
 
 
 
     # Drive creation command with validation and interactive prompts
-    mkdrive_parser = cmd2.Cmd2ArgumentParser(description='Create a new virtual drive.')
-    mkdrive_parser.add_argument('-b', '--block', type=int, help='Size of the new drive in blocks (must be at least 32)', default=None)
-    mkdrive_parser.add_argument('-s', '--size', type=int, help='Size of the blocks in bytes (default 4096)', default=4096)
-    mkdrive_parser.add_argument('-i', '--inode', type=int, help='Number of inodes (default 80)', default=80)
-    mkdrive_parser.add_argument('name', nargs=1, help='Name of the new drive')
+    @staticmethod
+    def mkdrive_parser() -> cmd2.Cmd2ArgumentParser:
+        mkdrive_parser = cmd2.Cmd2ArgumentParser(description='Create a new virtual drive.')
+        mkdrive_parser.add_argument('-b', '--block', type=int, help='Size of the new drive in blocks (must be at least 32)', default=None)
+        mkdrive_parser.add_argument('-s', '--size', type=int, help='Size of the blocks in bytes (default 4096)', default=4096)
+        mkdrive_parser.add_argument('-i', '--inode', type=int, help='Initial number of inodes; the table grows when they run out (default 80)', default=80)
+        mkdrive_parser.add_argument('-d', '--dedup', action='store_true', help='Store identical data blocks only once')
+        mkdrive_parser.add_argument('-c', '--compress', choices=COMPRESSION_ALGORITHMS, default='none', help='Default compression for files on this drive (default none)')
+        mkdrive_parser.add_argument('-g', '--groups', type=int, default=1, help='Number of block groups, each with its own inode table and data blocks (default 1)')
+        mkdrive_parser.add_argument('-t', '--device', choices=list(DEVICE_MODELS.keys()), default='hdd', help='Timing model for simulated I/O cost (default hdd)')
+        mkdrive_parser.add_argument('-a', '--delalloc', action='store_true', help='Delay block allocation until data is flushed, when the final file size is known')
+        mkdrive_parser.add_argument('--no-inline', action='store_true', help=f'Always use data blocks, even for files of {INLINE_DATA_MAX} characters or less')
+        mkdrive_parser.add_argument('name', nargs=1, help='Name of the new drive')
+        return mkdrive_parser
     @cmd2.with_argparser(mkdrive_parser)
     def do_mkdrive(self, args) -> None:
         """Create a new virtual drive with specified parameters, prompting for missing values."""
@@ -382,8 +297,10 @@ class MyApp(cmd2.Cmd):
             return
         
         while block is None:
-            self.poutput("Enter block count:")
-            answer = input()
+            answer = self._ask("Enter block count:")
+            if answer is None:
+                self.perror("Error: Block count (-b) is required in batch mode.")
+                return
             if not answer.isdigit():
                 self.perror("Error: Blocks must be an integer.")
                 pass
@@ -398,8 +315,10 @@ class MyApp(cmd2.Cmd):
             return
         
         while size is None:
-            self.poutput("Enter block size (in bytes):")
-            answer = input()
+            answer = self._ask("Enter block size (in bytes):")
+            if answer is None:
+                self.perror("Error: Block size (-s) is required in batch mode.")
+                return
             if not answer.isdigit():
                 self.perror("Error: Block size must be an integer.")
                 pass
@@ -414,8 +333,10 @@ class MyApp(cmd2.Cmd):
             return
 
         while inode is None:
-            self.poutput("Enter inode count:")
-            answer = input()
+            answer = self._ask("Enter inode count:")
+            if answer is None:
+                self.perror("Error: Inode count (-i) is required in batch mode.")
+                return
             if not answer.isdigit():
                 self.perror("Error: Inode count must be an integer.")
                 pass
@@ -425,23 +346,134 @@ class MyApp(cmd2.Cmd):
             else:
                 inode = int(answer)
 
-        save_drive(Drive(name, block, None, size, inode), name + ".json")
-        drive_choices.append(name)
+        if args.groups < 1:
+            self.perror("Error: There must be at least 1 block group.")
+            return
+        if args.groups > 1 and (block - 3) // args.groups <= math.ceil(inode / args.groups / (size // INODE_SIZE)):
+            self.perror("Error: Too many block groups for a drive of this size.")
+            return
+
+        if not self._save(Drive(name, block, None, size, inode, dedup=args.dedup, compression=args.compress, inline_data=not args.no_inline, groups=args.groups, device=args.device, delalloc=args.delalloc), name + ".json"):
+            return
         self.poutput(f"Created new drive: {name}, {block} blocks in {size} byte increments.\n Remember to mount the new drive.")
 
 
 
 
 
-    rmdrive_parser = cmd2.Cmd2ArgumentParser(description='Remove a virtual drive file.')
-    rmdrive_parser.add_argument('name', nargs=1, choices=drive_choices, help='Name of the drive to remove')
+    # Storage pools (software RAID) - one drive spread over several member drive images
+    @staticmethod
+    def mkpool_parser() -> cmd2.Cmd2ArgumentParser:
+        mkpool_parser = cmd2.Cmd2ArgumentParser(description='Create a storage pool that stripes, mirrors or parity-protects a drive across several drive images.')
+        mkpool_parser.add_argument('-l', '--level', choices=list(RAID_LEVELS.keys()), default='raid5', help='raid0 (striping), raid1 (mirroring) or raid5 (striping with parity) (default raid5)')
+        mkpool_parser.add_argument('-m', '--members', type=int, default=3, help='Number of member drive images (default 3)')
+        mkpool_parser.add_argument('-b', '--block', type=int, required=True, help='Size of the pool in logical blocks (must be at least 32)')
+        mkpool_parser.add_argument('-s', '--size', type=int, help='Size of the blocks in bytes (default 4096)', default=4096)
+        mkpool_parser.add_argument('-i', '--inode', type=int, help='Number of inodes (default 80)', default=80)
+        mkpool_parser.add_argument('-t', '--device', choices=list(DEVICE_MODELS.keys()), default='hdd', help='Timing model for each member (default hdd)')
+        mkpool_parser.add_argument('name', nargs=1, help='Name of the new pool')
+        return mkpool_parser
+    @cmd2.with_argparser(mkpool_parser)
+    def do_mkpool(self, args) -> None:
+        """Create a pool; it is saved as NAME plus one image per member (NAME.0, NAME.1, ...)."""
+        name = args.name[0].upper() if args.name[0].isalpha() else args.name[0]
+        if args.block < 32:
+            self.perror("Error: Blocks must be at least 32.")
+            return
+        if args.size < 1024:
+            self.perror("Error: Block size must be at least 1024 bytes.")
+            return
+        if args.inode < 1:
+            self.perror("Error: There must be at least 1 inode.")
+            return
+        if args.members < RAID_LEVELS[args.level]:
+            self.perror(f"Error: {args.level} needs at least {RAID_LEVELS[args.level]} members.")
+            return
+        if name in drive_names():
+            self.perror(f"Error: Drive {name} already exists.")
+            return
+
+        if not self._save(create_pool(name, args.level, args.members, args.block, block_size=args.size, inode_count=args.inode, device=args.device), name + ".json"):
+            return
+        self.poutput(f"Created {args.level} pool: {name}, {args.block} blocks over {args.members} members ({name}.0 to {name}.{args.members - 1}).\n Remember to mount the new pool.")
+
+    @staticmethod
+    def pool_parser() -> cmd2.Cmd2ArgumentParser:
+        pool_parser = cmd2.Cmd2ArgumentParser(description='Show the members of a mounted pool, fail one, or rebuild a missing one.')
+        pool_parser.add_argument('action', choices=['status', 'fail', 'rebuild'], help='Pool operation to perform')
+        pool_parser.add_argument('path', nargs=1, choices_provider=lambda: list(mounted_drives.keys()), help='Path of the pool')
+        pool_parser.add_argument('member', nargs='?', type=int, help='Member number (for fail and rebuild)')
+        return pool_parser
+    @cmd2.with_argparser(pool_parser)
+    def do_pool(self, args) -> None:
+        """Manage the member drives of a mounted storage pool."""
+        path = args.path[0].upper()
+        if path not in mounted_drives:
+            self.perror(f"Error: No drive is mounted at {path}.")
+            return
+        drive = mounted_drives[path]
+        pool = drive.block_list
+        if not isinstance(pool, PooledBlockList):
+            self.perror(f"Error: Drive at {path} is not a pool.")
+            return
+
+        if args.action == "status":
+            state = "degraded" if pool.degraded() else "online"
+            self.poutput(f"Pool {pool.name} at {path}: {pool.level}, {len(pool.members)} members, {len(pool)} blocks, {state}")
+            self.poutput(f"  {'Member':<10} {'State':<8} {'Blocks':>8} {'Sim time ms':>12}")
+            for k, member in enumerate(pool.members):
+                elapsed = f"{drive.device.members[k].elapsed * 1000:.2f}" if isinstance(drive.device, PoolDevice) else "-"
+                blocks = len(member) if member is not None else "-"
+                self.poutput(f"  {pool.name + '.' + str(k):<10} {'online' if member is not None else 'missing':<8} {blocks:>8} {elapsed:>12}")
+            return
+
+        if args.member is None or not 0 <= args.member < len(pool.members):
+            self.perror(f"Error: Please specify a member number from 0 to {len(pool.members) - 1}.")
+            return
+        member_file = pool_member_file(pool.name, args.member)
+
+        if args.action == "fail":
+            if pool.members[args.member] is None:
+                self.perror(f"Error: Member {args.member} is already missing.")
+                return
+            if not PooledBlockList.tolerates(pool.level, len(pool.members), len(pool.members) - len(pool.online()) + 1):
+                self.perror(f"Error: {pool.level} pool {pool.name} would not survive losing member {args.member}.")
+                return
+            pool.fail(args.member)
+            sync_saves()  # A pending write of the pool must not bring the member's image back
+            if os.path.exists(os.path.join(SAVE_PATH, member_file)):
+                os.remove(os.path.join(SAVE_PATH, member_file))
+            self.poutput(f"Member {args.member} of pool {pool.name} failed; the pool is running degraded.")
+        elif args.action == "rebuild":
+            if pool.members[args.member] is not None:
+                self.perror(f"Error: Member {args.member} is not missing.")
+                return
+            pool.rebuild(args.member)
+            self.poutput(f"Rebuilt member {args.member} of pool {pool.name} into {member_file}.")
+        self._save(drive, pool.name + ".json")
+
+
+
+    @staticmethod
+    def rmdrive_parser() -> cmd2.Cmd2ArgumentParser:
+        rmdrive_parser = cmd2.Cmd2ArgumentParser(description='Remove a virtual drive file.')
+        rmdrive_parser.add_argument('name', nargs=1, choices_provider=drive_names, help='Name of the drive to remove')
+        return rmdrive_parser
     @cmd2.with_argparser(rmdrive_parser)
     def do_rmdrive(self, args) -> None:
 
         name = args.name[0].upper() if args.name[0].isalpha() else args.name[0]
+        if discard_save(name + ".json") and not os.path.exists(os.path.join(SAVE_PATH, name + ".json")):
+            self.poutput(f"Removed drive {name} before it was saved.")
+            return
         try:
             os.remove(os.path.join(SAVE_PATH, name + ".json"))
             self.poutput(f"Removed drive file: {name}.json")
+            # A pool's member images go with it
+            for file in os.listdir(SAVE_PATH):
+                if file.startswith(name + ".") and file[len(name) + 1:-5].isdigit() and file.endswith(".json"):
+                    os.remove(os.path.join(SAVE_PATH, file))
+                    self.poutput(f"Removed pool member file: {file}")
         except FileNotFoundError:
             self.perror(f"Error: Drive file {name}.json not found.")
         except Exception as e:
@@ -451,9 +483,13 @@ class MyApp(cmd2.Cmd):
 
 
     # Drive mounting system - load drive files into memory for access
-    mount_parser = cmd2.Cmd2ArgumentParser(description='Mount a virtual drive.')
-    mount_parser.add_argument('-p', '--path', type=str, help='Path to mount the drive')
-    mount_parser.add_argument('name', nargs=1, choices=drive_choices, help='Name of the drive to mount')
+    @staticmethod
+    def mount_parser() -> cmd2.Cmd2ArgumentParser:
+        mount_parser = cmd2.Cmd2ArgumentParser(description='Mount a virtual drive.')
+        mount_parser.add_argument('-p', '--path', type=str, help='Path to mount the drive')
+        mount_parser.add_argument('-o', '--atime', choices=ATIME_MODES, default='relatime', help='When reading a file updates its access time (default relatime)')
+        mount_parser.add_argument('name', nargs=1, choices_provider=drive_names, help='Name of the drive to mount')
+        return mount_parser
     @cmd2.with_argparser(mount_parser)
     def do_mount(self, args) -> None:
         """Load a drive file and make it accessible at a specified mount point."""
@@ -465,8 +501,11 @@ class MyApp(cmd2.Cmd):
             path = None
         
         while path is None:
-            self.poutput("Enter mount path (A-Z):")
-            answer = input().upper()
+            answer = self._ask("Enter mount path (A-Z):")
+            if answer is None:
+                self.perror("Error: A free mount path (-p) is required in batch mode.")
+                return
+            answer = answer.upper()
             if not answer.isalpha() or len(answer) != 1:
                 self.perror("Error: Path must be a single letter A-Z.")
                 pass
@@ -480,14 +519,18 @@ class MyApp(cmd2.Cmd):
         if drive is None:
             self.perror(f"Error: Could not load drive {name}. Make sure the file exists.")
             return
+        drive.atime_mode = args.atime
         mounted_drives[path] = drive
 
         self.poutput(f"Mounted drive {name} at {path}.")
     
 
 
-    unmount_parser = cmd2.Cmd2ArgumentParser(description='Unmount a virtual drive.')
-    unmount_parser.add_argument('path', nargs=1, choices_provider=lambda: list(mounted_drives.keys()), help='Path of the drive to unmount')
+    @staticmethod
+    def unmount_parser() -> cmd2.Cmd2ArgumentParser:
+        unmount_parser = cmd2.Cmd2ArgumentParser(description='Unmount a virtual drive.')
+        unmount_parser.add_argument('path', nargs=1, choices_provider=lambda: list(mounted_drives.keys()), help='Path of the drive to unmount')
+        return unmount_parser
     @cmd2.with_argparser(unmount_parser)
     def do_unmount(self, args) -> None:
         path = args.path[0].upper()
@@ -496,48 +539,433 @@ class MyApp(cmd2.Cmd):
             return
         del mounted_drives[path]
         self.poutput(f"Unmounted drive at {path}.")
+        self._sync()
+
+
+
+    def _sync(self) -> bool:
+        """Write dirty drive images now (see start_write_back). Prints an error and returns False if any couldn't be written."""
+        written, failed = sync_saves()
+        sync_drives()  # Images written at the periodic durability level
+        if failed:
+            self.perror(f"Error: {failed} drive image{'s' if failed != 1 else ''} could not be written; the drive bay still holds the previous version.")
+        return not failed
+
+    @staticmethod
+    def sync_parser() -> cmd2.Cmd2ArgumentParser:
+        sync_parser = cmd2.Cmd2ArgumentParser(description='Write every drive image with unsaved changes to the drive bay now.')
+        return sync_parser
+    @cmd2.with_argparser(sync_parser)
+    def do_sync(self, args) -> None:
+        """Write every drive image with unsaved changes to the drive bay now."""
+        if not self._sync():
+            return
+        stats = write_back_stats()
+        if stats is None:
+            self.poutput("Drive images are written as each command finishes; nothing to sync.")
+        else:
+            self.poutput(f"All drive images written ({stats['saves']} saves coalesced into {stats['writes']} image write{'s' if stats['writes'] != 1 else ''} this session).")
 
 
 
+    # Snapshots - point-in-time copies of the inode table sharing data blocks with the live drive
+    @staticmethod
+    def snapshot_parser() -> cmd2.Cmd2ArgumentParser:
+        snapshot_parser = cmd2.Cmd2ArgumentParser(description='Create, list, delete or roll back to snapshots of a mounted drive.')
+        snapshot_parser.add_argument('action', choices=['create', 'list', 'delete', 'rollback'], help='Snapshot operation to perform')
+        snapshot_parser.add_argument('path', nargs=1, choices_provider=lambda: list(mounted_drives.keys()), help='Path of the drive')
+        snapshot_parser.add_argument('name', nargs='?', help='Name of the snapshot (not needed for list)')
+        return snapshot_parser
+    @cmd2.with_argparser(snapshot_parser)
+    def do_snapshot(self, args) -> None:
+        """Manage copy-on-write snapshots of a mounted drive."""
+        path = args.path[0].upper()
+        if path not in mounted_drives:
+            self.perror(f"Error: No drive is mounted at {path}.")
+            return
+        drive = mounted_drives[path]
 
-    displaydata_parser = cmd2.Cmd2ArgumentParser(description='Display the contents of a mounted drive.')
-    displaydata_parser.add_argument('path', nargs=1, choices_provider=lambda: list(mounted_drives.keys()), help='Path of the drive to display')
+        if args.action == "list":
+            if not drive.snapshots:
+                self.poutput(f"Drive at {path} has no snapshots.")
+                return
+            self.poutput(f"{'Name':<20} {'Inodes':<8} {'Blocks':<8} {'Created'}")
+            self.poutput("-" * 60)
+            for name, snapshot in drive.snapshots.items():
+                blocks = sum(length for inode in snapshot["inodes"].values() for (start, length) in inode["pointers"])
+                self.poutput(f"{name:<20} {len(snapshot['inodes']):<8} {blocks:<8} {format_time(snapshot['time'])}")
+            return
+
+        if args.name is None:
+            self.perror(f"Error: Please specify a snapshot name to {args.action}.")
+            return
+
+        if args.action == "create":
+            if not drive.create_snapshot(args.name):
+                self.perror(f"Error: Snapshot '{args.name}' already exists.")
+                return
+            self.poutput(f"Created snapshot '{args.name}' of drive at {path}.")
+        elif args.action == "delete":
+            if not drive.delete_snapshot(args.name):
+                self.perror(f"Error: Snapshot '{args.name}' does not exist.")
+                return
+            self.poutput(f"Deleted snapshot '{args.name}'.")
+        elif args.action == "rollback":
+            if not drive.rollback_snapshot(args.name):
+                self.perror(f"Error: Snapshot '{args.name}' does not exist.")
+                return
+            self.poutput(f"Rolled back drive at {path} to snapshot '{args.name}'.")
+        self._save(drive)
+
+
+
+    @staticmethod
+    def clone_parser() -> cmd2.Cmd2ArgumentParser:
+        clone_parser = cmd2.Cmd2ArgumentParser(description='Create a new drive that shares its data blocks with a mounted drive or snapshot.')
+        clone_parser.add_argument('-s', '--snapshot', type=str, help='Clone this snapshot instead of the live drive')
+        clone_parser.add_argument('-p', '--path', type=str, help='Mount the clone at this path (A-Z)')
+        clone_parser.add_argument('source', nargs=1, choices_provider=lambda: list(mounted_drives.keys()), help='Path of the drive to clone')
+        clone_parser.add_argument('name', nargs=1, help='Name of the new drive')
+        return clone_parser
+    @cmd2.with_argparser(clone_parser)
+    def do_clone(self, args) -> None:
+        """Clone a mounted drive (or one of its snapshots) into a new drive."""
+        source = args.source[0].upper()
+        name = args.name[0].upper() if args.name[0].isalpha() else args.name[0]
+        path = args.path.upper() if args.path else None
+
+        if source not in mounted_drives:
+            self.perror(f"Error: No drive is mounted at {source}.")
+            return
+        if name in drive_names():
+            self.perror(f"Error: Drive {name} already exists.")
+            return
+        if path is not None and (not path.isalpha() or len(path) != 1):
+            self.perror("Error: Path must be a single letter A-Z.")
+            return
+        if path in mounted_drives:
+            self.perror(f"Error: Path {path} is already in use.")
+            return
+
+        clone = mounted_drives[source].clone(name, args.snapshot)
+        if clone is None:
+            self.perror(f"Error: Snapshot '{args.snapshot}' does not exist.")
+            return
+        if not self._save(clone, name + ".json"):
+            return
+        origin = f"snapshot '{args.snapshot}' of {source}" if args.snapshot else f"drive at {source}"
+        self.poutput(f"Cloned {origin} into new drive: {name}")
+
+        if path is not None:
+            mounted_drives[path] = clone
+            self.poutput(f"Mounted drive {name} at {path}.")
+
+
+
+
+    @staticmethod
+    def displaydata_parser() -> cmd2.Cmd2ArgumentParser:
+        displaydata_parser = cmd2.Cmd2ArgumentParser(description='Display a block usage map of a mounted drive.')
+        displaydata_parser.add_argument('-r', '--range', type=str, help='Only show data blocks START:END (END exclusive, e.g. 0:4096)')
+        displaydata_parser.add_argument('-c', '--cell', type=int, help=f'Data blocks per cell (default: fit the range into {USAGE_SUMMARY_CELLS} cells)')
+        displaydata_parser.add_argument('-f', '--files', action='store_true', help='Colour each cell by the file owning most of its blocks')
+        displaydata_parser.add_argument('path', nargs=1, choices_provider=lambda: list(mounted_drives.keys()), help='Path of the drive to display')
+        return displaydata_parser
     @cmd2.with_argparser(displaydata_parser)
     def do_displaydata(self, args) -> None:
+        """Show data block usage as a heatmap; each cell covers a run of blocks and is shaded by how full it is."""
         path = args.path[0].upper()
         if path not in mounted_drives:
             self.perror(f"Error: No drive is mounted at {path}.")
             return
         drive = mounted_drives[path]
-        self.poutput(f"Contents of drive at {path}:")
-        data_start = drive.block_list[0]["data_start"]
-        
-        # Create visual representation of data block usage
-        display: list[str] = []
-        message = ""
-        for i in range(data_start, drive.block_list[0]["total_blocks"]):
-            if drive.block_list[i] == '':
-                message += "-"  # Empty block
+        data_size = drive.block_list[0]["data_size"]
+
+        start, end = 0, data_size
+        if args.range:
+            first, _, last = args.range.partition(":")
+            try:
+                start = int(first) if first else 0
+                end = int(last) if last else data_size
+            except ValueError:
+                self.perror("Error: Range must look like START:END, e.g. 0:4096.")
+                return
+            if not 0 <= start < end <= data_size:
+                self.perror(f"Error: Range must be within 0:{data_size} and not empty.")
+                return
+        if args.cell is not None and args.cell < 1:
+            self.perror("Error: Cells must cover at least 1 block.")
+            return
+        cell_blocks = args.cell or max(1, math.ceil((end - start) / USAGE_SUMMARY_CELLS))
+
+        # Shade each cell by occupancy; the whole-drive default view comes straight from the usage summary
+        cells = drive.usage_cells(start, end, cell_blocks)
+        shades = []
+        for (used, total) in cells:
+            if used == 0:
+                shades.append("·")
+            elif used == total:
+                shades.append("█")
             else:
-                message += "#"  # Used block
-            if len(message) == 8:
-                display.append(message)
-                message = ""
-        
-        if message:
-            display.append(message)
-        
-        print_chain = []
-        for i in range(0, len(display)):
-            print_chain.append(display[i])
-            if (i + 1) % 2 == 0 or i == len(display) - 1:
-                self.poutput(" ".join(print_chain))
-                print_chain = []
+                shades.append("░▒▓"[min(2, used * 3 // total)])
+
+        # Optionally colour each cell by its dominant file
+        legend = []
+        if args.files:
+            owners: list[dict[int, int]] = [{} for _ in cells]
+            for (inode_index, first, last) in drive.extent_owners(start, end):
+                for cell in range((first - start) // cell_blocks, (last - 1 - start) // cell_blocks + 1):
+                    overlap = min(last, start + (cell + 1) * cell_blocks) - max(first, start + cell * cell_blocks)
+                    owners[cell][inode_index] = owners[cell].get(inode_index, 0) + overlap
+            palette = [cmd2.ansi.Fg.RED, cmd2.ansi.Fg.GREEN, cmd2.ansi.Fg.YELLOW, cmd2.ansi.Fg.BLUE, cmd2.ansi.Fg.MAGENTA, cmd2.ansi.Fg.CYAN,
+                       cmd2.ansi.Fg.LIGHT_RED, cmd2.ansi.Fg.LIGHT_GREEN, cmd2.ansi.Fg.LIGHT_YELLOW, cmd2.ansi.Fg.LIGHT_BLUE, cmd2.ansi.Fg.LIGHT_MAGENTA, cmd2.ansi.Fg.LIGHT_CYAN]
+            colours: dict[int, cmd2.ansi.Fg] = {}
+            for cell, counts in enumerate(owners):
+                if counts:
+                    owner = max(counts, key=counts.get)
+                    if owner not in colours:
+                        colours[owner] = palette[len(colours) % len(palette)]
+                        legend.append(owner)
+                    shades[cell] = cmd2.ansi.style(shades[cell], fg=colours[owner])
+
+        used = sum(cell[0] for cell in cells)
+        self.poutput(f"Block usage of drive at {path}: data blocks {start}-{end - 1}, {cell_blocks} block{'s' if cell_blocks != 1 else ''} per cell, {used}/{end - start} used")
+        width = 64
+        for row in range(0, len(shades), width):
+            line = shades[row:row + width]
+            groups = ["".join(line[g:g + 8]) for g in range(0, len(line), 8)]
+            self.poutput(f"{start + row * cell_blocks:>10} " + " ".join(groups))
+        self.poutput("Legend: · empty  ░ <1/3  ▒ <2/3  ▓ <full  █ full")
+        for inode_index in legend[:20]:
+            self.poutput(f"  {cmd2.ansi.style('█', fg=colours[inode_index])} {path}:{drive.path_of(inode_index)}")
+        if len(legend) > 20:
+            self.poutput(f"  ... and {len(legend) - 20} more files")
+
+    @staticmethod
+    def dedupstats_parser() -> cmd2.Cmd2ArgumentParser:
+        dedupstats_parser = cmd2.Cmd2ArgumentParser(description='Show block deduplication savings for a mounted drive.')
+        dedupstats_parser.add_argument('path', nargs=1, choices_provider=lambda: list(mounted_drives.keys()), help='Path of the drive to report on')
+        return dedupstats_parser
+    @cmd2.with_argparser(dedupstats_parser)
+    def do_dedupstats(self, args) -> None:
+        """Report logical vs physical block usage and the size of the dedup hash index."""
+        path = args.path[0].upper()
+        if path not in mounted_drives:
+            self.perror(f"Error: No drive is mounted at {path}.")
+            return
+        stats = mounted_drives[path].dedup_stats()
+        ratio = stats["logical_blocks"] / stats["physical_blocks"] if stats["physical_blocks"] else 1.0
+        self.poutput(f"Deduplication stats for drive at {path}:")
+        self.poutput(f"  Deduplication:     {'enabled' if stats['enabled'] else 'disabled'}")
+        self.poutput(f"  Logical blocks:    {stats['logical_blocks']}")
+        self.poutput(f"  Physical blocks:   {stats['physical_blocks']}")
+        self.poutput(f"  Blocks saved:      {stats['saved_blocks']} ({stats['saved_bytes']} bytes, ratio {ratio:.2f}x)")
+        self.poutput(f"  Hash index:        {stats['index_entries']} entries, {stats['index_bytes']} bytes")
+
+    @staticmethod
+    def iostat_parser() -> cmd2.Cmd2ArgumentParser:
+        iostat_parser = cmd2.Cmd2ArgumentParser(description='Show or change the simulated I/O cost of a mounted drive.')
+        iostat_parser.add_argument('-r', '--reset', action='store_true', help='Reset the counters after showing them')
+        iostat_parser.add_argument('-t', '--device', choices=list(DEVICE_MODELS.keys()), help='Switch the drive to this timing model (counters start from zero)')
+        iostat_parser.add_argument('path', nargs=1, choices_provider=lambda: list(mounted_drives.keys()), help='Path of the drive to report on')
+        return iostat_parser
+    @cmd2.with_argparser(iostat_parser)
+    def do_iostat(self, args) -> None:
+        """Report the simulated time and block accesses charged to a drive's timing model."""
+        path = args.path[0].upper()
+        if path not in mounted_drives:
+            self.perror(f"Error: No drive is mounted at {path}.")
+            return
+        drive = mounted_drives[path]
+        if args.device is not None:
+            drive.block_list[0]["device"] = args.device
+            drive.attach_device()
+            self._save(drive)
+            self.poutput(f"Drive at {path} now uses the {args.device} timing model." if args.device != "none" else f"Removed the timing model from drive at {path}.")
+        if drive.device is None:
+            self.poutput(f"Drive at {path} has no timing model.")
+            return
+        stats = drive.device.stats()
+        self.poutput(f"Simulated I/O for drive at {path} ({stats['device']}):")
+        self.poutput(f"  Block reads:       {stats['reads']}")
+        self.poutput(f"  Block writes:      {stats['writes']}")
+        self.poutput(f"  Simulated time:    {stats['elapsed'] * 1000:.2f} ms")
+        if stats["device"] == "hdd":
+            self.poutput(f"  Head movement:     {stats['head_movement']} blocks")
+        if "erases" in stats:
+            self.poutput(f"  Erases:            {stats['erases']}")
+        if isinstance(drive.device, PoolDevice):
+            for k, member in enumerate(drive.device.members):
+                self.poutput(f"  Member {k}:          {member.elapsed * 1000:.2f} ms, {member.reads} reads, {member.writes} writes")
+        if args.reset:
+            drive.device.reset()
+
+    @staticmethod
+    def iosched_parser() -> cmd2.Cmd2ArgumentParser:
+        iosched_parser = cmd2.Cmd2ArgumentParser(description='Compare I/O schedulers on concurrent reads of files from one drive.')
+        iosched_parser.add_argument('-s', '--scheduler', action='append', choices=list(SCHEDULERS.keys()), help='Scheduler to compare; repeat for several (default all)')
+        iosched_parser.add_argument('path', nargs='+', completer=MyApp._complete_path_files_and_dirs, help='Files to read at the same time; directories add every file beneath them')
+        return iosched_parser
+    @cmd2.with_argparser(iosched_parser)
+    def do_iosched(self, args) -> None:
+        """Replay the same concurrent read workload through each scheduler on a fresh copy of the drive's timing model."""
+        drive_letter = None
+        files = []
+        for target_path in args.path:
+            resolved = self._lookup(target_path)
+            if resolved is None:
+                return
+            if drive_letter is not None and resolved.letter != drive_letter:
+                self.perror("Error: All paths must be on the same drive.")
+                return
+            drive_letter, drive = resolved.letter, resolved.drive
+            if resolved.inode is None:
+                self.perror(f"Error: '{target_path}' does not exist.")
+                return
+            stack = [resolved.inode]
+            while stack:
+                current = stack.pop()
+                if drive.get_inode(current)["file_type"].lower() == "directory":
+                    stack.extend(drive.list_directory(current).values())
+                elif current not in files:
+                    files.append(current)
+
+        drive = mounted_drives[drive_letter]
+        if drive.device is None:
+            self.perror(f"Error: Drive at {drive_letter} has no timing model. Set one with 'iostat -t hdd {drive_letter}'.")
+            return
+        if not files:
+            self.perror("Error: No files to read.")
+            return
+
+        # Record each file's block requests once, then replay them through every scheduler
+        streams = drive.trace_io([lambda index=index: drive.load_inode(index) for index in files])
+        superblock = drive.block_list[0]
+        self.poutput(f"Concurrent reads of {len(files)} files ({sum(len(stream) for stream in streams)} block requests) on {drive.device.name}:")
+        self.poutput(f"  {'Scheduler':<10} {'Head movement':>14} {'Sim time ms':>12} {'MB/s':>8} {'Mean wait ms':>13} {'Max wait ms':>12}")
+        for scheduler in args.scheduler or SCHEDULERS.keys():
+            if isinstance(drive.device, PoolDevice):
+                device = PoolDevice(drive.block_list, drive.device.model, superblock["block_size"])
+            else:
+                device = make_device(drive.device.name, superblock["block_size"], superblock["total_blocks"])
+            stats = run_queue(device, streams, scheduler, superblock["total_blocks"] - 1)
+            throughput = stats["requests"] * superblock["block_size"] / stats["elapsed"] / (1024 * 1024) if stats["elapsed"] else 0
+            self.poutput(f"  {scheduler:<10} {stats['head_movement']:>14} {stats['elapsed'] * 1000:>12.2f} {throughput:>8.2f} {stats['mean_wait'] * 1000:>13.2f} {stats['max_wait'] * 1000:>12.2f}")
+
+    @staticmethod
+    def groupstats_parser() -> cmd2.Cmd2ArgumentParser:
+        groupstats_parser = cmd2.Cmd2ArgumentParser(description='Show block group usage and read locality for a mounted drive.')
+        groupstats_parser.add_argument('path', nargs=1, choices_provider=lambda: list(mounted_drives.keys()), help='Path of the drive to report on')
+        return groupstats_parser
+    @cmd2.with_argparser(groupstats_parser)
+    def do_groupstats(self, args) -> None:
+        """Report inode and data block usage per block group and the seek distance to read every file."""
+        path = args.path[0].upper()
+        if path not in mounted_drives:
+            self.perror(f"Error: No drive is mounted at {path}.")
+            return
+        drive = mounted_drives[path]
+        self.poutput(f"Block groups for drive at {path}:")
+        self.poutput(f"  {'Group':<6} {'Inodes used':>12} {'Blocks used':>12}")
+        for g in range(drive.group_count()):
+            usage = drive.usage(g)
+            inodes = f"{usage['inodes_used']}/{usage['inodes_total']}"
+            blocks = f"{usage['blocks_used']}/{usage['blocks_total']}"
+            self.poutput(f"  {g:<6} {inodes:>12} {blocks:>12}")
+        stats = drive.seek_distance()
+        average = stats["distance"] / stats["files"] if stats["files"] else 0
+        self.poutput(f"Reading all {stats['files']} files: {stats['seeks']} seeks, {stats['distance']} blocks of head travel ({average:.1f} per file)")
+
+    @staticmethod
+    def df_parser() -> cmd2.Cmd2ArgumentParser:
+        df_parser = cmd2.Cmd2ArgumentParser(description='Show free and used space on mounted drives.')
+        df_parser.add_argument('path', nargs='*', choices_provider=lambda: list(mounted_drives.keys()), help='Drives to report on (default: every mounted drive)')
+        return df_parser
+    @cmd2.with_argparser(df_parser)
+    def do_df(self, args) -> None:
+        """Report data block and inode usage per drive from the drives' usage counters."""
+        paths = [path.upper() for path in args.path] or sorted(mounted_drives.keys())
+        self.poutput(f"{'Drive':<6} {'Name':<12} {'Blocks':>9} {'Used':>9} {'Free':>9} {'Use%':>5} {'Inodes':>8} {'IUsed':>8} {'IFree':>8}")
+        for path in paths:
+            if path not in mounted_drives:
+                self.perror(f"Error: No drive is mounted at {path}.")
+                continue
+            drive = mounted_drives[path]
+            space = drive.space()
+            used = space["blocks_used"] + space["blocks_reserved"]  # Delayed writes already hold their blocks
+            percent = used * 100 // space["blocks_total"] if space["blocks_total"] else 0
+            self.poutput(f"{path + ':':<6} {drive.block_list[0]['name']:<12} {space['blocks_total']:>9} {used:>9} {space['blocks_total'] - used:>9} {percent:>4}% "
+                         f"{space['inodes_total']:>8} {space['inodes_used']:>8} {space['inodes_total'] - space['inodes_used']:>8}")
+
+    @staticmethod
+    def du_parser() -> cmd2.Cmd2ArgumentParser:
+        du_parser = cmd2.Cmd2ArgumentParser(description='Show the space used by a file or directory tree.')
+        du_parser.add_argument('path', nargs='?', default='.', completer=MyApp._complete_path_files_and_dirs, help='File or directory to report on (default: the current directory)')
+        du_parser.add_argument('-s', '--summarize', action='store_true', help='Only show the total, not each entry of the directory')
+        return du_parser
+    @cmd2.with_argparser(du_parser)
+    def do_du(self, args) -> None:
+        """Report data blocks, bytes and inodes under a path from the directory usage counters."""
+        resolved = self._lookup(args.path)
+        if resolved is None:
+            return
+        if resolved.inode is None:
+            self.perror(f"Error: '{resolved.display}' does not exist.")
+            return
+        if resolved.is_directory() and not self._permitted(access.check, resolved, target=READ | EXECUTE):
+            return
+        drive = resolved.drive
+        self.poutput(f"{'Blocks':>9} {'Bytes':>11} {'Inodes':>7}  Path")
+        if not args.summarize and resolved.is_directory():
+            for name, child in sorted(drive.list_directory(resolved.inode).items()):
+                usage = drive.disk_usage(child)
+                suffix = "/" if drive.get_inode(child)["file_type"].lower() == "directory" else ""
+                self.poutput(f"{usage['blocks']:>9} {usage['bytes']:>11} {usage['inodes']:>7}  {name}{suffix}")
+        usage = drive.disk_usage(resolved.inode)
+        self.poutput(f"{usage['blocks']:>9} {usage['bytes']:>11} {usage['inodes']:>7}  {resolved.display}")
+
+    @staticmethod
+    def quota_parser() -> cmd2.Cmd2ArgumentParser:
+        quota_parser = cmd2.Cmd2ArgumentParser(description='Show or set per-owner quotas on a mounted drive.')
+        quota_parser.add_argument('path', nargs=1, choices_provider=lambda: list(mounted_drives.keys()), help='Path of the drive')
+        quota_parser.add_argument('-u', '--user', help='Owner to show or set the quota of (default: every owner on the drive)')
+        quota_parser.add_argument('-b', '--blocks', type=int, help='Set the data block limit (0 removes it)')
+        quota_parser.add_argument('-i', '--inodes', type=int, help='Set the inode limit (0 removes it)')
+        return quota_parser
+    @cmd2.with_argparser(quota_parser)
+    def do_quota(self, args) -> None:
+        """Show each owner's usage against their limits, or set an owner's limits. Writes past a limit are refused."""
+        path = args.path[0].upper()
+        if path not in mounted_drives:
+            self.perror(f"Error: No drive is mounted at {path}.")
+            return
+        drive = mounted_drives[path]
+        if args.blocks is not None or args.inodes is not None:
+            if args.user is None:
+                self.perror("Error: Please specify the owner to set a quota for with -u.")
+                return
+            if (args.blocks or 0) < 0 or (args.inodes or 0) < 0:
+                self.perror("Error: Quota limits can't be negative.")
+                return
+            drive.set_quota(args.user, args.blocks, args.inodes)
+            self._save(drive)
+
+        owners = [args.user] if args.user is not None else sorted(set(drive.owner_usage) | set(drive.block_list[0].get("quotas", {})))
+        self.poutput(f"{'Owner':<12} {'Blocks':>9} {'Limit':>9} {'Inodes':>8} {'Limit':>8} {'Bytes':>11}")
+        for owner in owners:
+            quota = drive.quota(owner)
+            block_limit = quota["block_limit"] or "-"
+            inode_limit = quota["inode_limit"] or "-"
+            self.poutput(f"{owner:<12} {quota['blocks']:>9} {block_limit:>9} {quota['inodes']:>8} {inode_limit:>8} {quota['bytes']:>11}")
 
     # File creation and writing system with path validation
-    write_parser = cmd2.Cmd2ArgumentParser(description='Write data to a mounted drive.')
-    write_parser.add_argument('path', nargs=1, completer=_complete_path_files_and_dirs, help='Path of the file to write to (e.g., A:/file.txt, file.txt, ../file.txt)')
-    write_parser.add_argument('data', nargs='?', help='Data to write to the file. Enclose in quotes for multiple words. If not provided, you will be prompted to enter the data.')
+    @staticmethod
+    def write_parser() -> cmd2.Cmd2ArgumentParser:
+        write_parser = cmd2.Cmd2ArgumentParser(description='Write data to a mounted drive.')
+        write_parser.add_argument('path', nargs=1, completer=MyApp._complete_path_files_and_dirs, help='Path of the file to write to (e.g., A:/file.txt, file.txt, ../file.txt)')
+        write_parser.add_argument('data', nargs='?', help='Data to write to the file. Enclose in quotes for multiple words. If not provided, you will be prompted to enter the data.')
+        write_parser.add_argument('-c', '--compress', choices=COMPRESSION_ALGORITHMS, default=None, help='Compression for this file (default: the drive setting)')
+        return write_parser
     @cmd2.with_argparser(write_parser)
     def do_write(self, args) -> None:
         """Write data to a file on a mounted drive, creating or overwriting as needed."""
@@ -546,133 +974,105 @@ class MyApp(cmd2.Cmd):
         
         # If no data provided, prompt user for input
         if data is None:
-            self.poutput("Enter the data to write to the file (press Enter when done):")
-            data = input()
+            data = self._ask("Enter the data to write to the file (press Enter when done):")
             if data is None:
-                data = ""  # Handle case where user presses Ctrl+C or similar
+                self.perror("Error: Data to write is required in batch mode.")
+                return
 
         # Resolve path (handle relative paths using current working directory)
-        resolved_path = self._resolve_path(target_path)
-        if resolved_path is None:
-            return
-
-        # Parse drive and file path
-        if len(resolved_path) < 3 or resolved_path[1:3] != ":/":
-            self.perror("Error: Invalid path format. Use format 'A:/filename' or relative paths like 'filename'.")
-            return
-
-        drive_letter = resolved_path[0].upper()
-        file_path = resolved_path[3:] if len(resolved_path) > 3 else ""
-
-        # Check if drive is mounted
-        if drive_letter not in mounted_drives:
-            self.perror(f"Error: No drive is mounted at {drive_letter}.")
+        resolved = self._lookup(target_path)
+        if resolved is None:
             return
-
-        drive = mounted_drives[drive_letter]
+        drive = resolved.drive
+        file_path = resolved.path[1:]
 
         # Validate that we have a filename
-        if file_path == "":
+        if resolved.is_root():
             self.perror("Error: Please specify a filename to write to.")
             return
         
-        # Check if file is being written to a subdirectory
-        if '/' in file_path:
-            # Extract directory path from the resolved absolute path
-            dir_parts = file_path.split('/')[:-1]  # Get all parts except the filename
-            
-            # Validate all parent directories exist using absolute paths
-            for i in range(len(dir_parts)):
-                # Build the absolute directory path up to this point
-                dir_path_check = '/' + '/'.join(dir_parts[:i+1])
-                
-                # Check if the directory exists
-                if drive.find_file(dir_path_check) is None:
-                    display_dir_path = '/'.join(dir_parts[:i+1])
-                    self.perror(f"Error: Directory '{display_dir_path}' does not exist. Create the directory first using mkdir.")
-                    return
-                
-                # Check if the found path is actually a directory
-                dir_inode_index = drive.find_file(dir_path_check)
-                if dir_inode_index is not None:
-                    inode_start = drive.block_list[0]["inode_start"]
-                    inode_per_block = drive.block_list[0]["block_size"] // 256
-                    dir_inode = drive.block_list[inode_start + (dir_inode_index // inode_per_block)][dir_inode_index % inode_per_block]
-                    if dir_inode["file_type"].lower() != "directory":
-                        display_dir_path = '/'.join(dir_parts[:i+1])
-                        self.perror(f"Error: '{display_dir_path}' is not a directory.")
-                        return
+        # Validate all parent directories exist (each prefix of the path)
+        dir_parts = resolved.components[:-1]
+        for i in range(1, len(dir_parts) + 1):
+            dir_inode_index = drive.find_components(dir_parts[:i])
+            if dir_inode_index is None:
+                self.perror(f"Error: Directory '{'/'.join(dir_parts[:i])}' does not exist. Create the directory first using mkdir.")
+                return
+            if drive.get_inode(dir_inode_index)["file_type"].lower() != "directory":
+                self.perror(f"Error: '{'/'.join(dir_parts[:i])}' is not a directory.")
+                return
+
+        io_mark = self._io_mark(drive)
+
+        if not self._writable(resolved):
+            return
 
         # Check if file already exists
-        existing_inode_index = drive.find_file(f"/{file_path}")
+        existing_inode_index = resolved.inode
         if existing_inode_index is not None:
             # File exists - delete the old one to allow overwriting
-            inode_start = drive.block_list[0]["inode_start"]
-            inode_per_block = drive.block_list[0]["block_size"] // 256
-            existing_inode = drive.block_list[inode_start + (existing_inode_index // inode_per_block)][existing_inode_index % inode_per_block]
+            existing_inode = drive.get_inode(existing_inode_index)
             
             # Check if it's actually a file (not a directory)
             if existing_inode["file_type"].lower() == "directory":
                 self.perror(f"Error: '{file_path}' is a directory, not a file.")
                 return
             
-            # Delete the existing file
-            drive.delete_inode(existing_inode_index)
+            # The file is rewritten in place, keeping its inode and reusing its blocks
             self.poutput(f"Overwriting existing file '{file_path}'.")
 
-        free_inode = drive.find_free_inode()
+        file_name = resolved.name
+        parent_index = resolved.parent()
+        free_inode = existing_inode_index if existing_inode_index is not None else drive.find_free_inode(parent_index)  # Prefer the parent directory's block group
         if free_inode is None:
             self.perror("Error: No free inodes available.")
             return
         
+        # A rewrite keeps the file's owner, group and permissions
+        existing = drive.get_inode(existing_inode_index) if existing_inode_index is not None else None
         data_inode = Inode(
-            file_name=f"/{file_path}",  # Store path without drive like "/foo/bar/file.txt"
+            file_name=file_name,  # Stored relative to the parent directory, like "file.txt"
             file_type="File",
             size=len(data),
             pointers=[],
-            uid="user",
-            time=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            permissions=[7,7,7],
-            mli_pointer=[]
+            uid=existing["uid"] if existing else access.user,
+            time=time.time_ns(),
+            permissions=list(existing["permissions"]) if existing else [7,7,7],
+            mli_pointer=[],
+            compression=args.compress,
+            parent=parent_index,
+            gid=existing.get("gid", DEFAULT_GROUP) if existing else access.group
         )
 
         if not drive.write_inode(data, data_inode, free_inode):
             self.perror("Error: Not enough space on drive to write data.")
             return
-        self.poutput(f"Wrote data to {resolved_path} on drive.")
-        save_drive(drive, drive.block_list[0]["name"] + ".json")
+        self.poutput(f"Wrote data to {resolved.display} on drive.")
+        self._report_io(drive, io_mark)
+        self._save(drive)
         return
         
 
 
     # Directory creation with extensive path validation
-    mkdir_parser = cmd2.Cmd2ArgumentParser(description='Create a directory on a mounted drive.')
-    mkdir_parser.add_argument('path', nargs=1, completer=_complete_path_files_and_dirs, help='Path of the directory to create (e.g., A:/mydir, mydir, ../mydir)')
+    @staticmethod
+    def mkdir_parser() -> cmd2.Cmd2ArgumentParser:
+        mkdir_parser = cmd2.Cmd2ArgumentParser(description='Create a directory on a mounted drive.')
+        mkdir_parser.add_argument('path', nargs=1, completer=MyApp._complete_path_files_and_dirs, help='Path of the directory to create (e.g., A:/mydir, mydir, ../mydir)')
+        return mkdir_parser
     @cmd2.with_argparser(mkdir_parser)
     def do_mkdir(self, args) -> None:
         """Create a directory with comprehensive validation of path format and parent directories."""
         target_path = args.path[0]
         
         # Resolve path (handle relative paths using current working directory)
-        resolved_path = self._resolve_path(target_path)
-        if resolved_path is None:
-            return
-
-        # Parse drive and directory path
-        if len(resolved_path) < 3 or resolved_path[1:3] != ":/":
-            self.perror("Error: Invalid path format. Use format 'A:/dirname' or relative paths like 'dirname'.")
-            return
-
-        drive_letter = resolved_path[0].upper()
-        dir_name = resolved_path[3:] if len(resolved_path) > 3 else ""
-
-        # Check if drive is mounted
-        if drive_letter not in mounted_drives:
-            self.perror(f"Error: No drive is mounted at {drive_letter}.")
+        resolved = self._lookup(target_path)
+        if resolved is None:
             return
+        dir_name = resolved.path[1:]
         
         # Validate that we have a directory name
-        if dir_name == "" or dir_name == "/":
+        if resolved.is_root():
             self.perror("Error: Directory name cannot be empty or just '/'.")
             return
         
@@ -695,52 +1095,47 @@ class MyApp(cmd2.Cmd):
             self.perror("Error: Directory name cannot start or end with dots.")
             return
         
-        drive = mounted_drives[drive_letter]
+        drive = resolved.drive
         
         # Check if directory already exists
-        existing_inode = drive.find_file(f"/{dir_name}")
-        if existing_inode is not None:
+        if resolved.inode is not None:
             self.perror(f"Error: Directory '{dir_name}' already exists.")
             return
         
-        # Validate parent directories exist for nested paths
-        if '/' in dir_name:
-            parts = dir_name.split('/')
-            # Check each parent directory exists
-            current_path_without_drive = "/"
-            for i, part in enumerate(parts[:-1]):  # All parts except the last (which we're creating)
-                current_path_without_drive += part
-                if drive.find_file(current_path_without_drive) is None:
-                    self.perror(f"Error: Parent directory '{'/'.join(parts[:i+1])}' does not exist. Create parent directories first.")
-                    return
-                
-                # Verify it's actually a directory
-                parent_inode_index = drive.find_file(current_path_without_drive)
-                if parent_inode_index is not None:
-                    inode_start = drive.block_list[0]["inode_start"]
-                    inode_per_block = drive.block_list[0]["block_size"] // 256
-                    parent_inode = drive.block_list[inode_start + (parent_inode_index // inode_per_block)][parent_inode_index % inode_per_block]
-                    if parent_inode["file_type"].lower() != "directory":
-                        self.perror(f"Error: '{'/'.join(parts[:i+1])}' is not a directory.")
-                        return
-                current_path_without_drive += "/"
+        # Validate parent directories exist for nested paths (all parts except the last, which we're creating)
+        parts = resolved.components
+        for i in range(1, len(parts)):
+            parent_inode_index = drive.find_components(parts[:i])
+            if parent_inode_index is None:
+                self.perror(f"Error: Parent directory '{'/'.join(parts[:i])}' does not exist. Create parent directories first.")
+                return
+            if drive.get_inode(parent_inode_index)["file_type"].lower() != "directory":
+                self.perror(f"Error: '{'/'.join(parts[:i])}' is not a directory.")
+                return
         
+        if not self._permitted(access.check, resolved, parent=WRITE | EXECUTE):
+            return
+
         # Check for available inodes
-        free_inode = drive.find_free_inode()
+        base_name = resolved.name
+        parent_index = resolved.parent()
+        free_inode = drive.find_free_inode(parent_index, directory=True)
         if free_inode is None:
             self.perror("Error: No free inodes available.")
             return
         
         # Create directory inode
         dir_inode = Inode(
-            file_name=f"/{dir_name}",  # Store path without drive like "/foo/bar"
+            file_name=base_name,  # Stored relative to the parent directory, like "bar"
             file_type="Directory",
             size=0,
             pointers=[],
-            uid="user",
-            time=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            uid=access.user,
+            time=time.time_ns(),
             permissions=[7,7,7],
-            mli_pointer=[]
+            mli_pointer=[],
+            parent=parent_index,
+            gid=access.group
         )
         
         # Write the inode to disk
@@ -748,22 +1143,556 @@ class MyApp(cmd2.Cmd):
             self.perror("Error: Not enough space on drive to create directory.")
             return
         
-        self.poutput(f"Created directory '{resolved_path}'.")
-        save_drive(drive, drive.block_list[0]["name"] + ".json")
+        self.poutput(f"Created directory '{resolved.display}'.")
+        self._save(drive)
         return
 
 
 
 
-    rmdir_parser = cmd2.Cmd2ArgumentParser(description='Remove a directory from a mounted drive.')
-    rmdir_parser.add_argument('path', nargs=1, completer=_complete_path_directories, help='Path of the directory to remove (e.g., A:/mydir)')
+    def _save(self, drive: Drive, filename: str | None = None) -> bool:
+        """Save a drive's image (<drive name>.json unless filename is given). Prints an error and returns False if it couldn't be written."""
+        filename = filename or drive.block_list[0]["name"] + ".json"
+        if save_drive(drive, filename):
+            return True
+        self.perror(f"Error: Could not save {filename}; the drive bay still holds its previous image.")
+        return False
+
+    def _lookup(self, target_path: str, target: int = 0, parent: int = 0) -> ResolvedPath | None:
+        """
+        Resolve a user-supplied path to its drive, components and inode through the shared cache,
+        checking that the session may search every directory above it (and has any target/parent
+        permission bits asked for, see AccessChecker.check).
+        Prints an error and returns None if the path is invalid, the drive isn't mounted or access is denied.
+        """
+        try:
+            resolved = resolver.resolve(target_path)
+            access.check(resolved, target, parent)
+            return resolved
+        except PathError as e:
+            self.perror(str(e))
+            return None
+
+    def _permitted(self, check, *args, **kwargs) -> bool:
+        """Run an access check (like access.check or access.check_tree); print the error and return False if it's denied."""
+        try:
+            check(*args, **kwargs)
+            return True
+        except AccessDenied as e:
+            self.perror(str(e))
+            return False
+
+    def _writable(self, resolved: ResolvedPath) -> bool:
+        """Check the session may write the file at resolved, or create it in its directory if it doesn't exist yet."""
+        if resolved.inode is not None:
+            return self._permitted(access.check, resolved, target=WRITE)
+        return self._permitted(access.check, resolved, parent=WRITE | EXECUTE)
+
+    def _io_mark(self, drive: Drive) -> tuple[float, dict | None]:
+        """Record wall-clock time and the drive's simulated I/O counters before an operation."""
+        return time.perf_counter(), drive.device.stats() if drive.device is not None else None
+
+    def _report_io(self, drive: Drive, io_mark: tuple[float, dict | None]) -> None:
+        """Print the wall-clock and simulated I/O time spent since _io_mark (as feedback, so piped output stays clean)."""
+        wall = time.perf_counter() - io_mark[0]
+        if drive.device is None:
+            self.pfeedback(f"I/O: {wall * 1000:.2f} ms wall-clock")
+            return
+        before, after = io_mark[1], drive.device.stats()
+        reads = after["reads"] - before["reads"]
+        writes = after["writes"] - before["writes"]
+        simulated = after["elapsed"] - before["elapsed"]
+        self.pfeedback(f"I/O: {wall * 1000:.2f} ms wall-clock, {simulated * 1000:.2f} ms simulated on {drive.device.name} ({reads} block reads, {writes} block writes)")
+
+    def _leave_removed_directory(self) -> None:
+        """Move the working directory back to the drive root if it was removed."""
+        if pwd["drive"] is None:
+            return
+        drive = mounted_drives.get(pwd["drive"])
+        if drive is None or resolver.resolve(pwd["path"]).inode is None:
+            pwd["path"] = "/"
+            self.prompt = f"AFS[{pwd['drive']}:/]$ "
+
+    def _copy_or_move_target(self, source_drive: Drive, source_index: int, destination: str) -> tuple[str, Drive, int, str, int | None] | None:
+        """
+        Work out where a cp/mv source ends up: (drive letter, drive, parent inode, name, existing inode).
+        An existing directory destination receives the source under its own name;
+        otherwise the destination's parent must exist and its last component is the new name.
+        An existing file at the destination is left in place for the caller to replace
+        once the copy or move has succeeded.
+        """
+        resolved = self._lookup(destination)
+        if resolved is None:
+            return None
+        drive_letter, drive = resolved.letter, resolved.drive
+        source_name = source_drive.get_inode(source_index)["file_name"]
+
+        if resolved.is_directory():
+            parent_index, name = resolved.inode, source_name
+            if not self._permitted(access.require, drive, parent_index, WRITE | EXECUTE, resolved.display):
+                return None
+        else:
+            parent_index, name = resolved.parent(), resolved.name
+            if parent_index is None or drive.get_inode(parent_index)["file_type"].lower() != "directory":
+                self.perror(f"Error: Directory '{resolved.parent_path}' does not exist.")
+                return None
+            if not self._permitted(access.check, resolved, parent=WRITE | EXECUTE):
+                return None
+
+        existing = drive.list_directory(parent_index).get(name)
+        if existing is not None:
+            if existing == source_index and drive is source_drive:
+                self.perror(f"Error: '{name}' and its destination are the same.")
+                return None
+            if drive.get_inode(existing)["file_type"].lower() == "directory":
+                self.perror(f"Error: Cannot overwrite directory '{name}'.")
+                return None
+            if source_drive.get_inode(source_index)["file_type"].lower() == "directory":
+                self.perror(f"Error: Cannot overwrite file '{name}' with a directory.")
+                return None
+
+        if drive is source_drive and source_drive.is_ancestor(source_index, parent_index):
+            self.perror("Error: Cannot copy or move a directory into itself.")
+            return None
+        return drive_letter, drive, parent_index, name, existing
+
+    @staticmethod
+    def _copy_into_place(source_drive: Drive, source_index: int, target_drive: Drive, parent_index: int, name: str, existing: int | None, owner: tuple[str, str] | None = None) -> int | None:
+        """
+        Copy a tree to parent/name on the target drive, replacing the file already there.
+        The copy is made under a temporary name and renamed over the old file only once it
+        has succeeded, so a copy refused for space or quota leaves the destination intact.
+        """
+        if existing is None:
+            return source_drive.copy_tree(source_index, target_drive, parent_index, name, owner)
+        siblings, temporary, n = target_drive.list_directory(parent_index), f".{name}.copy", 1
+        while temporary in siblings:
+            temporary, n = f".{name}.copy{n}", n + 1
+        new_index = source_drive.copy_tree(source_index, target_drive, parent_index, temporary, owner)
+        if new_index is not None:
+            target_drive.rename(new_index, parent_index, name, replace=True)
+        return new_index
+
+    @staticmethod
+    def rm_parser() -> cmd2.Cmd2ArgumentParser:
+        rm_parser = cmd2.Cmd2ArgumentParser(description='Remove files (and directories with -r) from a mounted drive.')
+        rm_parser.add_argument('-r', '--recursive', action='store_true', help='Remove directories and their contents')
+        rm_parser.add_argument('path', nargs='+', completer=MyApp._complete_path_files_and_dirs, help='Paths to remove (e.g., A:/file.txt, file.txt, ../dir)')
+        return rm_parser
+    @cmd2.with_argparser(rm_parser)
+    def do_rm(self, args) -> None:
+        """Remove files, or whole directory trees with -r. Cost is proportional to what is removed."""
+        changed = {}
+        for target_path in args.path:
+            resolved = self._lookup(target_path)
+            if resolved is None:
+                continue
+            drive_letter, drive, path, inode_index = resolved.letter, resolved.drive, resolved.path, resolved.inode
+            if resolved.is_root():
+                self.perror("Error: Cannot remove the root directory.")
+                continue
+            if inode_index is None:
+                self.perror(f"Error: '{path[1:]}' does not exist.")
+                continue
+            if drive.get_inode(inode_index)["file_type"].lower() == "directory" and not args.recursive:
+                self.perror(f"Error: '{path[1:]}' is a directory. Use 'rm -r' or 'rmdir'.")
+                continue
+            if not self._permitted(access.check, resolved, parent=WRITE | EXECUTE) or not self._permitted(access.check_tree, drive, inode_index, READ | WRITE | EXECUTE, 0, drive_letter):
+                continue
+            removed = drive.remove_tree(inode_index)
+            changed[drive_letter] = drive
+            self.poutput(f"Removed '{drive_letter}:{path}'" + (f" ({removed} entries)." if removed > 1 else "."))
+
+        for drive in changed.values():
+            self._save(drive)
+        self._leave_removed_directory()
+
+
+    @staticmethod
+    def rmdir_parser() -> cmd2.Cmd2ArgumentParser:
+        rmdir_parser = cmd2.Cmd2ArgumentParser(description='Remove a directory from a mounted drive.')
+        rmdir_parser.add_argument('-r', '--recursive', action='store_true', help='Remove the directory even if it is not empty')
+        rmdir_parser.add_argument('path', nargs=1, completer=MyApp._complete_path_directories, help='Path of the directory to remove (e.g., A:/mydir)')
+        return rmdir_parser
     @cmd2.with_argparser(rmdir_parser)
     def do_rmdir(self, args) -> None:
-        pass
+        """Remove an empty directory, or a whole directory tree with -r."""
+        resolved = self._lookup(args.path[0])
+        if resolved is None:
+            return
+        drive_letter, drive, path, dir_inode_index = resolved.letter, resolved.drive, resolved.path, resolved.inode
+        if resolved.is_root():
+            self.perror("Error: Cannot remove the root directory.")
+            return
+        if dir_inode_index is None:
+            self.perror(f"Error: Directory '{path[1:]}' does not exist.")
+            return
+        if drive.get_inode(dir_inode_index)["file_type"].lower() != "directory":
+            self.perror(f"Error: '{path[1:]}' is not a directory.")
+            return
+        if drive.list_directory(dir_inode_index) and not args.recursive:
+            self.perror(f"Error: Directory '{path[1:]}' is not empty. Use 'rmdir -r' to remove it and its contents.")
+            return
+        if not self._permitted(access.check, resolved, parent=WRITE | EXECUTE) or not self._permitted(access.check_tree, drive, dir_inode_index, READ | WRITE | EXECUTE, 0, drive_letter):
+            return
 
+        removed = drive.remove_tree(dir_inode_index)
+        self.poutput(f"Removed directory '{drive_letter}:{path}'" + (f" ({removed} entries)." if removed > 1 else "."))
+        self._save(drive)
+        self._leave_removed_directory()
+
+
+    @staticmethod
+    def mv_parser() -> cmd2.Cmd2ArgumentParser:
+        mv_parser = cmd2.Cmd2ArgumentParser(description='Move or rename a file or directory.')
+        mv_parser.add_argument('source', nargs=1, completer=MyApp._complete_path_files_and_dirs, help='Path to move (e.g., A:/old.txt, old.txt)')
+        mv_parser.add_argument('destination', nargs=1, completer=MyApp._complete_path_files_and_dirs, help='New path, or an existing directory to move into')
+        return mv_parser
+    @cmd2.with_argparser(mv_parser)
+    def do_mv(self, args) -> None:
+        """Move or rename a file or directory. Within a drive this is O(1) whatever the subtree size."""
+        resolved = self._lookup(args.source[0])
+        if resolved is None:
+            return
+        source_letter, source_drive, source_path, source_index = resolved.letter, resolved.drive, resolved.path, resolved.inode
+        if resolved.is_root():
+            self.perror("Error: Cannot move the root directory.")
+            return
+        if source_index is None:
+            self.perror(f"Error: '{source_path[1:]}' does not exist.")
+            return
+        if not self._permitted(access.check, resolved, parent=WRITE | EXECUTE):
+            return
+
+        target = self._copy_or_move_target(source_drive, source_index, args.destination[0])
+        if target is None:
+            return
+        target_letter, target_drive, parent_index, name, existing = target
+
+        if target_drive is source_drive:
+            if not source_drive.rename(source_index, parent_index, name, replace=existing is not None):
+                self.perror(f"Error: Could not move '{source_path[1:]}'.")
+                return
+        else:
+            # Different drives: copy the tree across, then remove the original
+            if not self._permitted(access.check_tree, source_drive, source_index, READ | EXECUTE, READ, source_letter):
+                return
+            if self._copy_into_place(source_drive, source_index, target_drive, parent_index, name, existing) is None:
+                self.perror("Error: Not enough space or inodes on the destination drive.")
+                self._save(target_drive)
+                return
+            source_drive.remove_tree(source_index)
+            self._save(target_drive)
+        self._save(source_drive)
+
+        new_path = target_drive.path_of(target_drive.list_directory(parent_index)[name])
+        self.poutput(f"Moved '{source_letter}:{source_path}' to '{target_letter}:{new_path}'.")
+
+        # Keep the working directory valid if it was inside the moved tree
+        if pwd["drive"] == source_letter and (pwd["path"] == source_path or pwd["path"].startswith(source_path + "/")):
+            pwd["drive"] = target_letter
+            pwd["path"] = new_path + pwd["path"][len(source_path):]
+            self.prompt = f"AFS[{pwd['drive']}:{pwd['path']}]$ "
+
+
+    @staticmethod
+    def cp_parser() -> cmd2.Cmd2ArgumentParser:
+        cp_parser = cmd2.Cmd2ArgumentParser(description='Copy a file (or a directory with -r).')
+        cp_parser.add_argument('-r', '--recursive', action='store_true', help='Copy directories and their contents')
+        cp_parser.add_argument('source', nargs=1, completer=MyApp._complete_path_files_and_dirs, help='Path to copy (e.g., A:/file.txt, file.txt)')
+        cp_parser.add_argument('destination', nargs=1, completer=MyApp._complete_path_files_and_dirs, help='New path, or an existing directory to copy into')
+        return cp_parser
+    @cmd2.with_argparser(cp_parser)
+    def do_cp(self, args) -> None:
+        """Copy files or directory trees. Copies on the same drive share data blocks until rewritten."""
+        resolved = self._lookup(args.source[0])
+        if resolved is None:
+            return
+        source_letter, source_drive, source_path, source_index = resolved.letter, resolved.drive, resolved.path, resolved.inode
+        if source_index is None:
+            self.perror(f"Error: '{source_path[1:]}' does not exist.")
+            return
+        if source_drive.get_inode(source_index)["file_type"].lower() == "directory" and not args.recursive:
+            self.perror(f"Error: '{source_path[1:] or '/'}' is a directory. Use 'cp -r' to copy it.")
+            return
+        if not self._permitted(access.check_tree, source_drive, source_index, READ | EXECUTE, READ, source_letter):
+            return
 
-    cd_parser = cmd2.Cmd2ArgumentParser(description='Change the current working directory.')
-    cd_parser.add_argument('path', nargs='?', completer=_complete_path_directories, help='Directory path to change to (e.g., A:/, A:/mydir, mydir, .., .)')
+        target = self._copy_or_move_target(source_drive, source_index, args.destination[0])
+        if target is None:
+            return
+        target_letter, target_drive, parent_index, name, existing = target
+
+        new_index = self._copy_into_place(source_drive, source_index, target_drive, parent_index, name, existing, (access.user, access.group))
+        self._save(target_drive)
+        if new_index is None:
+            self.perror("Error: Not enough space or inodes on the destination drive.")
+            return
+        self.poutput(f"Copied '{source_letter}:{source_path}' to '{target_letter}:{target_drive.path_of(new_index)}'.")
+
+
+    @staticmethod
+    def fallocate_parser() -> cmd2.Cmd2ArgumentParser:
+        fallocate_parser = cmd2.Cmd2ArgumentParser(description='Preallocate data blocks for a file so it can grow without fragmenting.')
+        fallocate_parser.add_argument('-l', '--length', type=int, required=True, help='Number of data blocks the file should own')
+        fallocate_parser.add_argument('path', nargs=1, completer=MyApp._complete_path_files_and_dirs, help='File to preallocate (created empty if it does not exist)')
+        return fallocate_parser
+    @cmd2.with_argparser(fallocate_parser)
+    def do_fallocate(self, args) -> None:
+        """Reserve data blocks for a file up front, in one contiguous run where possible."""
+        resolved = self._lookup(args.path[0])
+        if resolved is None:
+            return
+        drive_letter, drive, path = resolved.letter, resolved.drive, resolved.path
+        if args.length < 1:
+            self.perror("Error: Length must be at least 1 block.")
+            return
+        if drive.block_list[0].get("dedup", False):
+            self.perror("Error: Preallocation is not supported on deduplicated drives.")
+            return
+        if not self._writable(resolved):
+            return
+
+        inode_index = resolved.inode
+        if inode_index is None:
+            parent_index, file_name = resolved.parent(), resolved.name
+            if parent_index is None or drive.get_inode(parent_index)["file_type"].lower() != "directory":
+                self.perror(f"Error: Directory '{resolved.parent_path}' does not exist.")
+                return
+            inode_index = drive.find_free_inode(parent_index)
+            if inode_index is None:
+                self.perror("Error: No free inodes available.")
+                return
+            # Create the file empty, then preallocate it like an existing one (a single contiguous run where possible)
+            if not drive.write_inode("", Inode(file_name, "File", 0, [], access.user, time.time_ns(), [7,7,7], [], None, parent_index, access.group), inode_index):
+                self.perror("Error: Not enough space on drive.")
+                return
+            created = True
+        elif drive.get_inode(inode_index)["file_type"].lower() == "directory":
+            self.perror(f"Error: '{path[1:]}' is a directory, not a file.")
+            return
+        else:
+            created = False
+        try:
+            allocated = drive.fallocate(inode_index, args.length)
+        except QuotaExceeded:
+            if created:
+                drive.delete_inode(inode_index)  # Don't leave an empty file behind
+            raise
+        if not allocated:
+            if created:
+                drive.delete_inode(inode_index)
+            self.perror("Error: Not enough space on drive.")
+            return
+        extents = drive.get_inode(inode_index)["pointers"]
+        self.poutput(f"Preallocated {args.length} blocks for '{drive_letter}:{path}' in {len(extents)} extent{'s' if len(extents) != 1 else ''}.")
+        self._save(drive)
+
+
+    @staticmethod
+    def su_parser() -> cmd2.Cmd2ArgumentParser:
+        su_parser = cmd2.Cmd2ArgumentParser(description='Act as another user for the rest of the session.')
+        su_parser.add_argument('-g', '--group', action='append', default=[], help='Group to be a member of; repeat for several. The first is given to new files (default: users)')
+        su_parser.add_argument('user', nargs='?', default=SUPERUSER, help=f'User to act as (default: {SUPERUSER}, who passes every permission check)')
+        return su_parser
+    @cmd2.with_argparser(su_parser)
+    def do_su(self, args) -> None:
+        """Switch the session's user and groups. Later commands are checked against the new user's permissions."""
+        if any(not name or ':' in name for name in [args.user, *args.group]):
+            self.perror("Error: User and group names can't be empty or contain ':'.")
+            return
+        access.switch(args.user, args.group)
+        self.poutput(f"Now acting as {access.user} (groups: {', '.join(access.groups)}).")
+
+    @staticmethod
+    def whoami_parser() -> cmd2.Cmd2ArgumentParser:
+        whoami_parser = cmd2.Cmd2ArgumentParser(description='Show the user the session acts as.')
+        return whoami_parser
+    @cmd2.with_argparser(whoami_parser)
+    def do_whoami(self, args) -> None:
+        """Show the user the session acts as and their groups."""
+        self.poutput(f"{access.user} (groups: {', '.join(access.groups)})")
+
+    @staticmethod
+    def chmod_parser() -> cmd2.Cmd2ArgumentParser:
+        chmod_parser = cmd2.Cmd2ArgumentParser(description='Change the permissions of files and directories.')
+        chmod_parser.add_argument('mode', help='Octal permissions for the owner, group and everyone else (e.g., 755, 640)')
+        chmod_parser.add_argument('path', nargs='+', completer=MyApp._complete_path_files_and_dirs, help='Paths to change')
+        return chmod_parser
+    @cmd2.with_argparser(chmod_parser)
+    def do_chmod(self, args) -> None:
+        """Set rwx permissions. Only the owner (or root) can change them."""
+        permissions = parse_mode(args.mode)
+        if permissions is None:
+            self.perror(f"Error: Invalid mode '{args.mode}'. Use three octal digits like 755.")
+            return
+        changed = {}
+        for target_path in args.path:
+            resolved = self._lookup(target_path)
+            if resolved is None:
+                continue
+            if resolved.inode is None:
+                self.perror(f"Error: '{resolved.display}' does not exist.")
+                continue
+            drive = resolved.drive
+            if not access.is_superuser() and drive.get_inode(resolved.inode)["uid"] != access.user:
+                self.perror(f"Error: Only the owner can change the permissions of '{resolved.display}'.")
+                continue
+            drive.chmod(resolved.inode, permissions)
+            changed[resolved.letter] = drive
+            self.poutput(f"Set '{resolved.display}' to {permission_string(permissions)}.")
+        for drive in changed.values():
+            self._save(drive)
+
+    @staticmethod
+    def chown_parser() -> cmd2.Cmd2ArgumentParser:
+        chown_parser = cmd2.Cmd2ArgumentParser(description='Change the owner and/or group of files and directories.')
+        chown_parser.add_argument('owner', help='New owner, owner:group, or :group to change only the group')
+        chown_parser.add_argument('path', nargs='+', completer=MyApp._complete_path_files_and_dirs, help='Paths to change')
+        return chown_parser
+    @cmd2.with_argparser(chown_parser)
+    def do_chown(self, args) -> None:
+        """Change ownership. Only root can give a file away; an owner can change its group to one of their own groups."""
+        uid, _, gid = args.owner.partition(':')
+        uid, gid = uid or None, gid or None
+        if uid is None and gid is None:
+            self.perror("Error: Please specify an owner, owner:group or :group.")
+            return
+        changed = {}
+        for target_path in args.path:
+            resolved = self._lookup(target_path)
+            if resolved is None:
+                continue
+            if resolved.inode is None:
+                self.perror(f"Error: '{resolved.display}' does not exist.")
+                continue
+            drive = resolved.drive
+            inode = drive.get_inode(resolved.inode)
+            if not access.is_superuser():
+                if uid is not None and uid != inode["uid"]:
+                    self.perror(f"Error: Only {SUPERUSER} can change the owner of '{resolved.display}'.")
+                    continue
+                if inode["uid"] != access.user or (gid is not None and gid not in access.groups):
+                    self.perror(f"Error: Only the owner can change the group of '{resolved.display}', to a group they are in.")
+                    continue
+            drive.chown(resolved.inode, uid, gid)
+            changed[resolved.letter] = drive
+            self.poutput(f"'{resolved.display}' is now owned by {inode['uid']}:{inode.get('gid', DEFAULT_GROUP)}.")
+        for drive in changed.values():
+            self._save(drive)
+
+
+    @staticmethod
+    def xattr_parser() -> cmd2.Cmd2ArgumentParser:
+        xattr_parser = cmd2.Cmd2ArgumentParser(description='List, show, set or remove extended attributes of a file or directory.')
+        xattr_parser.add_argument('action', choices=['list', 'get', 'set', 'remove'], help='Attribute operation to perform')
+        xattr_parser.add_argument('path', nargs=1, completer=MyApp._complete_path_files_and_dirs, help='File or directory (e.g., A:/file.txt, file.txt)')
+        xattr_parser.add_argument('name', nargs='?', help='Attribute name (not needed for list)')
+        xattr_parser.add_argument('value', nargs='?', help='Value to set')
+        return xattr_parser
+    @cmd2.with_argparser(xattr_parser)
+    def do_xattr(self, args) -> None:
+        """Manage user extended attributes: free-form name/value pairs that find can search by."""
+        resolved = self._lookup(args.path[0], target=WRITE if args.action in ('set', 'remove') else READ)
+        if resolved is None:
+            return
+        if resolved.inode is None:
+            self.perror(f"Error: '{resolved.display}' does not exist.")
+            return
+        drive = resolved.drive
+        xattrs = drive.get_inode(resolved.inode).get("xattrs", {})
+
+        if args.action == "list":
+            if not xattrs:
+                self.poutput(f"'{resolved.display}' has no extended attributes.")
+            for name, value in sorted(xattrs.items()):
+                self.poutput(f"{name}={value}")
+            return
+
+        if not args.name or '=' in args.name:
+            self.perror(f"Error: Please specify an attribute name to {args.action} (without '=').")
+            return
+        if args.action == "get":
+            if args.name not in xattrs:
+                self.perror(f"Error: '{resolved.display}' has no attribute '{args.name}'.")
+                return
+            self.poutput(xattrs[args.name])
+            return
+        if args.action == "set":
+            if args.value is None:
+                self.perror("Error: Please specify the value to set.")
+                return
+            drive.set_xattr(resolved.inode, args.name, args.value)
+            self.poutput(f"Set {args.name} on '{resolved.display}'.")
+        elif not drive.remove_xattr(resolved.inode, args.name):
+            self.perror(f"Error: '{resolved.display}' has no attribute '{args.name}'.")
+            return
+        else:
+            self.poutput(f"Removed {args.name} from '{resolved.display}'.")
+        self._save(drive)
+
+    @staticmethod
+    def _timestamp_argument(text: str) -> int:
+        """argparse type for times like "2025-01-31", "2025-01-31 14:00" or "2025-01-31 14:00:05", as nanoseconds since the epoch."""
+        for pattern in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+            try:
+                return int(datetime.datetime.strptime(text, pattern).timestamp()) * 1_000_000_000
+            except ValueError:
+                continue
+        raise argparse.ArgumentTypeError(f"invalid time '{text}' (use YYYY-MM-DD or 'YYYY-MM-DD HH:MM[:SS]')")
+
+    @staticmethod
+    def find_parser() -> cmd2.Cmd2ArgumentParser:
+        find_parser = cmd2.Cmd2ArgumentParser(description='Find files and directories by name, type, owner, size, modification time or extended attribute.')
+        find_parser.add_argument('path', nargs='?', default='.', completer=MyApp._complete_path_directories, help='Directory to search below (default: the current directory)')
+        find_parser.add_argument('-n', '--name', help='Name glob, like "*.txt" or "report-202?" (quote it)')
+        find_parser.add_argument('-t', '--type', choices=['f', 'd'], help='Only files (f) or directories (d)')
+        find_parser.add_argument('-u', '--user', help='Only entries owned by this user')
+        find_parser.add_argument('--min-size', type=int, help='Smallest size in bytes')
+        find_parser.add_argument('--max-size', type=int, help='Largest size in bytes')
+        find_parser.add_argument('--newer', type=MyApp._timestamp_argument, help='Modified at or after this time (YYYY-MM-DD [HH:MM[:SS]])')
+        find_parser.add_argument('--older', type=MyApp._timestamp_argument, help='Modified before this time')
+        find_parser.add_argument('-x', '--xattr', help='Has this extended attribute (NAME), or with this value (NAME=VALUE)')
+        return find_parser
+    @cmd2.with_argparser(find_parser)
+    def do_find(self, args) -> None:
+        """Search a directory tree through the drive's metadata indexes; entries the user can't see are left out."""
+        resolved = self._lookup(args.path, target=READ | EXECUTE)
+        if resolved is None:
+            return
+        if resolved.inode is None:
+            self.perror(f"Error: Directory '{resolved.display}' does not exist.")
+            return
+        if not resolved.is_directory():
+            self.perror(f"Error: '{resolved.display}' is not a directory.")
+            return
+        xattr = None
+        if args.xattr is not None:
+            name, separator, value = args.xattr.partition('=')
+            xattr = (name, value if separator else None)
+
+        drive = resolved.drive
+        matches = drive.find(resolved.inode, args.name, {'f': 'file', 'd': 'directory', None: None}[args.type], args.user,
+                             (args.min_size, args.max_size), (args.newer, args.older), xattr)
+        paths = []
+        for index in matches:
+            path = drive.path_of(index)
+            try:
+                access.check(ResolvedPath(resolved.letter, drive, tuple(path[1:].split('/')), index), parent=READ | EXECUTE)
+            except AccessDenied:
+                continue  # Like ls, seeing a name needs read permission on its directory
+            paths.append(path)
+        if not paths:
+            self.poutput("No matches found.")
+        for path in sorted(paths):
+            self.poutput(f"{resolved.letter}:{path}")
+
+
+    @staticmethod
+    def cd_parser() -> cmd2.Cmd2ArgumentParser:
+        cd_parser = cmd2.Cmd2ArgumentParser(description='Change the current working directory.')
+        cd_parser.add_argument('path', nargs='?', completer=MyApp._complete_path_directories, help='Directory path to change to (e.g., A:/, A:/mydir, mydir, .., .)')
+        return cd_parser
     @cmd2.with_argparser(cd_parser)
     def do_cd(self, args) -> None:
         """Change the current working directory to an existing directory."""
@@ -780,27 +1709,14 @@ class MyApp(cmd2.Cmd):
             return
         
         # Resolve path (handle relative paths)
-        resolved_path = self._resolve_path(target_path)
-        if resolved_path is None:
-            return
-        
-        # Parse drive and directory path
-        if len(resolved_path) < 3 or resolved_path[1:3] != ":/":
-            self.perror("Error: Invalid path format. Use format 'A:/' or 'A:/dirname'.")
+        resolved = self._lookup(target_path, target=EXECUTE)
+        if resolved is None:
             return
-        
-        drive_letter = resolved_path[0].upper()
-        dir_path = resolved_path[3:] if len(resolved_path) > 3 else ""
-        
-        # Check if drive is mounted
-        if drive_letter not in mounted_drives:
-            self.perror(f"Error: No drive is mounted at {drive_letter}.")
-            return
-        
-        drive = mounted_drives[drive_letter]
+        drive_letter = resolved.letter
+        dir_path = resolved.path[1:]
         
         # Handle root directory case
-        if dir_path == "":
+        if resolved.is_root():
             # Changing to root directory
             pwd["drive"] = drive_letter
             pwd["path"] = "/"
@@ -810,17 +1726,12 @@ class MyApp(cmd2.Cmd):
             return
         
         # Check if the target directory exists
-        target_full_path = f"/{dir_path}"
-        dir_inode_index = drive.find_file(target_full_path)
-        if dir_inode_index is None:
+        if resolved.inode is None:
             self.perror(f"Error: Directory '{dir_path}' does not exist.")
             return
         
         # Verify it's actually a directory
-        inode_start = drive.block_list[0]["inode_start"]
-        inode_per_block = drive.block_list[0]["block_size"] // 256
-        dir_inode = drive.block_list[inode_start + (dir_inode_index // inode_per_block)][dir_inode_index % inode_per_block]
-        if dir_inode["file_type"].lower() != "directory":
+        if not resolved.is_directory():
             self.perror(f"Error: '{dir_path}' is not a directory.")
             return
         
@@ -834,8 +1745,12 @@ class MyApp(cmd2.Cmd):
 
 
     # Directory listing with support for relative and absolute paths
-    ls_parser = cmd2.Cmd2ArgumentParser(description='List directory contents.')
-    ls_parser.add_argument('path', nargs='?', completer=_complete_path_directories, help='Optional directory path to list (e.g., A:/, A:/mydir, mydir)')
+    @staticmethod
+    def ls_parser() -> cmd2.Cmd2ArgumentParser:
+        ls_parser = cmd2.Cmd2ArgumentParser(description='List directory contents.')
+        ls_parser.add_argument('path', nargs='?', completer=MyApp._complete_path_directories, help='Optional directory path to list (e.g., A:/, A:/mydir, mydir)')
+        ls_parser.add_argument('-l', '--long', action='store_true', help='Also show permissions, owner and group')
+        return ls_parser
     @cmd2.with_argparser(ls_parser)
     def do_ls(self, args) -> None:
         """List directory contents for the current working directory or specified path."""
@@ -849,176 +1764,44 @@ class MyApp(cmd2.Cmd):
             target_path = f"{pwd['drive']}:{pwd['path']}"
         
         # Resolve path (handle relative paths)
-        resolved_path = self._resolve_path(target_path)
-        if resolved_path is None:
-            return
-        
-        # Parse drive and directory path
-        if len(resolved_path) < 3 or resolved_path[1:3] != ":/":
-            self.perror("Error: Invalid path format. Use format 'A:/' or 'A:/dirname'.")
-            return
-        
-        drive_letter = resolved_path[0].upper()
-        dir_path = resolved_path[3:] if len(resolved_path) > 3 else ""
-        
-        # Check if drive is mounted
-        if drive_letter not in mounted_drives:
-            self.perror(f"Error: No drive is mounted at {drive_letter}.")
+        resolved = self._lookup(target_path, target=READ)
+        if resolved is None:
             return
         
-        drive = mounted_drives[drive_letter]
-        
         # List files and directories
-        self._list_directory_contents(drive, drive_letter, dir_path)
+        self._list_directory_contents(resolved, args.long)
     
-    def _resolve_path(self, path: str) -> str | None:
-        """
-        Resolve relative paths to absolute paths using current working directory.
-        Handles ., .., and relative paths appropriately with proper path normalization.
+    def _list_directory_contents(self, resolved: ResolvedPath, long: bool = False) -> None:
         """
-        if path.startswith('/'):
-            # Absolute path without drive - use current drive
-            if pwd["drive"] is None:
-                self.perror("Error: No current directory set. Please specify a drive letter.")
-                return None
-            result_path = f"{pwd['drive']}:{path}"
-        elif ':' in path:
-            # Already absolute path with drive
-            result_path = path
-        else:
-            # Relative path - combine with current directory
-            if pwd["drive"] is None:
-                self.perror("Error: No current directory set. Please specify a drive letter.")
-                return None
-            
-            # Combine current path with relative path
-            current_path = pwd["path"].rstrip('/')
-            if current_path == "":
-                current_path = "/"
-            
-            # Build combined path
-            if current_path == "/":
-                combined = f"/{path}"
-            else:
-                combined = f"{current_path}/{path}"
-            
-            result_path = f"{pwd['drive']}:{combined}"
-        
-        # Now normalize the path to resolve .. and . components
-        return self._normalize_path(result_path)
-    
-    def _normalize_path(self, path: str) -> str:
-        """
-        Normalize a path by resolving . and .. components.
-        Takes a path like 'A:/dir1/dir2/../file.txt' and returns 'A:/dir1/file.txt'
+        List the contents of a directory using the drive's directory index.
+        Displays files and directories in a formatted table with type, name, size, and modification time.
         """
-        if ':' not in path:
-            return path
-            
-        drive_part, path_part = path.split(':', 1)
+        drive, drive_letter, current_dir = resolved.drive, resolved.letter, resolved.path
+        dir_path = current_dir[1:]
         
-        # Split path into components
-        if path_part.startswith('/'):
-            path_part = path_part[1:]  # Remove leading slash
-        
-        if path_part == "":
-            return f"{drive_part}:/"
-            
-        components = path_part.split('/')
-        normalized = []
-        
-        for component in components:
-            if component == '.' or component == '':
-                # Skip current directory references and empty components
-                continue
-            elif component == '..':
-                # Go up one directory
-                if normalized:
-                    normalized.pop()
-                # If we're already at root, .. has no effect
-            else:
-                normalized.append(component)
+        dir_inode_index = resolved.inode
+        if dir_inode_index is None:
+            self.perror(f"Error: Directory '{dir_path}' does not exist.")
+            return
         
-        # Reconstruct the path
-        if not normalized:
-            return f"{drive_part}:/"
-        else:
-            return f"{drive_part}:/{'/'.join(normalized)}"
-    
-    def _list_directory_contents(self, drive: Drive, drive_letter: str, dir_path: str) -> None:
-        """
-        List the contents of a directory by scanning inodes for matching file paths.
-        Displays files and directories in a formatted table with type, name, size, and modification time.
-        """
-        # Determine what we're looking for
-        if dir_path == "":
-            # Root directory
-            current_dir = "/"
-            target_prefix = "/"
-        else:
-            # Subdirectory
-            current_dir = f"/{dir_path}"
-            target_prefix = f"/{dir_path}/"
-        
-        # Check if the target directory exists (unless it's root)
-        if dir_path != "":
-            target_full_path = f"/{dir_path}"
-            dir_inode_index = drive.find_file(target_full_path)
-            if dir_inode_index is None:
-                self.perror(f"Error: Directory '{dir_path}' does not exist.")
-                return
-            
-            # Verify it's actually a directory
-            inode_start = drive.block_list[0]["inode_start"]
-            inode_per_block = drive.block_list[0]["block_size"] // 256
-            dir_inode = drive.block_list[inode_start + (dir_inode_index // inode_per_block)][dir_inode_index % inode_per_block]
-            if dir_inode["file_type"].lower() != "directory":
-                self.perror(f"Error: '{dir_path}' is not a directory.")
-                return
+        # Verify it's actually a directory
+        if not resolved.is_directory():
+            self.perror(f"Error: '{dir_path}' is not a directory.")
+            return
         
-        # Collect all files and directories by scanning inode table
+        # Collect the directory's direct children
         items = []
-        inode_bitmap = drive.block_list[drive.block_list[0]["inode_bitmap_start"]]
-        inode_start = drive.block_list[0]["inode_start"]
-        inode_per_block = drive.block_list[0]["block_size"] // 256
-        
-        for i in range(len(inode_bitmap)):
-            if inode_bitmap[i]:
-                inode = drive.block_list[inode_start + (i // inode_per_block)][i % inode_per_block]
-                file_name = inode["file_name"]
-                file_type = inode["file_type"]
-                
-                # Skip free inodes and the root directory itself
-                if file_type == "free" or file_name == "/":
-                    continue
-                
-                # For root directory listing
-                if dir_path == "":
-                    # Show items directly in root (like /test, not /test/something)
-                    if file_name.startswith("/") and file_name != "/":
-                        # Remove the leading slash for display
-                        display_name = file_name[1:]
-                        # Only show direct children (no further slashes)
-                        if "/" not in display_name:
-                            items.append({
-                                "name": display_name,
-                                "type": file_type,
-                                "size": inode["size"],
-                                "modified": inode["time_modified"]
-                            })
-                else:
-                    # For subdirectory listing
-                    if file_name.startswith(target_prefix):
-                        # Get the relative name after the directory prefix
-                        relative_name = file_name[len(target_prefix):]
-                        # Only show direct children (no further slashes)
-                        if "/" not in relative_name and relative_name != "":
-                            items.append({
-                                "name": relative_name,
-                                "type": file_type,
-                                "size": inode["size"],
-                                "modified": inode["time_modified"]
-                            })
+        for name, child in drive.list_directory(dir_inode_index).items():
+            inode = drive.get_inode(child)
+            items.append({
+                "name": name,
+                "type": inode["file_type"],
+                "size": inode["size"],
+                "modified": format_time(inode["time_modified"]),
+                "mode": permission_string(inode["permissions"]),
+                "owner": inode["uid"],
+                "group": inode.get("gid", DEFAULT_GROUP)
+            })
         
         # Display results in formatted table
         if not items:
@@ -1026,8 +1809,12 @@ class MyApp(cmd2.Cmd):
             return
         
         self.poutput(f"Contents of '{drive_letter}:{current_dir}':")
-        self.poutput(f"{'Type':<10} {'Name':<20} {'Size':<8} {'Modified'}")
-        self.poutput("-" * 60)
+        if long:
+            self.poutput(f"{'Type':<10} {'Mode':<10} {'Owner':<10} {'Group':<10} {'Name':<20} {'Size':<8} {'Modified'}")
+            self.poutput("-" * 93)
+        else:
+            self.poutput(f"{'Type':<10} {'Name':<20} {'Size':<8} {'Modified'}")
+            self.poutput("-" * 60)
         
         # Sort items: directories first, then files, both alphabetically
         items.sort(key=lambda x: (x["type"].lower() != "directory", x["name"].lower()))
@@ -1035,58 +1822,51 @@ class MyApp(cmd2.Cmd):
         for item in items:
             type_display = "DIR" if item["type"].lower() == "directory" else "FILE"
             size_display = "-" if item["type"].lower() == "directory" else str(item["size"])
-            self.poutput(f"{type_display:<10} {item['name']:<20} {size_display:<8} {item['modified']}")
+            if long:
+                self.poutput(f"{type_display:<10} {item['mode']:<10} {item['owner']:<10} {item['group']:<10} {item['name']:<20} {size_display:<8} {item['modified']}")
+            else:
+                self.poutput(f"{type_display:<10} {item['name']:<20} {size_display:<8} {item['modified']}")
 
 
     # File content display command
-    cat_parser = cmd2.Cmd2ArgumentParser(description='Display the contents of a file.')
-    cat_parser.add_argument('path', nargs=1, completer=_complete_path_files, help='Path of the file to display (e.g., A:/file.txt, file.txt, ../file.txt)')
+    @staticmethod
+    def cat_parser() -> cmd2.Cmd2ArgumentParser:
+        cat_parser = cmd2.Cmd2ArgumentParser(description='Display the contents of a file.')
+        cat_parser.add_argument('path', nargs=1, completer=MyApp._complete_path_files, help='Path of the file to display (e.g., A:/file.txt, file.txt, ../file.txt)')
+        return cat_parser
     @cmd2.with_argparser(cat_parser)
     def do_cat(self, args) -> None:
         """Display the contents of a file on a mounted drive."""
         target_path = args.path[0]
         
         # Resolve path (handle relative paths using current working directory)
-        resolved_path = self._resolve_path(target_path)
-        if resolved_path is None:
-            return
-        
-        # Parse drive and file path
-        if len(resolved_path) < 3 or resolved_path[1:3] != ":/":
-            self.perror("Error: Invalid path format. Use format 'A:/filename' or relative paths like 'filename'.")
-            return
-        
-        drive_letter = resolved_path[0].upper()
-        file_path = resolved_path[3:] if len(resolved_path) > 3 else ""
-        
-        # Check if drive is mounted
-        if drive_letter not in mounted_drives:
-            self.perror(f"Error: No drive is mounted at {drive_letter}.")
+        resolved = self._lookup(target_path, target=READ)
+        if resolved is None:
             return
+        file_path = resolved.path[1:]
         
         # Validate that we have a filename
-        if file_path == "":
+        if resolved.is_root():
             self.perror("Error: Please specify a filename to display.")
             return
         
-        drive = mounted_drives[drive_letter]
+        drive = resolved.drive
         
         # Check if file exists
-        file_inode_index = drive.find_file(f"/{file_path}")
+        file_inode_index = resolved.inode
         if file_inode_index is None:
             self.perror(f"Error: File '{file_path}' does not exist.")
             return
         
         # Verify it's actually a file (not a directory)
-        inode_start = drive.block_list[0]["inode_start"]
-        inode_per_block = drive.block_list[0]["block_size"] // 256
-        file_inode = drive.block_list[inode_start + (file_inode_index // inode_per_block)][file_inode_index % inode_per_block]
+        file_inode = drive.get_inode(file_inode_index)
         
         if file_inode["file_type"].lower() == "directory":
             self.perror(f"Error: '{file_path}' is a directory, not a file. Use 'ls' to list directory contents.")
             return
         
         # Read and display file contents
+        io_mark = self._io_mark(drive)
         file_content = drive.load_inode(file_inode_index)
         if file_content is None:
             self.perror(f"Error: Unable to read file '{file_path}'.")
@@ -1097,9 +1877,66 @@ class MyApp(cmd2.Cmd):
             self.poutput(f"File '{file_path}' is empty.")
         else:
             self.poutput(file_content)
+        if drive.touch_atime(file_inode_index):
+            self._save(drive)
+        self._report_io(drive, io_mark)
+
+    # Profiling wrapper - run any other command under cProfile to see where the time goes
+    @staticmethod
+    def profile_parser() -> cmd2.Cmd2ArgumentParser:
+        profile_parser = cmd2.Cmd2ArgumentParser(description='Run a command under the profiler and show the hottest functions.')
+        profile_parser.add_argument('-n', '--top', type=int, default=15, help='Number of functions to show (default 15)')
+        profile_parser.add_argument('-s', '--sort', choices=['cumulative', 'tottime', 'ncalls'], default='cumulative', help='Sort order for the report (default cumulative)')
+        profile_parser.add_argument('-o', '--output', type=str, help='Write raw pstats data to this file for offline analysis (snakeviz, flameprof, gprof2dot)')
+        profile_parser.add_argument('-a', '--all', action='store_true', help='Include functions outside the simulator modules')
+        profile_parser.add_argument('command', help='Command to profile (e.g., ls, write, cat)')
+        profile_parser.add_argument('command_args', nargs=argparse.REMAINDER, help='Arguments to pass to the command')
+        return profile_parser
+    @cmd2.with_argparser(profile_parser, preserve_quotes=True)
+    def do_profile(self, args) -> None:
+        """Execute a command under cProfile and report the functions it spent the most time in."""
+        if args.command == "profile":
+            self.perror("Error: Cannot profile the profile command.")
+            return
+        if args.top < 1:
+            self.perror("Error: Number of functions to show must be at least 1.")
+            return
+
+        command_line = " ".join([args.command] + args.command_args)
+
+        import cProfile  # Only needed when profiling
+        import pstats
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            self.onecmd_plus_hooks(command_line)
+        finally:
+            profiler.disable()
+        elapsed = time.perf_counter() - start
+
+        self.poutput(f"\nProfiled '{command_line}' in {elapsed * 1000:.2f} ms")
+        stats = pstats.Stats(profiler, stream=self.stdout)
+        stats.strip_dirs().sort_stats(args.sort)
+        if args.all:
+            stats.print_stats(args.top)
+        else:
+            # Restrict the report to the simulator's own code
+            stats.print_stats(r"(disk_simulator|device|pool|paths|access|main)\.py", args.top)
+
+        if args.output:
+            output_path = cmd2.utils.strip_quotes(args.output)
+            try:
+                profiler.dump_stats(output_path)
+                self.poutput(f"Wrote profile data to {output_path}.")
+            except OSError as e:
+                self.perror(f"Error writing profile data to {output_path}: {e}")
 
     # Demo program, showcasing filesystem commands
-    demo_parser = cmd2.Cmd2ArgumentParser(description='Run a comprehensive demo of the filesystem commands.')
+    @staticmethod
+    def demo_parser() -> cmd2.Cmd2ArgumentParser:
+        demo_parser = cmd2.Cmd2ArgumentParser(description='Run a comprehensive demo of the filesystem commands.')
+        return demo_parser
     @cmd2.with_argparser(demo_parser)
     def do_demo(self, args) -> None:
         """
@@ -1461,11 +2298,25 @@ class MyApp(cmd2.Cmd):
 
 
     def do_exit(self, args) -> bool:
-        """Exit the application."""
+        """Write any unsaved drive images and exit the application."""
+        self._sync()
         print("Goodbye!")
         return True
 
 if __name__ == '__main__':
-    import sys
+    cli_parser = argparse.ArgumentParser(description='AFS command line interface. Any other arguments are run as commands at startup.')
+    cli_parser.add_argument('--batch', nargs='?', const='-', metavar='FILE', help='Run the commands in FILE (stdin if omitted or "-") without prompting, then exit')
+    cli_parser.add_argument('--durability', choices=DURABILITY_LEVELS, help='How drive images reach stable storage (default: commit)')
+    options, remaining = cli_parser.parse_known_args()
+    sys.argv = sys.argv[:1] + remaining  # Left for cmd2's own startup commands
+    if options.durability is not None:
+        set_durability(options.durability)
     app = MyApp()
-    sys.exit(app.cmdloop())
\ No newline at end of file
+    if options.batch is not None:
+        code = app.run_batch(options.batch)
+    else:
+        start_write_back()  # Commands return once the drives change in memory; images follow in the background
+        code = app.cmdloop()
+    stop_write_back()
+    sync_drives()  # Images saved at the periodic level since the last sync
+    sys.exit(code)
\ No newline at end of file
@@ -0,0 +1,126 @@
+from collections import OrderedDict
+
+# Path resolution for the shell.
+# User paths ("A:/docs/a.txt", "/docs", "../a.txt") are normalised against the
+# working directory once and memoised, so repeated commands and every completion
+# keystroke skip the string splitting. The inode each path names is cached too
+# and re-checked against the drive's namespace generation, which the drive bumps
+# whenever a directory entry is added, removed or renamed.
+
+PATH_CACHE_SIZE = 4096  # Resolved paths kept before the least recently used are dropped
+
+
+class PathError(ValueError):
+    """A path that can't be resolved; the message is shown to the user as is."""
+
+
+class ResolvedPath:
+    """A user path resolved to a drive, normalised components and the inode it names (None if it doesn't exist)."""
+    __slots__ = ("letter", "drive", "components", "inode")
+
+    def __init__(self, letter: str, drive, components: tuple[str, ...], inode: int | None) -> None:
+        self.letter = letter
+        self.drive = drive
+        self.components = components
+        self.inode = inode
+
+    @property
+    def path(self) -> str:
+        """Absolute path on the drive, like "/docs/a.txt"."""
+        return "/" + "/".join(self.components)
+
+    @property
+    def display(self) -> str:
+        """Path including the drive letter, like "A:/docs/a.txt"."""
+        return f"{self.letter}:{self.path}"
+
+    @property
+    def name(self) -> str:
+        """Last component ("" for the root directory)."""
+        return self.components[-1] if self.components else ""
+
+    @property
+    def parent_path(self) -> str:
+        return "/" + "/".join(self.components[:-1])
+
+    def is_root(self) -> bool:
+        return not self.components
+
+    def is_directory(self) -> bool:
+        return self.inode is not None and self.drive.get_inode(self.inode)["file_type"].lower() == "directory"
+
+    def parent(self) -> int | None:
+        """Inode of the containing directory, or None if it doesn't exist."""
+        return self.drive.find_components(self.components[:-1])
+
+
+def normalise(path: str, pwd_drive: str | None, pwd_path: str) -> tuple[str, tuple[str, ...]]:
+    """
+    Split a user path into (drive letter, components), resolving it against the
+    working directory and dropping "." and ".." components.
+    Raises PathError for paths that can't be resolved.
+    """
+    if ':' in path:
+        drive_part, path_part = path.split(':', 1)
+        if len(drive_part) != 1:
+            raise PathError("Error: Invalid path format. Use format 'A:/name' or relative paths like 'name'.")
+        letter, parts = drive_part.upper(), path_part.split('/')
+    elif pwd_drive is None:
+        raise PathError("Error: No current directory set. Please specify a drive letter.")
+    elif path.startswith('/'):
+        letter, parts = pwd_drive, path.split('/')
+    else:
+        letter, parts = pwd_drive, pwd_path.split('/') + path.split('/')
+
+    components = []
+    for component in parts:
+        if component == '..':
+            if components:
+                components.pop()  # At the root, .. has no effect
+        elif component not in ('', '.'):
+            components.append(component)
+    return letter, tuple(components)
+
+
+class PathResolver:
+    """
+    Resolves user paths against the working directory with a bounded LRU cache
+    keyed on (working directory, input). drives and pwd are the shell's live
+    mount table and working directory, read on every call.
+    """
+    def __init__(self, drives: dict, pwd: dict, size: int = PATH_CACHE_SIZE) -> None:
+        self.drives = drives
+        self.pwd = pwd
+        self.size = size
+        self.cache: OrderedDict[tuple, list] = OrderedDict()  # Key -> [letter, components, drive, generation, inode]
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, path: str) -> ResolvedPath:
+        """Resolve a path to a ResolvedPath on a mounted drive. Raises PathError if it can't be."""
+        key = (self.pwd["drive"], self.pwd["path"], path)
+        entry = self.cache.get(key)
+        if entry is None:
+            self.misses += 1
+            entry = [*normalise(path, self.pwd["drive"], self.pwd["path"]), None, -1, None]
+            self.cache[key] = entry
+            if len(self.cache) > self.size:
+                self.cache.popitem(last=False)
+        else:
+            self.hits += 1
+            self.cache.move_to_end(key)
+
+        letter, components = entry[0], entry[1]
+        drive = self.drives.get(letter)
+        if drive is None:
+            raise PathError(f"Error: No drive is mounted at {letter}.")
+        # A remount swaps the drive object; a namespace change bumps its generation
+        if entry[2] is not drive or entry[3] != drive.generation:
+            entry[2], entry[3], entry[4] = drive, drive.generation, drive.find_components(components)
+        return ResolvedPath(letter, drive, components, entry[4])
+
+    def clear(self) -> None:
+        self.cache.clear()
+
+    def stats(self) -> dict:
+        return {"entries": len(self.cache), "hits": self.hits, "misses": self.misses}
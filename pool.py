@@ -0,0 +1,286 @@
+import base64
+import json
+from device import *
+
+# Storage pools (software RAID) for the disk simulator.
+# A pool presents one logical block list to a Drive and spreads the blocks over
+# several member block lists, each saved as its own image in the drive bay.
+
+RAID_LEVELS = {"raid0": 2, "raid1": 2, "raid5": 3}  # Level -> minimum number of members
+
+def _encode_block(value) -> bytes:
+    """Length-prefixed JSON encoding of a block, the unit parity is computed over."""
+    raw = json.dumps(value, default=lambda v: v.tolist()).encode()
+    return len(raw).to_bytes(4, "big") + raw
+
+def _xor_blocks(encoded: list[bytes]) -> bytes:
+    """XOR byte strings together, padding the shorter ones with zeros."""
+    width = max((len(e) for e in encoded), default=0)
+    result = 0
+    for e in encoded:
+        result ^= int.from_bytes(e.ljust(width, b"\0"), "big")
+    return result.to_bytes(width, "big")
+
+
+class PooledBlockList:
+    """
+    A list-like view of a pool's logical blocks, striped, mirrored or parity
+    protected across member block lists.
+
+    - raid0: block b lives on member b % n at offset b // n
+    - raid1: every member holds a full copy
+    - raid5: stripes of n - 1 data blocks plus one parity block, with the
+      parity member rotating from stripe to stripe
+
+    A missing member (None) leaves the pool degraded. Its blocks are served
+    from the mirrors or rebuilt from parity, and anything written to it is
+    kept in memory until the member is rebuilt.
+    Blocks are changed in place in memory (inode tables, bitmaps), so parity
+    is brought up to date when the pool is saved rather than on every write.
+    """
+    def __init__(self, name: str, level: str, members: list[list | None], length: int) -> None:
+        self.name = name
+        self.level = level
+        self.members = members
+        self.length = length
+        self.recovered: dict[int, object] = {}  # Offset -> block for the missing member (degraded raid5)
+        self._share_mirrors()
+        self._recover_missing()
+
+    @classmethod
+    def from_blocks(cls, name: str, level: str, count: int, blocks: list) -> "PooledBlockList":
+        """Spread an existing list of blocks over count new members."""
+        pool = cls(name, level, [[None] * cls.member_size(level, count, len(blocks)) for _ in range(count)], len(blocks))
+        for i, block in enumerate(blocks):
+            pool[i] = block
+        pool.update_parity()
+        return pool
+
+    @staticmethod
+    def member_size(level: str, count: int, length: int) -> int:
+        """Blocks each member needs to hold length logical blocks."""
+        if level == "raid0":
+            return -(-length // count)
+        if level == "raid1":
+            return length
+        return -(-length // (count - 1))  # One stripe per member block
+
+    @staticmethod
+    def tolerates(level: str, count: int, missing: int) -> bool:
+        """Whether a pool of this level can keep running with missing members."""
+        if level == "raid0":
+            return missing == 0
+        if level == "raid1":
+            return missing < count
+        return missing <= 1
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self):
+        return (self[i] for i in range(self.length))
+
+    def copy(self) -> list:
+        return list(self)
+
+    def online(self) -> list[int]:
+        """Indices of the members that are present."""
+        return [k for k, member in enumerate(self.members) if member is not None]
+
+    def degraded(self) -> bool:
+        return len(self.online()) < len(self.members)
+
+    def parity_member(self, stripe: int) -> int:
+        """Member holding the parity block of a raid5 stripe."""
+        return stripe % len(self.members)
+
+    def locate(self, block: int) -> tuple[int, int]:
+        """Return (member, offset) of a logical block's data (the first copy for raid1)."""
+        count = len(self.members)
+        if self.level == "raid0":
+            return block % count, block // count
+        if self.level == "raid1":
+            return 0, block
+        stripe, k = divmod(block, count - 1)
+        parity = self.parity_member(stripe)
+        return (k if k < parity else k + 1), stripe
+
+    def _stripe_blocks(self, stripe: int) -> range:
+        """Logical blocks in a raid5 stripe."""
+        first = stripe * (len(self.members) - 1)
+        return range(first, min(first + len(self.members) - 1, self.length))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if self.level == "raid1":
+            return self.members[self.online()[0]][index]
+        member, offset = self.locate(index)
+        if self.members[member] is not None:
+            return self.members[member][offset]
+        return self.recovered[offset]
+
+    def __setitem__(self, index, value) -> None:
+        if isinstance(index, slice):
+            for i, v in zip(range(*index.indices(self.length)), value):
+                self[i] = v
+            return
+        if index < 0:
+            index += self.length
+        if self.level == "raid1":
+            for k in self.online():
+                self.members[k][index] = value  # Mirrors share the object, so in-place changes reach every copy
+            return
+        member, offset = self.locate(index)
+        if self.members[member] is not None:
+            self.members[member][offset] = value
+        else:
+            self.recovered[offset] = value
+
+    def _reconstruct(self, member: int, offset: int):
+        """Rebuild a missing raid5 data block by XOR-ing the parity with the rest of its stripe."""
+        encoded = [base64.b85decode(self.members[self.parity_member(offset)][offset])]
+        for b in self._stripe_blocks(offset):
+            m, _ = self.locate(b)
+            if m != member:
+                encoded.append(_encode_block(self.members[m][offset]))
+        raw = _xor_blocks(encoded)
+        return json.loads(raw[4:4 + int.from_bytes(raw[:4], "big")])
+
+    def _share_mirrors(self) -> None:
+        """
+        Point every raid1 mirror at the first online member's block objects.
+        Mirrors read from separate images hold separate copies, and in-place
+        changes to the inode tables and bitmaps would only reach the first one.
+        """
+        if self.level != "raid1":
+            return
+        online = self.online()
+        for k in online[1:]:
+            self.members[k][:] = self.members[online[0]]
+
+    def _recover_missing(self) -> None:
+        """
+        Rebuild a missing raid5 member's data blocks from parity as soon as the
+        pool goes degraded. Later writes leave parity stale until the next save,
+        so it can't be relied on to reconstruct blocks lazily.
+        """
+        if self.level != "raid5":
+            return
+        for member in range(len(self.members)):
+            if self.members[member] is None:
+                for b in range(self.length):
+                    m, offset = self.locate(b)
+                    if m == member:
+                        self.recovered[offset] = self._reconstruct(member, offset)
+
+    def update_parity(self) -> None:
+        """Recompute every raid5 parity block from the logical blocks."""
+        if self.level != "raid5":
+            return
+        for stripe in range(self.member_size(self.level, len(self.members), self.length)):
+            parity = self.parity_member(stripe)
+            if self.members[parity] is None:
+                continue
+            encoded = [_encode_block(self[b]) for b in self._stripe_blocks(stripe)]
+            self.members[parity][stripe] = base64.b85encode(_xor_blocks(encoded)).decode()
+
+    def fail(self, member: int) -> None:
+        """
+        Drop a member, as if its disk had died. Its raid5 data blocks stay in
+        memory (the drive may hold references to them, like the bitmaps).
+        """
+        if self.level == "raid5":
+            for b in range(self.length):
+                m, offset = self.locate(b)
+                if m == member:
+                    self.recovered[offset] = self.members[m][offset]
+        self.members[member] = None
+
+    def rebuild(self, member: int) -> None:
+        """Regenerate a missing member from the mirrors or from parity."""
+        size = self.member_size(self.level, len(self.members), self.length)
+        if self.level == "raid1":
+            self.members[member] = list(self.members[self.online()[0]])
+            return
+        rebuilt = [None] * size
+        for b in range(self.length):
+            m, offset = self.locate(b)
+            if m == member:
+                rebuilt[offset] = self[b]
+        self.members[member] = rebuilt
+        self.recovered.clear()
+        self.update_parity()
+
+    def io_targets(self, block: int, write: bool, busy: list[float], last: list[int]) -> list[tuple[int, int, bool]]:
+        """
+        Member accesses needed to service one logical block request: (member, offset, write).
+        busy and last are each member's elapsed time and last offset accessed.
+        raid1 reads stay on the mirror a sequential read is already using, otherwise
+        go to the least busy one; raid5 writes read and rewrite the data and parity
+        blocks, and reads of a missing member read the rest of the stripe.
+        """
+        online = self.online()
+        if self.level == "raid1":
+            if write:
+                return [(k, block, True) for k in online]
+            sequential = [k for k in online if last[k] == block - 1]
+            return [(sequential[0] if sequential else min(online, key=lambda k: busy[k]), block, False)]
+        member, offset = self.locate(block)
+        if self.level == "raid0":
+            return [(member, offset, write)]
+        parity = self.parity_member(offset)
+        if member not in online:
+            reads = [(k, offset, False) for k in online]
+            return reads + ([(parity, offset, True)] if write and parity in online else [])
+        if not write:
+            return [(member, offset, False)]
+        targets = [(member, offset, False), (member, offset, True)]
+        if parity in online:
+            targets = [(member, offset, False), (parity, offset, False), (member, offset, True), (parity, offset, True)]
+        return targets
+
+    def descriptor(self) -> dict:
+        """Pool metadata saved in the pool's own image."""
+        return {"name": self.name, "level": self.level, "members": len(self.members), "length": self.length}
+
+
+class PoolDevice(DeviceModel):
+    """
+    Timing model for a pool: one device model per member. Member devices work
+    in parallel, so the pool's elapsed time is that of its busiest member.
+    """
+    name = "pool"
+
+    def __init__(self, pool: PooledBlockList, model: str, block_size: int = 4096) -> None:
+        self.pool = pool
+        self.model = model
+        size = PooledBlockList.member_size(pool.level, len(pool.members), pool.length)
+        self.members = [make_device(model, block_size, size) for _ in pool.members]
+        self.last = [-1] * len(pool.members)  # Offset each member last accessed
+        super().__init__(block_size)
+
+    def reset(self) -> None:
+        super().reset()
+        for member in self.members:
+            member.reset()
+
+    def access(self, block: int, write: bool = False) -> float:
+        before = self.elapsed
+        for (k, offset, member_write) in self.pool.io_targets(block, write, [m.elapsed for m in self.members], self.last):
+            self.members[k].access(offset, member_write)
+            self.last[k] = offset
+        if write:
+            self.writes += 1
+        else:
+            self.reads += 1
+        self.elapsed = max(m.elapsed for m in self.members)
+        self.head_movement = sum(m.head_movement for m in self.members)
+        return self.elapsed - before
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["device"] = f"{self.pool.level} x{len(self.members)} {self.model}"
+        return stats
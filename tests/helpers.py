@@ -0,0 +1,91 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from collections import Counter
+from disk_simulator import *
+
+# Shared fixtures for the tests.
+# Run the suite from the repository root with: python -m unittest discover tests
+
+
+def expected_refcounts(drive: Drive) -> Counter:
+    """Reference count each data block should have: one per live inode or snapshot inode whose extents cover it."""
+    counts = Counter()
+    inodes = [inode for i, inode in drive.used_inodes()]
+    inodes += [inode for snapshot in drive.snapshots.values() for inode in snapshot["inodes"].values()]
+    for inode in inodes:
+        for (start, length) in inode["pointers"]:
+            counts.update(range(start, start + length))
+    return counts
+
+
+def stored_refcounts(drive: Drive) -> Counter:
+    """Reference counts recorded in the drive's data bitmap."""
+    data_bitmap = drive.block_list[drive.block_list[0]["data_bitmap_start"]]
+    return Counter({block: int(count) for block, count in enumerate(data_bitmap) if count})
+
+
+def extents(drive: Drive, inode_index: int) -> list[list[int]]:
+    """An inode's extents as [start, length] lists (they may be stored as tuples or lists)."""
+    return [list(extent) for extent in drive.get_inode(inode_index)["pointers"]]
+
+
+def new_file(name: str, parent: int = 0, uid: str = "user") -> Inode:
+    return Inode(name, "File", 0, [], uid, 0, [7,7,7], [], None, parent)
+
+
+def new_directory(name: str, parent: int = 0, uid: str = "user") -> Inode:
+    return Inode(name, "Directory", 0, [], uid, 0, [7,7,7], [], None, parent)
+
+
+class DriveTestCase(unittest.TestCase):
+    """Runs each test in an empty temporary directory, so saved images land in a fresh drive bay."""
+    def setUp(self) -> None:
+        bay = tempfile.TemporaryDirectory()
+        self.addCleanup(bay.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(bay.name)
+        durability = get_durability()
+        self.addCleanup(set_durability, durability)
+        set_durability("none")  # Syncing every image adds nothing to what the tests check
+
+    def assertRefcounts(self, drive: Drive) -> None:
+        """Every data block's reference count matches the live inodes and snapshots that use it."""
+        self.assertEqual(stored_refcounts(drive), expected_refcounts(drive))
+
+
+class ShellTestCase(DriveTestCase):
+    """Drives the shell the way a user would, with no drives mounted and the default user."""
+    def setUp(self) -> None:
+        super().setUp()
+        import main
+        self.main = main
+        main.mounted_drives.factories.clear()  # No sample drives
+        main.mounted_drives.clear()
+        main.pwd.update(drive=None, path="/")
+        main.resolver.clear()
+        main.access.switch(main.DEFAULT_USER)
+        self.app = main.MyApp()
+        self.app.batch = True  # Never prompt
+        self.app.quiet = True  # No I/O timing feedback
+
+    def run_command(self, command: str) -> tuple[str, str]:
+        """Run one command. Returns (output, errors)."""
+        self.app.stdout = io.StringIO()
+        errors = io.StringIO()
+        with contextlib.redirect_stdout(self.app.stdout), contextlib.redirect_stderr(errors):  # The drive module prints some messages
+            self.app.onecmd_plus_hooks(command)
+        return self.app.stdout.getvalue(), errors.getvalue()
+
+    def assertSucceeds(self, command: str) -> str:
+        """Run a command that must not report an error. Returns its output."""
+        output, errors = self.run_command(command)
+        self.assertEqual(errors, "", f"{command!r} failed")
+        return output
+
+    def assertFails(self, command: str, message: str) -> None:
+        """Run a command that must report an error containing message."""
+        output, errors = self.run_command(command)
+        self.assertIn(message, errors, f"{command!r} didn't fail as expected")
@@ -0,0 +1,30 @@
+import unittest
+from helpers import *
+
+
+@unittest.skipIf(load_numpy() is None, "NumPy isn't installed")
+class VectorisedBitmapTest(DriveTestCase):
+    """NumPy bitmaps must behave exactly like the plain lists."""
+    def test_out_of_space_returns_none_quietly(self) -> None:
+        drive = Drive("N", 128, vectorised=True)
+        free = drive.usage()["blocks_total"] - drive.usage()["blocks_used"]
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.assertIsNone(drive.find_free_data_blocks(free + 1))
+        self.assertEqual(output.getvalue(), "")
+        self.assertEqual(sum(length for (start, length) in drive.find_free_data_blocks(free)), free)
+
+    def test_same_allocation_as_lists(self) -> None:
+        drives = [Drive("N", 256, vectorised=vectorised) for vectorised in (False, True)]
+        for drive in drives:
+            for n in range(1, 12):
+                drive.write_inode("x" * n * CHAR_BLOCK_SIZE, new_file(f"f{n}"), n)
+            for n in range(1, 12, 3):
+                drive.delete_inode(n)
+            drive.write_inode("y" * 20 * CHAR_BLOCK_SIZE, new_file("big"), 1)
+            self.assertRefcounts(drive)
+        self.assertEqual(*[[[list(p) for p in inode["pointers"]] for i, inode in drive.used_inodes()] for drive in drives])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+from helpers import *
+
+
+class CopyMoveRemoveTest(ShellTestCase):
+    """cp, mv, rm and rmdir -r keep file contents and reference counts intact."""
+    def setUp(self) -> None:
+        super().setUp()
+        for letter in "DE":
+            self.assertSucceeds(f"mkdrive -b 256 {letter}")
+            self.assertSucceeds(f"mount -p {letter} {letter}")
+        self.drive = self.main.mounted_drives["D"]
+        self.assertSucceeds("mkdir D:/src")
+        self.assertSucceeds("mkdir D:/src/sub")
+        self.assertSucceeds(f"write D:/src/a.txt {'a' * 100}")
+        self.assertSucceeds(f"write D:/src/sub/b.txt {'b' * 100}")
+
+    def test_cp_shares_extents_on_the_same_drive(self) -> None:
+        self.assertSucceeds("cp D:/src/a.txt D:/copy.txt")
+        self.assertEqual(extents(self.drive, self.drive.find_file("copy.txt")), extents(self.drive, self.drive.find_file("src/a.txt")))
+        self.assertEqual(max(stored_refcounts(self.drive).values()), 2)
+        self.assertSucceeds(f"write D:/copy.txt {'c' * 100}")
+        self.assertEqual(self.assertSucceeds("cat D:/src/a.txt").strip(), "a" * 100)
+        self.assertRefcounts(self.drive)
+
+    def test_cp_r_then_rm_r(self) -> None:
+        self.assertSucceeds("cp -r D:/src D:/dst")
+        self.assertEqual(self.assertSucceeds("cat D:/dst/sub/b.txt").strip(), "b" * 100)
+        self.assertSucceeds("rm -r D:/src")
+        self.assertEqual(self.assertSucceeds("cat D:/dst/a.txt").strip(), "a" * 100)
+        self.assertRefcounts(self.drive)
+        self.assertSucceeds("rm -r D:/dst")
+        self.assertEqual(stored_refcounts(self.drive), Counter())
+
+    def test_cp_r_to_another_drive(self) -> None:
+        self.assertSucceeds("cp -r D:/src E:/dst")
+        self.assertEqual(self.assertSucceeds("cat E:/dst/sub/b.txt").strip(), "b" * 100)
+        self.assertRefcounts(self.drive)
+        self.assertRefcounts(self.main.mounted_drives["E"])
+
+    def test_mv_within_and_across_drives(self) -> None:
+        self.assertSucceeds("mv D:/src/sub D:/moved")
+        self.assertEqual(self.assertSucceeds("cat D:/moved/b.txt").strip(), "b" * 100)
+        self.assertFails("cat D:/src/sub/b.txt", "Error:")
+        self.assertSucceeds("mv D:/src E:/src")
+        self.assertEqual(self.assertSucceeds("cat E:/src/a.txt").strip(), "a" * 100)
+        self.assertIsNone(self.drive.find_file("src"))
+        self.assertRefcounts(self.drive)
+        self.assertRefcounts(self.main.mounted_drives["E"])
+
+    def test_cp_and_mv_replace_a_file(self) -> None:
+        self.assertSucceeds("write D:/old.txt old")
+        self.assertSucceeds("cp D:/src/a.txt D:/old.txt")
+        self.assertEqual(self.assertSucceeds("cat D:/old.txt").strip(), "a" * 100)
+        self.assertSucceeds("mv D:/src/sub/b.txt D:/old.txt")
+        self.assertEqual(self.assertSucceeds("cat D:/old.txt").strip(), "b" * 100)
+        self.assertSucceeds("write E:/old.txt old")
+        self.assertSucceeds("mv D:/old.txt E:/old.txt")
+        self.assertEqual(self.assertSucceeds("cat E:/old.txt").strip(), "b" * 100)
+        self.assertEqual(list(self.main.mounted_drives["E"].list_directory(0)), ["old.txt"])
+        self.assertRefcounts(self.drive)
+        self.assertRefcounts(self.main.mounted_drives["E"])
+
+    def test_failed_copy_keeps_the_destination(self) -> None:
+        self.assertSucceeds("mkdrive -b 32 F")
+        self.assertSucceeds("mount -p F F")
+        self.assertSucceeds(f"write F:/keep.txt {'k' * 100}")
+        self.assertSucceeds(f"write D:/big.txt {'x' * 40 * CHAR_BLOCK_SIZE}")
+        self.assertFails("cp D:/big.txt F:/keep.txt", "Not enough space")
+        self.assertFails("mv D:/big.txt F:/keep.txt", "Not enough space")
+        self.assertEqual(self.assertSucceeds("cat F:/keep.txt").strip(), "k" * 100)
+        self.assertEqual(list(self.main.mounted_drives["F"].list_directory(0)), ["keep.txt"])
+        self.assertIsNotNone(self.drive.find_file("big.txt"))
+        self.assertRefcounts(self.main.mounted_drives["F"])
+
+    def test_mv_into_its_own_subtree_is_refused(self) -> None:
+        self.assertFails("mv D:/src D:/src/sub/inner", "Error:")
+        self.assertEqual(self.assertSucceeds("cat D:/src/sub/b.txt").strip(), "b" * 100)
+
+    def test_cp_with_snapshot_then_rollback(self) -> None:
+        self.assertSucceeds("snapshot create D s")
+        self.assertSucceeds("cp D:/src/a.txt D:/copy.txt")
+        self.assertSucceeds("rm D:/src/a.txt")
+        self.assertRefcounts(self.drive)
+        self.assertSucceeds("snapshot rollback D s")
+        self.assertEqual(self.assertSucceeds("cat D:/src/a.txt").strip(), "a" * 100)
+        self.assertIsNone(self.drive.find_file("copy.txt"))
+        self.assertRefcounts(self.drive)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+from helpers import *
+
+
+class DedupTest(DriveTestCase):
+    """Identical blocks stored once and shared by reference count."""
+    def setUp(self) -> None:
+        super().setUp()
+        self.drive = Drive("D", 256, dedup=True, inline_data=False)
+        self.content = "".join(chr(ord("a") + n) * CHAR_BLOCK_SIZE for n in range(4))
+
+    def test_identical_files_share_blocks(self) -> None:
+        self.drive.write_inode(self.content, new_file("a"), 1)
+        self.drive.write_inode(self.content, new_file("b"), 2)
+        stats = self.drive.dedup_stats()
+        self.assertEqual((stats["logical_blocks"], stats["physical_blocks"], stats["saved_blocks"]), (8, 4, 4))
+        self.assertRefcounts(self.drive)
+
+    def test_repeated_blocks_within_a_file(self) -> None:
+        self.drive.write_inode("z" * 5 * CHAR_BLOCK_SIZE, new_file("a"), 1)
+        self.assertEqual(self.drive.dedup_stats()["physical_blocks"], 1)
+        self.assertEqual(self.drive.load_inode(1), "z" * 5 * CHAR_BLOCK_SIZE)
+        self.assertRefcounts(self.drive)
+
+    def test_rewriting_one_copy_leaves_the_other(self) -> None:
+        self.drive.write_inode(self.content, new_file("a"), 1)
+        self.drive.write_inode(self.content, new_file("b"), 2)
+        changed = "q" * CHAR_BLOCK_SIZE + self.content[CHAR_BLOCK_SIZE:]
+        self.drive.write_inode(changed, new_file("a"), 1)
+        self.assertEqual(self.drive.load_inode(1), changed)
+        self.assertEqual(self.drive.load_inode(2), self.content)
+        self.assertRefcounts(self.drive)
+
+    def test_deleting_shared_content(self) -> None:
+        self.drive.write_inode(self.content, new_file("a"), 1)
+        self.drive.write_inode(self.content, new_file("b"), 2)
+        self.drive.delete_inode(1)
+        self.assertEqual(self.drive.load_inode(2), self.content)
+        self.assertRefcounts(self.drive)
+        self.drive.delete_inode(2)
+        self.assertEqual(stored_refcounts(self.drive), Counter())
+        # The freed blocks may be reused for other content; the index must not point at them any more
+        self.drive.write_inode("w" * 4 * CHAR_BLOCK_SIZE, new_file("c"), 1)
+        self.drive.write_inode(self.content, new_file("d"), 2)
+        self.assertEqual(self.drive.load_inode(1), "w" * 4 * CHAR_BLOCK_SIZE)
+        self.assertEqual(self.drive.load_inode(2), self.content)
+        self.assertRefcounts(self.drive)
+
+    def test_snapshot_and_copy_references(self) -> None:
+        self.drive.write_inode(self.content, new_file("a"), 1)
+        self.drive.create_snapshot("s")
+        copy = self.drive.copy_tree(1, self.drive, 0, "b")
+        self.drive.write_inode(self.content, new_file("c"), copy + 1)
+        self.assertEqual(max(stored_refcounts(self.drive).values()), 4)
+        self.drive.delete_inode(1)
+        self.drive.delete_snapshot("s")
+        self.assertEqual(self.drive.load_inode(copy), self.content)
+        self.assertRefcounts(self.drive)
+
+    def test_index_is_rebuilt_on_load(self) -> None:
+        self.drive.write_inode(self.content, new_file("a"), 1)
+        self.assertTrue(save_drive(self.drive, "D.json"))
+        loaded = load_drive("D.json")
+        loaded.write_inode(self.content, new_file("b"), 2)
+        self.assertEqual(loaded.dedup_stats()["physical_blocks"], 4)
+        self.assertRefcounts(loaded)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+from helpers import *
+
+
+class DelayedCopyTest(ShellTestCase):
+    """Copies of files whose delayed writes haven't been placed yet."""
+    def setUp(self) -> None:
+        super().setUp()
+        defer_saves()  # Saving flushes delayed writes, which would hide the problem
+        self.addCleanup(discard_saves)
+        self.assertSucceeds("mkdrive -a -b 256 D")
+        self.assertSucceeds("mount -p D D")
+        self.assertSucceeds("mkdrive -b 256 E")
+        self.assertSucceeds("mount -p E E")
+        self.assertSucceeds(f"write D:/a.txt {'x' * 100}")
+        self.assertTrue(self.main.mounted_drives["D"].dirty)
+
+    def test_cp_after_unflushed_write(self) -> None:
+        self.assertSucceeds("cp D:/a.txt D:/b.txt")
+        self.assertEqual(self.assertSucceeds("cat D:/b.txt").strip(), "x" * 100)
+        self.assertEqual(self.assertSucceeds("cat D:/a.txt").strip(), "x" * 100)
+        self.assertRefcounts(self.main.mounted_drives["D"])
+
+    def test_cp_to_another_drive_after_unflushed_write(self) -> None:
+        self.assertSucceeds("cp D:/a.txt E:/b.txt")
+        self.assertEqual(self.assertSucceeds("cat E:/b.txt").strip(), "x" * 100)
+
+    def test_mv_to_another_drive_after_unflushed_write(self) -> None:
+        self.assertSucceeds("mv D:/a.txt E:/b.txt")
+        self.assertEqual(self.assertSucceeds("cat E:/b.txt").strip(), "x" * 100)
+        self.assertRefcounts(self.main.mounted_drives["D"])
+
+    def test_copy_tree_flushes_the_source(self) -> None:
+        drive = Drive("F", 256, delalloc=True)
+        drive.write_inode("y" * 100, new_file("a.txt"), 1)
+        copy = drive.copy_tree(1, drive, 0, "b.txt")
+        self.assertEqual(drive.load_inode(copy), "y" * 100)
+        self.assertEqual([list(p) for p in drive.get_inode(copy)["pointers"]], [list(p) for p in drive.get_inode(1)["pointers"]])
+        self.assertRefcounts(drive)
+
+
+class FlushTest(DriveTestCase):
+    def test_interleaved_growth_is_placed_contiguously(self) -> None:
+        drive = Drive("F", 512, delalloc=True)
+        for size in range(1, 9):
+            for index, name in ((1, "a.txt"), (2, "b.txt")):
+                drive.write_inode(name[0] * size * CHAR_BLOCK_SIZE, new_file(name), index)
+        self.assertEqual(set(drive.dirty), {1, 2})
+        self.assertEqual(drive.flush(), 2)
+        self.assertFalse(drive.dirty)
+        self.assertEqual(drive.reserved_blocks, 0)
+        for index, name in ((1, "a.txt"), (2, "b.txt")):
+            self.assertEqual(len(drive.get_inode(index)["pointers"]), 1)
+            self.assertEqual(drive.load_inode(index), name[0] * 8 * CHAR_BLOCK_SIZE)
+        self.assertRefcounts(drive)
+
+    def test_save_places_delayed_writes(self) -> None:
+        drive = Drive("F", 256, delalloc=True)
+        drive.write_inode("z" * 100, new_file("a.txt"), 1)
+        self.assertTrue(save_drive(drive, "F.json"))
+        loaded = load_drive("F.json")
+        self.assertEqual(loaded.load_inode(1), "z" * 100)
+        self.assertRefcounts(loaded)
+
+
+class FallocateTest(ShellTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.assertSucceeds("mkdrive -b 256 D")
+        self.assertSucceeds("mount -p D D")
+        # Leave 3-block holes between 3-block files
+        for n in range(8):
+            self.assertSucceeds(f"write D:/f{n}.txt {'x' * 3 * CHAR_BLOCK_SIZE}")
+        for n in range(0, 8, 2):
+            self.assertSucceeds(f"rm D:/f{n}.txt")
+        self.drive = self.main.mounted_drives["D"]
+
+    def extents(self, name: str) -> list:
+        return self.drive.get_inode(self.drive.find_file(name))["pointers"]
+
+    def test_new_file_gets_one_run(self) -> None:
+        self.assertIn("in 1 extent.", self.assertSucceeds("fallocate -l 8 D:/new.bin"))
+        self.assertEqual([list(p)[1] for p in self.extents("new.bin")], [8])
+        self.assertRefcounts(self.drive)
+
+    def test_existing_file_gets_one_run(self) -> None:
+        self.assertSucceeds("write D:/old.txt hello")
+        self.assertIn("in 1 extent.", self.assertSucceeds("fallocate -l 8 D:/old.txt"))
+        self.assertEqual(self.assertSucceeds("cat D:/old.txt").strip(), "hello")
+        self.assertRefcounts(self.drive)
+
+    def test_growing_into_a_preallocation_stays_in_place(self) -> None:
+        self.assertSucceeds("fallocate -l 8 D:/log.txt")
+        extents = [list(p) for p in self.extents("log.txt")]
+        self.assertSucceeds(f"write D:/log.txt {'y' * 7 * CHAR_BLOCK_SIZE}")
+        self.assertEqual([list(p) for p in self.extents("log.txt")], extents)
+        self.assertRefcounts(self.drive)
+
+    def test_failed_new_file_is_not_left_behind(self) -> None:
+        self.assertFails("fallocate -l 100000 D:/huge.bin", "Not enough space")
+        self.assertIsNone(self.drive.find_file("huge.bin"))
+        self.assertRefcounts(self.drive)
+
+
+if __name__ == "__main__":
+    unittest.main()
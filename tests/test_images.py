@@ -0,0 +1,79 @@
+import json
+import shutil
+import unittest
+from helpers import *
+
+EXAMPLE_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "drive_bay", "example.json")
+
+
+class SchemaUpgradeTest(DriveTestCase):
+    """drive_bay/example.json predates the schema field, so it is a version 1 image."""
+    FILES = {
+        "readme.txt": "Welcome to the AFS demonstration!",
+        "documents/notes.txt": "Project documentation and notes.",
+        "photos/vacation.jpg": "Binary image data placeholder.",
+    }
+
+    def setUp(self) -> None:
+        super().setUp()
+        os.makedirs(SAVE_PATH)
+        shutil.copy(EXAMPLE_IMAGE, SAVE_PATH)
+
+    def load(self, filename: str = "example.json") -> tuple[Drive, str]:
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            drive = load_drive(filename)
+        self.assertIsNotNone(drive)
+        return drive, output.getvalue()
+
+    def assertExampleContents(self, drive: Drive) -> None:
+        for path, content in self.FILES.items():
+            self.assertEqual(drive.load_inode(drive.find_file(path)), content)
+        self.assertEqual(sorted(drive.list_directory(0)), ["documents", "photos", "readme.txt"])
+        self.assertRefcounts(drive)
+
+    def test_upgrade_from_schema_1(self) -> None:
+        with open(EXAMPLE_IMAGE) as f:
+            self.assertNotIn("schema", json.load(f)["block_list"][0])
+        drive, output = self.load()
+        self.assertIn(f"Upgraded example.json from image format 1 to {IMAGE_SCHEMA}.", output)
+        self.assertEqual(drive.block_list[0]["schema"], IMAGE_SCHEMA)
+        self.assertExampleContents(drive)
+        for i, inode in drive.used_inodes():
+            self.assertIsInstance(inode["time_modified"], int)
+            self.assertGreater(inode["time_modified"], 0)
+
+    def test_upgraded_image_is_rewritten_once(self) -> None:
+        self.load()
+        with open(os.path.join(SAVE_PATH, "example.json")) as f:
+            image = json.load(f)
+        self.assertEqual(image["inode_fields"], INODE_FIELDS)
+        drive, output = self.load()
+        self.assertEqual(output, "")
+        self.assertExampleContents(drive)
+
+    def test_upgraded_drive_keeps_working(self) -> None:
+        drive, output = self.load()
+        drive.write_inode("new content", new_file("new.txt"), drive.find_free_inode(0))
+        drive.delete_inode(drive.find_file("readme.txt"))
+        self.assertTrue(save_drive(drive, "example.json"))
+        drive, output = self.load()
+        self.assertEqual(drive.load_inode(drive.find_file("new.txt")), "new content")
+        self.assertIsNone(drive.find_file("readme.txt"))
+        self.assertRefcounts(drive)
+
+    def test_both_image_formats_load_the_same_drive(self) -> None:
+        drive, output = self.load()
+        previous = get_image_format()
+        self.addCleanup(set_image_format, previous)
+        for image_format in IMAGE_FORMATS:
+            with self.subTest(image_format=image_format):
+                set_image_format(image_format)
+                self.assertTrue(save_drive(drive, f"{image_format}.json"))
+                loaded, output = self.load(f"{image_format}.json")
+                self.assertEqual(output, "")
+                self.assertExampleContents(loaded)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+import unittest
+from helpers import *
+from access import *
+
+
+class PermissionTest(ShellTestCase):
+    """Permission checks in the shell, and the cached decisions behind them."""
+    def setUp(self) -> None:
+        super().setUp()
+        self.assertSucceeds("mkdrive -b 256 D")
+        self.assertSucceeds("mount -p D D")
+        self.assertSucceeds("su")
+        self.assertSucceeds("mkdir D:/home")
+        self.assertSucceeds("chmod 755 D:/home")
+        self.assertSucceeds("mkdir D:/home/alice")
+        self.assertSucceeds("chown alice:alice D:/home/alice")
+        self.assertSucceeds("chmod 700 D:/home/alice")
+        self.assertSucceeds("su alice -g alice")
+        self.assertSucceeds("write D:/home/alice/diary.txt secret")
+
+    def assertDenied(self, command: str) -> None:
+        self.assertFails(command, "Permission denied")
+
+    def test_owner_has_access(self) -> None:
+        self.assertEqual(self.assertSucceeds("cat D:/home/alice/diary.txt").strip(), "secret")
+        self.assertIn("diary.txt", self.assertSucceeds("ls D:/home/alice"))
+
+    def test_others_are_denied(self) -> None:
+        self.assertSucceeds("su bob")
+        self.assertDenied("cat D:/home/alice/diary.txt")
+        self.assertDenied("ls D:/home/alice")
+        self.assertDenied("write D:/home/alice/new.txt hello")
+        self.assertDenied("rm D:/home/alice/diary.txt")
+        self.assertDenied("mkdir D:/home/bob")
+        self.assertDenied("cp D:/home/alice/diary.txt D:/stolen.txt")
+        self.assertDenied("mv D:/home/alice D:/taken")
+        self.assertIsNone(self.main.mounted_drives["D"].find_file("home/bob"))
+        self.assertEqual(self.main.mounted_drives["D"].load_inode(self.main.mounted_drives["D"].find_file("home/alice/diary.txt")), "secret")
+
+    def test_moving_across_drives_needs_read(self) -> None:
+        self.assertSucceeds("su")
+        self.assertSucceeds("mkdrive -b 256 E")
+        self.assertSucceeds("mount -p E E")
+        self.assertSucceeds("write D:/secret.txt classified")
+        self.assertSucceeds("chmod 702 D:/secret.txt")
+        self.assertSucceeds("su user")
+        self.assertDenied("mv D:/secret.txt E:/m.txt")
+        self.assertIsNone(self.main.mounted_drives["E"].find_file("m.txt"))
+        self.assertIsNotNone(self.main.mounted_drives["D"].find_file("secret.txt"))
+
+    def test_root_passes_every_check(self) -> None:
+        self.assertSucceeds("su")
+        self.assertEqual(self.assertSucceeds("cat D:/home/alice/diary.txt").strip(), "secret")
+
+    def test_directories_need_execute_to_be_searched(self) -> None:
+        self.assertSucceeds("chmod 600 D:/home/alice")
+        self.assertDenied("cat D:/home/alice/diary.txt")
+        self.assertSucceeds("chmod 700 D:/home/alice")  # Still the owner's to change
+        self.assertSucceeds("cat D:/home/alice/diary.txt")
+
+    def test_creating_needs_write_on_the_directory(self) -> None:
+        self.assertSucceeds("chmod 500 D:/home/alice")
+        self.assertDenied("write D:/home/alice/new.txt hello")
+        self.assertDenied("rm D:/home/alice/diary.txt")
+        self.assertSucceeds("write D:/home/alice/diary.txt rewritten")  # The file itself is still writable
+
+    def test_group_permissions(self) -> None:
+        self.assertSucceeds("chmod 750 D:/home/alice")
+        self.assertSucceeds("chmod 640 D:/home/alice/diary.txt")
+        self.assertSucceeds("su bob -g alice")
+        self.assertEqual(self.assertSucceeds("cat D:/home/alice/diary.txt").strip(), "secret")
+        self.assertDenied("write D:/home/alice/diary.txt changed")
+        self.assertSucceeds("su bob")
+        self.assertDenied("cat D:/home/alice/diary.txt")
+
+    def test_chmod_invalidates_cached_decisions(self) -> None:
+        self.assertSucceeds("su bob")
+        self.assertDenied("cat D:/home/alice/diary.txt")
+        self.assertSucceeds("su alice -g alice")
+        self.assertSucceeds("chmod 755 D:/home/alice")
+        self.assertSucceeds("su bob")
+        self.assertSucceeds("cat D:/home/alice/diary.txt")
+        self.assertSucceeds("su alice -g alice")
+        self.assertSucceeds("chmod 700 D:/home/alice")
+        self.assertSucceeds("su bob")
+        self.assertDenied("cat D:/home/alice/diary.txt")
+
+    def test_rename_invalidates_cached_decisions(self) -> None:
+        self.assertSucceeds("su")
+        self.assertSucceeds("mkdir D:/public")
+        self.assertSucceeds("write D:/public/note.txt open")
+        self.assertSucceeds("su bob")
+        self.assertSucceeds("cat D:/public/note.txt")
+        self.assertSucceeds("su")
+        self.assertSucceeds("mv D:/home/alice D:/public")
+        self.assertSucceeds("mv D:/public/note.txt D:/public/alice/note.txt")
+        self.assertSucceeds("su bob")
+        self.assertDenied("cat D:/public/alice/note.txt")
+
+    def test_only_owners_change_permissions(self) -> None:
+        self.assertSucceeds("su bob")
+        self.assertFails("chmod 777 D:/home/alice", "Only the owner")
+        self.assertFails("chown bob D:/home", f"Only {SUPERUSER}")
+        self.assertSucceeds("su alice -g alice")
+        self.assertFails("chown alice D:/home", f"Only {SUPERUSER}")
+        self.assertFails("chmod 9x9 D:/home/alice", "Invalid mode")
+
+    def test_rm_r_needs_write_on_the_whole_subtree(self) -> None:
+        self.assertSucceeds("mkdir D:/home/alice/keep")
+        self.assertSucceeds("write D:/home/alice/keep/file.txt data")
+        self.assertSucceeds("chmod 500 D:/home/alice/keep")
+        self.assertDenied("rm -r D:/home/alice/keep")
+        self.assertIsNotNone(self.main.mounted_drives["D"].find_file("home/alice/keep/file.txt"))
+
+    def test_new_files_belong_to_the_session(self) -> None:
+        drive = self.main.mounted_drives["D"]
+        inode = drive.get_inode(drive.find_file("home/alice/diary.txt"))
+        self.assertEqual((inode["uid"], inode["gid"]), ("alice", "alice"))
+        self.assertSucceeds("su")
+        self.assertSucceeds("write D:/home/alice/diary.txt rewritten")
+        inode = drive.get_inode(drive.find_file("home/alice/diary.txt"))
+        self.assertEqual((inode["uid"], inode["gid"]), ("alice", "alice"))
+
+
+class AccessCheckerTest(unittest.TestCase):
+    def test_permission_strings(self) -> None:
+        self.assertEqual(permission_string([7, 5, 0]), "rwxr-x---")
+        self.assertEqual(parse_mode("644"), [6, 4, 4])
+        self.assertIsNone(parse_mode("8"))
+        self.assertIsNone(parse_mode("7777"))
+
+    def test_cache_is_bounded(self) -> None:
+        drive = Drive("C", 128, inode_count=64)
+        for n in range(1, 40):
+            drive.write_inode("", new_file(f"f{n}", uid="alice"), n)
+        checker = AccessChecker("bob", size=8)
+        for n in range(1, 40):
+            checker.bits(drive, n)
+        self.assertEqual(checker.stats()["entries"], 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import shutil
+import unittest
+from helpers import *
+
+
+class PoolReloadTest(ShellTestCase):
+    """Pools written, reloaded and run degraded on each of their members in turn."""
+    def remount(self) -> None:
+        self.assertSucceeds("unmount P")
+        self.assertSucceeds("mount -p P P")
+
+    def assertSurvivesEachFailure(self, members: int, files: dict[str, str]) -> None:
+        """Mount the saved pool with each member's image missing in turn and read every file back."""
+        self.assertSucceeds("unmount P")
+        for k in range(members):
+            image = os.path.join(SAVE_PATH, pool_member_file("P", k))
+            shutil.move(image, image + ".away")
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):  # "member k is missing"
+                    drive = load_drive("P.json")
+                self.assertIsNotNone(drive, f"pool didn't load without member {k}")
+                self.assertTrue(drive.block_list.degraded())
+                for name, content in files.items():
+                    index = drive.find_file(name)
+                    self.assertIsNotNone(index, f"{name} missing without member {k}")
+                    self.assertEqual(drive.load_inode(index), content)
+                self.assertRefcounts(drive)
+            finally:
+                shutil.move(image + ".away", image)
+
+    def check_level(self, level: str, members: int) -> None:
+        self.assertSucceeds(f"mkpool -l {level} -m {members} -b 128 -t none P")
+        self.assertSucceeds("mount -p P P")
+        self.remount()
+        files = {"a.txt": "a" * 100, "b.txt": "b" * 10}
+        for name, content in files.items():
+            self.assertSucceeds(f"write P:/{name} {content}")
+        self.remount()
+        self.assertSucceeds("rm P:/b.txt")
+        del files["b.txt"]
+        self.assertSucceeds(f"write P:/c.txt {'c' * 70}")
+        files["c.txt"] = "c" * 70
+        self.assertSurvivesEachFailure(members, files)
+
+    def test_raid1_after_reload(self) -> None:
+        self.check_level("raid1", 2)
+
+    def test_raid1_three_mirrors_after_reload(self) -> None:
+        self.check_level("raid1", 3)
+
+    def test_raid5_after_reload(self) -> None:
+        self.check_level("raid5", 3)
+
+    def check_rebuild(self, level: str, members: int) -> None:
+        self.assertSucceeds(f"mkpool -l {level} -m {members} -b 128 -t none P")
+        self.assertSucceeds("mount -p P P")
+        self.assertSucceeds(f"write P:/a.txt {'a' * 100}")
+        self.remount()
+        self.assertSucceeds("pool fail P 0")
+        self.assertSucceeds(f"write P:/b.txt {'b' * 100}")
+        self.remount()
+        self.assertTrue(self.main.mounted_drives["P"].block_list.degraded())
+        self.assertSucceeds(f"write P:/c.txt {'c' * 100}")
+        self.assertSucceeds("pool rebuild P 0")
+        self.assertFalse(self.main.mounted_drives["P"].block_list.degraded())
+        self.assertSucceeds(f"write P:/d.txt {'d' * 100}")
+        self.assertSurvivesEachFailure(members, {f"{c}.txt": c * 100 for c in "abcd"})
+
+    def test_raid1_degrade_and_rebuild_after_reload(self) -> None:
+        self.check_rebuild("raid1", 2)
+
+    def test_raid5_degrade_and_rebuild_after_reload(self) -> None:
+        self.check_rebuild("raid5", 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+import unittest
+from helpers import *
+
+
+def scanned_usage(drive: Drive, inode_index: int) -> list[int]:
+    """[inodes, blocks, bytes] under an inode, by walking the tree instead of reading the counters."""
+    inode = drive.get_inode(inode_index)
+    totals = Drive._inode_charge(inode)
+    if inode["file_type"].lower() == "directory":
+        for child in drive.list_directory(inode_index).values():
+            totals = [a + b for a, b in zip(totals, scanned_usage(drive, child))]
+    return totals
+
+
+class UsageCounterTest(ShellTestCase):
+    """The incremental usage counters behind du, df and quota."""
+    def setUp(self) -> None:
+        super().setUp()
+        self.assertSucceeds("mkdrive -b 256 D")
+        self.assertSucceeds("mount -p D D")
+        self.drive = self.main.mounted_drives["D"]
+        self.assertSucceeds("mkdir D:/a")
+        self.assertSucceeds("mkdir D:/a/b")
+        self.assertSucceeds("mkdir D:/c")
+        self.assertSucceeds(f"write D:/a/one.txt {'1' * 100}")
+        self.assertSucceeds(f"write D:/a/b/two.txt {'2' * 200}")
+        self.assertSucceeds(f"write D:/c/three.txt {'3' * 10}")
+
+    def assertCountersMatchScan(self) -> None:
+        for i, inode in self.drive.used_inodes():
+            if inode["file_type"].lower() == "directory":
+                usage = self.drive.disk_usage(i)
+                self.assertEqual([usage["inodes"], usage["blocks"], usage["bytes"]], scanned_usage(self.drive, i), self.drive.path_of(i))
+        owners = {}
+        for i, inode in self.drive.used_inodes():
+            owners.setdefault(inode["uid"], [0, 0, 0])
+            owners[inode["uid"]] = [a + b for a, b in zip(owners[inode["uid"]], Drive._inode_charge(inode))]
+        for uid, totals in owners.items():
+            quota = self.drive.quota(uid)
+            self.assertEqual([quota["inodes"], quota["blocks"], quota["bytes"]], totals, uid)
+        self.assertEqual(self.drive.space()["inodes_used"], len(list(self.drive.used_inodes())))
+
+    def test_after_writes(self) -> None:
+        self.assertCountersMatchScan()
+        self.assertIn("D:/a", self.assertSucceeds("du -s D:/a"))
+
+    def test_after_rm(self) -> None:
+        self.assertSucceeds("rm D:/a/one.txt")
+        self.assertCountersMatchScan()
+        self.assertSucceeds("rm -r D:/a")
+        self.assertCountersMatchScan()
+        self.assertEqual(self.drive.disk_usage(0)["blocks"], scanned_usage(self.drive, 0)[1])
+
+    def test_after_mv(self) -> None:
+        self.assertSucceeds("mv D:/a/b D:/c/b")
+        self.assertCountersMatchScan()
+        self.assertSucceeds("mv D:/c/three.txt D:/a/b3.txt")
+        self.assertCountersMatchScan()
+        self.assertSucceeds("mv D:/c D:/a/c")
+        self.assertCountersMatchScan()
+
+    def test_after_rewrite_cp_and_chown(self) -> None:
+        self.assertSucceeds(f"write D:/a/one.txt {'1' * 10}")
+        self.assertSucceeds("cp -r D:/a D:/copy")
+        self.assertSucceeds("su")
+        self.assertSucceeds("chown alice D:/copy/one.txt")
+        self.assertCountersMatchScan()
+
+    def test_after_rollback(self) -> None:
+        self.assertSucceeds("snapshot create D s")
+        self.assertSucceeds("rm -r D:/a")
+        self.assertSucceeds("snapshot rollback D s")
+        self.assertCountersMatchScan()
+
+
+class QuotaTest(ShellTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.assertSucceeds("mkdrive -b 256 D")
+        self.assertSucceeds("mount -p D D")
+        self.drive = self.main.mounted_drives["D"]
+
+    def test_block_quota_rejects_a_write(self) -> None:
+        self.assertSucceeds("quota D -u user -b 6")
+        self.assertSucceeds(f"write D:/a.txt {'a' * 3 * CHAR_BLOCK_SIZE}")
+        before = self.drive.quota("user")
+        self.assertFails(f"write D:/b.txt {'b' * 4 * CHAR_BLOCK_SIZE}", "quota of 6 data blocks")
+        self.assertIsNone(self.drive.find_file("b.txt"))
+        self.assertEqual(self.drive.quota("user"), before)
+        self.assertRefcounts(self.drive)
+        self.assertSucceeds(f"write D:/b.txt {'b' * 3 * CHAR_BLOCK_SIZE}")  # Exactly at the limit
+        self.assertEqual(self.drive.quota("user")["blocks"], 6)
+
+    def test_rejected_rewrite_keeps_the_old_content(self) -> None:
+        self.assertSucceeds("quota D -u user -b 4")
+        self.assertSucceeds(f"write D:/a.txt {'a' * 3 * CHAR_BLOCK_SIZE}")
+        self.assertFails(f"write D:/a.txt {'b' * 5 * CHAR_BLOCK_SIZE}", "quota")
+        self.assertEqual(self.assertSucceeds("cat D:/a.txt").strip(), "a" * 3 * CHAR_BLOCK_SIZE)
+        self.assertRefcounts(self.drive)
+
+    def test_rejected_cp_and_mv_keep_the_destination(self) -> None:
+        self.assertSucceeds("mkdrive -b 256 E")
+        self.assertSucceeds("mount -p E E")
+        self.assertSucceeds("quota D -u user -b 6")
+        self.assertSucceeds("quota E -u user -b 6")
+        self.assertSucceeds(f"write D:/keep.txt {'k' * 2 * CHAR_BLOCK_SIZE}")
+        self.assertSucceeds(f"write D:/big.txt {'b' * 4 * CHAR_BLOCK_SIZE}")
+        self.assertSucceeds(f"write E:/keep.txt {'k' * 2 * CHAR_BLOCK_SIZE}")
+        self.assertSucceeds(f"write E:/other.txt {'o' * 4 * CHAR_BLOCK_SIZE}")
+        before = self.drive.quota("user")
+        self.assertFails("cp D:/big.txt D:/keep.txt", "quota")
+        self.assertFails("mv D:/big.txt E:/keep.txt", "quota")
+        for letter in "DE":
+            self.assertEqual(self.assertSucceeds(f"cat {letter}:/keep.txt").strip(), "k" * 2 * CHAR_BLOCK_SIZE)
+            self.assertEqual(sorted(self.main.mounted_drives[letter].list_directory(0)), sorted(["big.txt" if letter == "D" else "other.txt", "keep.txt"]))
+            self.assertRefcounts(self.main.mounted_drives[letter])
+        self.assertEqual(self.drive.quota("user"), before)
+
+    def test_inode_quota(self) -> None:
+        self.assertSucceeds("quota D -u user -i 2")
+        self.assertSucceeds("write D:/a.txt a")
+        self.assertSucceeds("mkdir D:/d")
+        self.assertFails("write D:/b.txt b", "quota of 2 inodes")
+        self.assertFails("cp D:/a.txt D:/c.txt", "quota of 2 inodes")
+        self.assertSucceeds("write D:/a.txt rewritten")  # A rewrite adds no inode
+        self.assertSucceeds("rm D:/a.txt")
+        self.assertSucceeds("write D:/b.txt b")
+
+    def test_shrinking_is_allowed_over_the_limit(self) -> None:
+        self.assertSucceeds(f"write D:/a.txt {'a' * 6 * CHAR_BLOCK_SIZE}")
+        self.assertSucceeds("quota D -u user -b 2")
+        self.assertSucceeds(f"write D:/a.txt {'a' * 4 * CHAR_BLOCK_SIZE}")
+        self.assertFails(f"write D:/a.txt {'a' * 5 * CHAR_BLOCK_SIZE}", "quota")
+
+    def test_fallocate_and_chown_respect_quotas(self) -> None:
+        self.assertSucceeds("quota D -u user -b 4")
+        self.assertFails("fallocate -l 8 D:/big.bin", "quota")
+        self.assertIsNone(self.drive.find_file("big.bin"))
+        self.assertSucceeds("su")
+        self.assertSucceeds(f"write D:/root.txt {'r' * 6 * CHAR_BLOCK_SIZE}")
+        self.assertFails("chown user D:/root.txt", "quota")
+        self.assertEqual(self.drive.get_inode(self.drive.find_file("root.txt"))["uid"], "root")
+
+    def test_quotas_are_saved(self) -> None:
+        self.assertSucceeds("quota D -u user -b 4 -i 3")
+        self.assertSucceeds("unmount D")
+        self.assertSucceeds("mount -p D D")
+        quota = self.main.mounted_drives["D"].quota("user")
+        self.assertEqual((quota["block_limit"], quota["inode_limit"]), (4, 3))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import random
+import unittest
+from helpers import *
+
+
+class SnapshotRefcountTest(DriveTestCase):
+    """Data blocks shared between the live drive and its snapshots."""
+    def setUp(self) -> None:
+        super().setUp()
+        self.drive = Drive("S", 256)
+        self.free = self.free_blocks()
+        self.drive.write_inode("a" * 100, new_file("a.txt"), 1)
+        self.drive.write_inode("b" * 100, new_file("b.txt"), 2)
+
+    def free_blocks(self) -> int:
+        usage = self.drive.usage()
+        return usage["blocks_total"] - usage["blocks_used"]
+
+    def test_snapshot_shares_blocks(self) -> None:
+        used = self.free - self.free_blocks()
+        self.assertTrue(self.drive.create_snapshot("s"))
+        self.assertFalse(self.drive.create_snapshot("s"))
+        self.assertEqual(self.free - self.free_blocks(), used)
+        self.assertEqual(max(stored_refcounts(self.drive).values()), 2)
+        self.assertRefcounts(self.drive)
+
+    def test_rewrite_and_delete_keep_snapshot_blocks(self) -> None:
+        self.drive.create_snapshot("s")
+        self.drive.write_inode("c" * 100, new_file("a.txt"), 1)
+        self.drive.delete_inode(2)
+        self.assertRefcounts(self.drive)
+        self.assertTrue(self.drive.rollback_snapshot("s"))
+        self.assertEqual(self.drive.load_inode(1), "a" * 100)
+        self.assertEqual(self.drive.load_inode(2), "b" * 100)
+        self.assertRefcounts(self.drive)
+
+    def test_deleting_everything_frees_every_block(self) -> None:
+        self.drive.create_snapshot("s")
+        self.drive.write_inode("c" * 300, new_file("a.txt"), 1)
+        self.drive.create_snapshot("t")
+        for index in (1, 2):
+            self.drive.delete_inode(index)
+        self.assertLess(self.free_blocks(), self.free)
+        self.assertTrue(self.drive.delete_snapshot("s"))
+        self.assertTrue(self.drive.delete_snapshot("t"))
+        self.assertFalse(self.drive.delete_snapshot("t"))
+        self.assertEqual(self.free_blocks(), self.free)
+        self.assertRefcounts(self.drive)
+
+    def test_clone_is_independent(self) -> None:
+        self.drive.create_snapshot("s")
+        self.drive.write_inode("c" * 100, new_file("a.txt"), 1)
+        clone = self.drive.clone("C", "s")
+        self.assertEqual(clone.load_inode(1), "a" * 100)
+        clone.write_inode("d" * 100, new_file("a.txt"), 1)
+        self.assertEqual(self.drive.load_inode(1), "c" * 100)
+        self.assertEqual(clone.load_inode(1), "d" * 100)
+        self.assertRefcounts(self.drive)
+        self.assertRefcounts(clone)
+
+    def test_refcounts_survive_save_and_load(self) -> None:
+        self.drive.create_snapshot("s")
+        self.drive.write_inode("c" * 100, new_file("a.txt"), 1)
+        self.assertTrue(save_drive(self.drive, "S.json"))
+        loaded = load_drive("S.json")
+        self.assertEqual(stored_refcounts(loaded), stored_refcounts(self.drive))
+        self.assertRefcounts(loaded)
+        loaded.rollback_snapshot("s")
+        self.assertEqual(loaded.load_inode(1), "a" * 100)
+
+
+class RefcountFuzzTest(DriveTestCase):
+    """Random writes, copies, deletes, snapshots and rollbacks never leave a reference count wrong."""
+    def fuzz(self, seed: int, **options) -> None:
+        rng = random.Random(seed)
+        drive = Drive("Z", 512, inode_count=64, **options)
+        contents = {}  # Live inode -> content
+        for step in range(300):
+            op = rng.random()
+            if op < 0.35 or not contents:
+                index = rng.choice(list(contents)) if contents and rng.random() < 0.5 else drive.find_free_inode(0)
+                if index is None:
+                    continue
+                data = rng.choice("xyz") * rng.randrange(0, 200)
+                if drive.write_inode(data, new_file(f"f{index}"), index):
+                    contents[index] = data
+            elif op < 0.5:
+                index = rng.choice(list(contents))
+                copy = drive.copy_tree(index, drive, 0, f"c{step}")
+                if copy is not None:
+                    contents[copy] = contents[index]
+            elif op < 0.65:
+                index = rng.choice(list(contents))
+                drive.delete_inode(index)
+                del contents[index]
+            elif op < 0.75:
+                drive.create_snapshot(f"s{step}")
+            elif op < 0.85 and drive.snapshots:
+                drive.delete_snapshot(rng.choice(list(drive.snapshots)))
+            elif drive.snapshots:
+                name = rng.choice(list(drive.snapshots))
+                drive.rollback_snapshot(name)
+                contents = {int(i): drive.load_inode(int(i)) for i, inode in drive.snapshots[name]["inodes"].items() if int(i) != 0}
+            self.assertRefcounts(drive)
+            for index, data in contents.items():
+                self.assertEqual(drive.load_inode(index), data)
+        for name in list(drive.snapshots):
+            drive.delete_snapshot(name)
+        for index in contents:
+            drive.delete_inode(index)
+        self.assertEqual(stored_refcounts(drive), Counter())
+
+    def test_plain(self) -> None:
+        self.fuzz(1)
+
+    def test_dedup(self) -> None:
+        self.fuzz(2, dedup=True)
+
+    def test_delalloc(self) -> None:
+        self.fuzz(3, delalloc=True)
+
+    def test_compressed(self) -> None:
+        self.fuzz(4, compression="zlib", inline_data=False)
+
+
+if __name__ == "__main__":
+    unittest.main()